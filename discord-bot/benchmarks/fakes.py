@@ -0,0 +1,100 @@
+"""Stand-ins for the radio and discord, so MeshClient can run without either."""
+import itertools
+import threading
+import time
+from types import SimpleNamespace
+
+
+class FakeInterface():
+    '''Just enough of meshtastic.mesh_interface.MeshInterface for MeshClient.
+
+    Sent packets get incrementing ids, which are kept in `sent` so the packet mix can ACK them.
+    '''
+
+    def __init__(self, my_node, nodes, modem_preset=0):
+        self.nodesByNum = {node['num']: node for node in nodes}
+        self.nodesByNum[my_node['num']] = my_node
+        self.nodes = {node['user']['id']: node for node in self.nodesByNum.values() if 'user' in node}
+        self._my_node = my_node
+
+        self.isConnected = threading.Event()
+        self.isConnected.set()
+
+        self.localNode = SimpleNamespace(localConfig=SimpleNamespace(
+            device=SimpleNamespace(role=0, node_info_broadcast_secs=10800),
+            lora=SimpleNamespace(modem_preset=modem_preset, tx_power=30),
+        ))
+
+        self._packet_ids = itertools.count(0x10000000)
+        self.sent = []
+        self._sent_lock = threading.Lock()
+
+    def getMyNodeInfo(self):
+        return self._my_node
+
+    def _sent_packet(self, to, channel=0):
+        packet = SimpleNamespace(id=next(self._packet_ids), to=to, channel=channel, hop_limit=3)
+        with self._sent_lock:
+            self.sent.append(packet)
+        return packet
+
+    def sendText(self, text, destinationId=0xFFFFFFFF, channelIndex=0, wantAck=False, wantResponse=False, onResponse=None):
+        return self._sent_packet(destinationId, channelIndex)
+
+    def sendTelemetry(self, destinationId=0xFFFFFFFF, wantResponse=False, channelIndex=0):
+        return self._sent_packet(destinationId, channelIndex)
+
+    def sendTraceRoute(self, dest, hopLimit=3, channelIndex=0):
+        return self._sent_packet(dest, channelIndex)
+
+    def sendHeartbeat(self):
+        pass
+
+    def close(self):
+        self.isConnected.clear()
+
+
+class StubDiscordClient():
+    '''Replaces discord_client.DiscordBot. Every enqueue_* call is just counted.'''
+
+    def __init__(self, user_id=1234567890):
+        self.user = SimpleNamespace(id=user_id, display_name='benchmark')
+        self.dis_channel_id = 1
+        self.calls = {}
+        self._lock = threading.Lock()
+
+    def __getattr__(self, name):
+        if not name.startswith('enqueue_'):
+            raise AttributeError(name)
+
+        def _count(*args, **kwargs):
+            with self._lock:
+                self.calls[name] = self.calls.get(name, 0) + 1
+        return _count
+
+
+class TimedLock():
+    '''threading.Lock that records how long each acquire waited.'''
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.waits = []
+
+    def acquire(self, blocking=True, timeout=-1):
+        tic = time.perf_counter()
+        acquired = self._lock.acquire(blocking, timeout)
+        self.waits.append(time.perf_counter() - tic)
+        return acquired
+
+    def release(self):
+        self._lock.release()
+
+    def locked(self):
+        return self._lock.locked()
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
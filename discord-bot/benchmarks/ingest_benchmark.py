@@ -0,0 +1,277 @@
+"""Synthetic ingest benchmark: pushes a generated packet mix through MeshClient.onReceiveMesh.
+
+Uses a fake radio interface and a stub discord client, with the real DB code (RXPacketWriter, node
+activity summary, ACK matching) against a temporary SQLite file or a local Postgres database.
+
+Usage (from the discord-bot directory):
+    python benchmarks/ingest_benchmark.py --rate 50 --duration 30
+    python benchmarks/ingest_benchmark.py --rate 0 --count 20000          # as fast as possible
+    python benchmarks/ingest_benchmark.py --postgres postgresql+psycopg2://user:pw@localhost/meshbot_bench
+
+Postgres: use a scratch database, the bot's tables are created in it and the rows are not cleaned up.
+"""
+import argparse
+import json
+import logging
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'bot'))
+
+from sqlalchemy import func, select, text
+from sqlalchemy.engine import make_url
+
+import db_base
+from config_classes import Config
+from database_client import RXPacketWriter
+from db_classes import RXPacket, ACK
+from mesh_client import MeshClient
+from util import DiscordInteractionInfo
+
+from fakes import FakeInterface, StubDiscordClient, TimedLock
+from packet_mix import DEFAULT_MIX, PacketMix, make_nodes
+
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(pct / 100 * (len(values) - 1))))]
+
+
+def database_info(args, tmp_dir):
+    if args.postgres:
+        url = make_url(args.postgres)
+        d = {
+            'type': 'postgres',
+            'host': url.host,
+            'port': url.port or 5432,
+            'username': url.username,
+            'password': url.password,
+            'db_name': url.database,
+        }
+    else:
+        d = {'type': 'sqlite', 'db_dir': tmp_dir, 'db_name': 'bench.db'}
+    d.update({'rx_flush_interval': args.flush_interval, 'rx_batch_size': args.batch_size})
+    return d
+
+
+def db_size(engine, db_info, tmp_dir):
+    """Bytes used by the database (sqlite: db file + WAL)."""
+    if db_info.db_type == 'sqlite':
+        path = os.path.join(tmp_dir, db_info.db_name)
+        return sum(os.path.getsize(p) for p in (path, path + '-wal') if os.path.exists(p))
+    with engine.connect() as conn:
+        return conn.execute(text('SELECT pg_database_size(current_database())')).scalar()
+
+
+def parse_mix(mix_str):
+    mix = dict(DEFAULT_MIX)
+    if mix_str:
+        for item in mix_str.split(','):
+            kind, weight = item.split('=')
+            if kind not in DEFAULT_MIX:
+                raise ValueError(f'Unknown packet kind: {kind}. Options: {list(DEFAULT_MIX)}')
+            mix[kind] = float(weight)
+    return mix
+
+
+class TXLoad():
+    '''Sends channel messages and DMs at tx_rate/s through MeshClient.process_queue_message, so ACKs
+    have something to match and TX commits compete with RX for the DB.'''
+
+    def __init__(self, mesh_client, nodes, tx_rate, seed=0):
+        self._mesh_client = mesh_client
+        self._nodes = [node for node in nodes if 'user' in node]
+        self._interval = 1 / tx_rate if tx_rate else None
+        self._rng = random.Random(seed)
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='bench-tx', daemon=True)
+        self.latencies = []
+
+    def start(self):
+        if self._interval:
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread.is_alive():
+            self._thread.join()
+
+    def _run(self):
+        msg_id = 0
+        while not self._stop.wait(self._interval):
+            msg_id += 1
+            dii = DiscordInteractionInfo(1, 1, msg_id, user_id=1, user_display_name='bench')
+            if self._rng.random() < 0.5:
+                msg = {'msg_type': 'send_channel', 'channel': 0, 'message': 'benchmark', 'discord_interaction_info': dii}
+            else:
+                node_id = self._rng.choice(self._nodes)['user']['id']
+                msg = {'msg_type': 'send_dm', 'node_ref': self._mesh_client.resolve_node(node_id), 'message': 'benchmark', 'discord_interaction_info': dii}
+            tic = time.perf_counter()
+            self._mesh_client.process_queue_message(msg)
+            self.latencies.append(time.perf_counter() - tic)
+
+
+def run(args):
+    tmp_dir = tempfile.mkdtemp(prefix='meshbot-bench-')
+    rng = random.Random(args.seed)
+    my_num = rng.randrange(0x10000000, 0xFFFFFFF0)
+    my_node = {
+        'num': my_num,
+        'user': {'id': f'!{my_num:08x}', 'longName': 'Benchmark Bot', 'shortName': 'BNCH', 'hwModel': 'TBEAM'},
+        'deviceMetrics': {'batteryLevel': 100, 'voltage': 4.1},
+    }
+    nodes = make_nodes(args.nodes, seed=args.seed)
+
+    config = Config.from_dict({
+        'channel_names': {0: 'Bench0', 1: 'Bench1', 2: 'Bench2'},
+        'database_info': database_info(args, tmp_dir),
+    })
+    db_info = config.database_info
+    engine = db_base.create_db_engine(db_info)
+    db_base.Base.metadata.create_all(engine)
+    db_base.Session.configure(bind=engine)
+    size_before = db_size(engine, db_info, tmp_dir)
+
+    rx_writer = RXPacketWriter(engine, flush_interval=db_info.rx_flush_interval, batch_size=db_info.rx_batch_size)
+    rx_writer.start()
+
+    mesh_client = MeshClient(config=config, rx_writer=rx_writer)
+    mesh_client._db_lock = TimedLock()
+    discord_client = StubDiscordClient()
+    mesh_client.link_discord(discord_client)
+    iface = FakeInterface(my_node, nodes)
+    mesh_client.iface = iface
+    mesh_client.onConnectionMesh(iface)
+
+    packets = PacketMix(my_node, nodes, mix=parse_mix(args.mix), seed=args.seed, sent_packets=iface.sent)
+    tx_load = TXLoad(mesh_client, nodes, args.tx_rate, seed=args.seed)
+
+    # the measurement: one thread calling onReceiveMesh, like meshtastic's publishing thread
+    latencies = {}
+    max_queue_depth = 0
+    behind = 0
+    count = args.count or (int(args.rate * args.duration) if args.rate else None)
+    deadline = None if count else time.perf_counter() + args.duration
+
+    logging.info(f'Benchmark starting: rate={args.rate or "max"}/s count={count} duration={args.duration}s db={db_info.db_type}')
+    tx_load.start()
+    start = time.perf_counter()
+    for i, (kind, packet) in enumerate(packets):
+        if count is not None and i >= count:
+            break
+        if deadline is not None and time.perf_counter() >= deadline:
+            break
+        if args.rate:
+            due = start + i / args.rate
+            delay = due - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            elif delay < -0.1:
+                behind += 1
+
+        tic = time.perf_counter()
+        mesh_client.onReceiveMesh(packet, iface)
+        latencies.setdefault(kind, []).append(time.perf_counter() - tic)
+
+        if i % 100 == 0:
+            max_queue_depth = max(max_queue_depth, rx_writer.queue_depth)
+
+    ingest_elapsed = time.perf_counter() - start
+    tx_load.stop()
+
+    # everything queued has to be written before the numbers mean anything
+    tic = time.perf_counter()
+    rx_writer.stop(timeout=600)
+    drain_elapsed = time.perf_counter() - tic
+    size_after = db_size(engine, db_info, tmp_dir)
+
+    with engine.connect() as conn:
+        rx_rows = conn.execute(select(func.count()).select_from(RXPacket).where(RXPacket.publisher_mesh_node_num == str(my_num))).scalar()
+        ack_rows = conn.execute(select(func.count()).select_from(ACK).where(ACK.publisher_mesh_node_num == str(my_num))).scalar()
+
+    all_latencies = [x for values in latencies.values() for x in values]
+    total = len(all_latencies)
+    lock_waits = {'db_lock': mesh_client._db_lock.waits}
+
+    return {
+        'db_type': db_info.db_type,
+        'packets': total,
+        'target_rate': args.rate or None,
+        'ingest_seconds': ingest_elapsed,
+        'ingest_rate': total / ingest_elapsed if ingest_elapsed else 0,
+        'drain_seconds': drain_elapsed,
+        'sustained_rate': total / (ingest_elapsed + drain_elapsed),
+        'packets_behind_schedule': behind,
+        'max_writer_queue_depth': max_queue_depth,
+        'latency_ms': {
+            kind: {'count': len(values), 'p50': percentile(values, 50) * 1000, 'p99': percentile(values, 99) * 1000, 'max': max(values) * 1000}
+            for kind, values in sorted(latencies.items()) + [('all', all_latencies)] if values
+        },
+        'lock_wait_ms': {
+            name: {'count': len(waits), 'total': sum(waits) * 1000, 'p99': percentile(waits, 99) * 1000, 'max': max(waits, default=0) * 1000}
+            for name, waits in lock_waits.items()
+        },
+        'tx_sent': len(iface.sent),
+        'tx_p50_ms': percentile(tx_load.latencies, 50) * 1000,
+        'rx_rows': rx_rows,
+        'ack_rows': ack_rows,
+        'db_bytes_before': size_before,
+        'db_bytes_after': size_after,
+        'db_bytes_per_packet': (size_after - size_before) / rx_rows if rx_rows else 0,
+        'discord_calls': discord_client.calls,
+        'handler_stats': {portnum: {'count': stats.count, 'errors': stats.errors, 'avg_ms': stats.avg_ms} for portnum, stats in mesh_client.portnum_handlers.stats().items()},
+    }
+
+
+def print_report(r):
+    print()
+    print(f"Database:              {r['db_type']}")
+    print(f"Packets:               {r['packets']} ({r['rx_rows']} rows written, {r['ack_rows']} ACKs, {r['tx_sent']} TX)")
+    print(f"Ingest:                {r['ingest_rate']:.0f} pkt/s over {r['ingest_seconds']:.1f}s (target: {r['target_rate'] or 'max'}, {r['packets_behind_schedule']} packets >100ms late)")
+    print(f"Writer drain:          {r['drain_seconds']:.2f}s (max queue depth {r['max_writer_queue_depth']})")
+    print(f"Sustained (ingest+db): {r['sustained_rate']:.0f} pkt/s")
+    print(f"DB growth:             {(r['db_bytes_after'] - r['db_bytes_before']) / 1e6:.2f} MB ({r['db_bytes_per_packet']:.0f} bytes/packet)")
+    print()
+    print(f"{'onReceiveMesh latency':<22} {'count':>8} {'p50 ms':>9} {'p99 ms':>9} {'max ms':>9}")
+    for kind, lat in r['latency_ms'].items():
+        print(f"{kind:<22} {lat['count']:>8} {lat['p50']:>9.3f} {lat['p99']:>9.3f} {lat['max']:>9.2f}")
+    print()
+    print(f"{'lock wait':<22} {'acquires':>8} {'total ms':>9} {'p99 ms':>9} {'max ms':>9}")
+    for name, wait in r['lock_wait_ms'].items():
+        print(f"{name:<22} {wait['count']:>8} {wait['total']:>9.1f} {wait['p99']:>9.3f} {wait['max']:>9.2f}")
+    print()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='MeshBot ingest benchmark')
+    parser.add_argument('--rate', type=float, default=50, help='Packets per second to generate, 0 for as fast as possible (default: 50)')
+    parser.add_argument('--duration', type=float, default=30, help='Seconds to run, if --count is not given (default: 30)')
+    parser.add_argument('--count', type=int, help='Number of packets to generate')
+    parser.add_argument('--nodes', type=int, default=300, help='Nodes in the fake mesh (default: 300)')
+    parser.add_argument('--tx-rate', type=float, default=0.5, help='Messages per second sent by the bot, 0 to disable (default: 0.5)')
+    parser.add_argument('--mix', help=f'Packet mix weights, e.g. text=10,telemetry=20. Defaults: {DEFAULT_MIX}')
+    parser.add_argument('--flush-interval', type=float, default=1.0, help='RXPacketWriter flush interval (default: 1.0)')
+    parser.add_argument('--batch-size', type=int, default=100, help='RXPacketWriter batch size (default: 100)')
+    parser.add_argument('--postgres', metavar='URL', help='Run against this Postgres database instead of a temporary SQLite file')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--json', metavar='FILE', help='Also write the results to this file')
+    parser.add_argument('--verbose', action='store_true', help="Show the bot's logging")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO if args.verbose else logging.WARNING, format="%(asctime)s [%(levelname)s] %(message)s")
+
+    results = run(args)
+    print_report(results)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
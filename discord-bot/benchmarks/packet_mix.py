@@ -0,0 +1,164 @@
+"""Generates received packets in the same dict format meshtastic publishes on meshtastic.receive."""
+import itertools
+import random
+import time
+
+from meshtastic.protobuf import mesh_pb2, portnums_pb2, telemetry_pb2
+
+from packet_record import to_packet_dict
+
+
+# relative weights, roughly what a busy regional mesh looks like
+DEFAULT_MIX = {
+    'text': 5,
+    'telemetry': 30,
+    'position': 25,
+    'nodeinfo': 15,
+    'routing': 10,
+    'traceroute': 2,
+    'neighborinfo': 5,
+    'encrypted': 8,
+}
+
+BROADCAST_NUM = 0xFFFFFFFF
+
+WORDS = ['hello', 'mesh', 'test', 'anyone', 'copy', 'signal', 'good', 'morning', 'relay', 'check', 'radio', 'node']
+
+
+def make_nodes(count, seed=0):
+    """Node dicts like iface.nodesByNum. Some nodes have no user info yet, like on a real device."""
+    rng = random.Random(seed)
+    nodes = []
+    for i in range(count):
+        num = rng.randrange(0x10000000, 0xFFFFFFF0)
+        node = {'num': num, 'lastHeard': int(time.time()) - rng.randrange(0, 86400)}
+        if rng.random() < 0.9:
+            node['user'] = {
+                'id': f'!{num:08x}',
+                'longName': f'Bench Node {i}',
+                'shortName': f'B{i:03d}'[-4:],
+                'hwModel': rng.choice(['TBEAM', 'HELTEC_V3', 'RAK4631', 'T_ECHO']),
+            }
+        nodes.append(node)
+    return nodes
+
+
+class PacketMix():
+    '''Random packets from `nodes`, heard by `my_node`, with port types weighted by `mix`.
+
+    Routing packets ACK packets sent through the fake interface (see fakes.FakeInterface.sent) when
+    there are any, so ACK matching is exercised too.
+    '''
+
+    def __init__(self, my_node, nodes, mix=None, channels=3, seed=0, sent_packets=None):
+        self._rng = random.Random(seed)
+        self._my_num = my_node['num']
+        self._nodes = nodes
+        self._channels = channels
+        self._sent_packets = sent_packets if sent_packets is not None else []
+        self._acked = 0
+
+        mix = mix or DEFAULT_MIX
+        self._kinds = list(mix)
+        self._weights = [mix[kind] for kind in self._kinds]
+        self._packet_ids = itertools.count(self._rng.randrange(1, 0x7FFFFFFF))
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        kind = self._rng.choices(self._kinds, self._weights)[0]
+        return kind, to_packet_dict(getattr(self, f'_{kind}')())
+
+    def _base(self, src_num=None, dst_num=BROADCAST_NUM):
+        rng = self._rng
+        pkt = mesh_pb2.MeshPacket()
+        setattr(pkt, 'from', src_num if src_num is not None else rng.choice(self._nodes)['num'])
+        pkt.to = dst_num
+        pkt.id = next(self._packet_ids) & 0xFFFFFFFF
+        pkt.channel = rng.randrange(self._channels) if dst_num == BROADCAST_NUM else 0
+        pkt.rx_time = int(time.time())
+        pkt.rx_snr = round(rng.uniform(-20, 10), 2)
+        pkt.rx_rssi = rng.randrange(-130, -40)
+        pkt.hop_start = 3
+        pkt.hop_limit = rng.randrange(0, 4)
+        return pkt
+
+    def _decoded(self, pkt, portnum, payload):
+        pkt.decoded.portnum = portnum
+        pkt.decoded.payload = payload
+        return pkt
+
+    def _text(self):
+        rng = self._rng
+        dst = self._my_num if rng.random() < 0.2 else BROADCAST_NUM
+        text = ' '.join(rng.choices(WORDS, k=rng.randrange(1, 25)))
+        return self._decoded(self._base(dst_num=dst), portnums_pb2.TEXT_MESSAGE_APP, text.encode('utf-8'))
+
+    def _telemetry(self):
+        rng = self._rng
+        telemetry = telemetry_pb2.Telemetry(time=int(time.time()))
+        if rng.random() < 0.7:
+            telemetry.device_metrics.battery_level = rng.randrange(0, 101)
+            telemetry.device_metrics.voltage = rng.uniform(3.3, 4.2)
+            telemetry.device_metrics.channel_utilization = rng.uniform(0, 40)
+            telemetry.device_metrics.air_util_tx = rng.uniform(0, 10)
+            telemetry.device_metrics.uptime_seconds = rng.randrange(0, 10**7)
+        else:
+            telemetry.environment_metrics.temperature = rng.uniform(-10, 40)
+            telemetry.environment_metrics.relative_humidity = rng.uniform(5, 100)
+            telemetry.environment_metrics.barometric_pressure = rng.uniform(950, 1050)
+        return self._decoded(self._base(), portnums_pb2.TELEMETRY_APP, telemetry.SerializeToString())
+
+    def _position(self):
+        rng = self._rng
+        position = mesh_pb2.Position(
+            latitude_i=int(rng.uniform(38, 42) * 1e7),
+            longitude_i=int(rng.uniform(-78, -72) * 1e7),
+            altitude=rng.randrange(0, 1500),
+            time=int(time.time()),
+            precision_bits=rng.choice([13, 16, 32]),
+            sats_in_view=rng.randrange(0, 20),
+        )
+        return self._decoded(self._base(), portnums_pb2.POSITION_APP, position.SerializeToString())
+
+    def _nodeinfo(self):
+        node = self._rng.choice(self._nodes)
+        user = node.get('user') or {'id': f'!{node["num"]:08x}', 'longName': f'New Node {node["num"]}', 'shortName': f'{node["num"] % 10000:04d}'}
+        user_pb = mesh_pb2.User(id=user['id'], long_name=user['longName'], short_name=user['shortName'])
+        return self._decoded(self._base(src_num=node['num']), portnums_pb2.NODEINFO_APP, user_pb.SerializeToString())
+
+    def _routing(self):
+        rng = self._rng
+        sent = self._sent_packets[self._acked] if self._acked < len(self._sent_packets) else None
+        if sent is not None:
+            self._acked += 1
+            # explicit ACK from the destination, or implicit (our own node heard it relayed)
+            src = sent.to if sent.to != BROADCAST_NUM and rng.random() < 0.5 else self._my_num
+            pkt = self._base(src_num=src, dst_num=self._my_num)
+            pkt.priority = mesh_pb2.MeshPacket.Priority.ACK
+            pkt.decoded.request_id = sent.id
+        else:
+            pkt = self._base(dst_num=rng.choice(self._nodes)['num'])
+        routing = mesh_pb2.Routing(error_reason=mesh_pb2.Routing.Error.NONE)
+        return self._decoded(pkt, portnums_pb2.ROUTING_APP, routing.SerializeToString())
+
+    def _traceroute(self):
+        rng = self._rng
+        route = mesh_pb2.RouteDiscovery(route=[rng.choice(self._nodes)['num'] for _ in range(rng.randrange(0, 4))])
+        return self._decoded(self._base(dst_num=self._my_num), portnums_pb2.TRACEROUTE_APP, route.SerializeToString())
+
+    def _neighborinfo(self):
+        # a port the bot has no handler for
+        rng = self._rng
+        src = rng.choice(self._nodes)['num']
+        info = mesh_pb2.NeighborInfo(node_id=src, node_broadcast_interval_secs=900)
+        for _ in range(rng.randrange(1, 6)):
+            info.neighbors.add(node_id=rng.choice(self._nodes)['num'], snr=rng.uniform(-20, 10))
+        return self._decoded(self._base(src_num=src), portnums_pb2.NEIGHBORINFO_APP, info.SerializeToString())
+
+    def _encrypted(self):
+        # a packet for a channel we don't have the key for
+        pkt = self._base()
+        pkt.encrypted = self._rng.randbytes(self._rng.randrange(16, 200))
+        return pkt
@@ -0,0 +1,219 @@
+"""Parse microbenchmark: per-packet cost of turning a received packet into rx_packets rows.
+
+Compares the RXPacket.from_dict path the portnum handlers used before PacketRecord (kept below as
+legacy_packet) with PacketRecord, for each packet type in the mix:
+    parse: work on the mesh receive thread (an RXPacket before, a PacketRecord now)
+    rows:  turning that into the Core insert rows, on the RXPacketWriter thread
+It also checks that both produce the same rows.
+
+Usage (from the discord-bot directory):
+    python benchmarks/parse_benchmark.py
+    python benchmarks/parse_benchmark.py --count 20000 --repeat 5
+"""
+import argparse
+import datetime
+import logging
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'bot'))
+
+import db_base
+from config_classes import Config
+from db_classes import RXPacket
+from mesh_client import MeshClient
+
+from fakes import FakeInterface, StubDiscordClient
+from packet_mix import PacketMix, make_nodes
+
+
+def legacy_common_fields(d, mesh_client):
+    """RXPacket.common_fields, as it was before PacketRecord."""
+    src_num = d.get('from')
+    dst_num = d.get('to')
+
+    try:
+        src_id = '!' + hex(src_num)[2:]
+        src_short_name = mesh_client.get_short_name(src_id)
+        src_long_name = mesh_client.get_long_name(src_id)
+    except:
+        src_id = None
+        src_short_name = None
+        src_long_name = None
+
+    try:
+        dst_id = '!' + hex(dst_num)[2:]
+        dst_short_name = mesh_client.get_short_name(dst_id)
+        dst_long_name = mesh_client.get_long_name(dst_id)
+    except:
+        dst_id = None
+        dst_short_name = None
+        dst_long_name = None
+
+    return {
+        'pkt_id': d.get('id'),
+        'publisher_mesh_node_num': mesh_client.my_node_info.node_num,
+        'publisher_discord_bot_user_id': mesh_client.discord_client.user.id,
+        'channel': d.get('channel'),
+        'src_num': src_num,
+        'src_id': src_id,
+        'src_short_name': src_short_name,
+        'src_long_name': src_long_name,
+        'dst_num': dst_num,
+        'dst_id': dst_id,
+        'dst_short_name': dst_short_name,
+        'dst_long_name': dst_long_name,
+        'hop_limit': d.get('hopLimit'),
+        'hop_start': d.get('hopStart'),
+        'pki_encrypted': d.get('pkiEncrypted'),
+        'portnum': d.get('decoded', {}).get('portnum'),
+        'priority': d.get('priority'),
+        'rx_time': d.get('rxTime'),
+        'rx_rssi': d.get('rxRssi'),
+        'rx_snr': d.get('rxSnr'),
+        'to_all': dst_id == '!ffffffff',
+        'want_ack': d.get('wantAck'),
+        'ts': datetime.datetime.now(datetime.timezone.utc),
+    }
+
+
+def legacy_packet(packet, mesh_client):
+    """What a portnum handler built before: an RXPacket with ORM side table objects, or for packets
+    without a handler, the insert row dict (RXPacket.insert_row_from_dict)."""
+    handler = mesh_client.portnum_handlers.get(packet.get('decoded', {}).get('portnum'))
+    if handler is None:
+        row = dict.fromkeys(RXPacket.insert_columns)
+        row.update(legacy_common_fields(packet, mesh_client))
+        return row
+    fields = legacy_common_fields(packet, mesh_client)
+    for key, value in handler.parse(packet.get('decoded', {})).items():
+        detail = RXPacket.detail_classes.get(key)
+        fields[key] = detail.from_dict(value) if detail is not None else value
+    return RXPacket(**fields)
+
+
+def legacy_rows(pkt):
+    if isinstance(pkt, dict):
+        return pkt, []
+    return pkt.to_insert_row(), pkt.detail_rows()
+
+
+def record_packet(packet, mesh_client):
+    return mesh_client.portnum_handlers.build_record(mesh_client, packet)
+
+
+def record_rows(record):
+    return record.to_insert_row(), record.detail_rows()
+
+
+def time_per_packet(fn, items, repeat):
+    """Best of repeat runs, in microseconds per item."""
+    best = None
+    for _ in range(repeat):
+        tic = time.perf_counter()
+        for item in items:
+            fn(item)
+        elapsed = time.perf_counter() - tic
+        best = elapsed if best is None else min(best, elapsed)
+    return best * 1e6 / len(items)
+
+
+def compare_rows(legacy, record):
+    """Returns the columns that differ (ts is ignored, it's the parse time)."""
+    legacy_row, legacy_details = legacy
+    row, details = record
+    diff = [key for key in RXPacket.insert_columns if key != 'ts' and legacy_row.get(key) != row.get(key)]
+    # packet_id is only known once the packet is written
+    without_id = lambda rows: sorted(((table.__tablename__, {k: v for k, v in r.items() if k != 'packet_id'}) for table, r in rows), key=lambda x: x[0])
+    if without_id(legacy_details) != without_id(details):
+        diff.append('details')
+    return diff
+
+
+def make_mesh_client(nodes, my_node, tmp_dir):
+    config = Config.from_dict({
+        'channel_names': {0: 'Bench0', 1: 'Bench1', 2: 'Bench2'},
+        'database_info': {'type': 'sqlite', 'db_dir': tmp_dir, 'db_name': 'bench.db'},
+    })
+    engine = db_base.create_db_engine(config.database_info)
+    db_base.Base.metadata.create_all(engine)
+    db_base.Session.configure(bind=engine)
+
+    mesh_client = MeshClient(config=config, rx_writer=None)
+    mesh_client.link_discord(StubDiscordClient())
+    iface = FakeInterface(my_node, nodes)
+    mesh_client.iface = iface
+    mesh_client.onConnectionMesh(iface)
+    return mesh_client
+
+
+def run(args):
+    rng = random.Random(args.seed)
+    my_num = rng.randrange(0x10000000, 0xFFFFFFF0)
+    my_node = {
+        'num': my_num,
+        'user': {'id': f'!{my_num:08x}', 'longName': 'Benchmark Bot', 'shortName': 'BNCH', 'hwModel': 'TBEAM'},
+        'deviceMetrics': {'batteryLevel': 100, 'voltage': 4.1},
+    }
+    nodes = make_nodes(args.nodes, seed=args.seed)
+    mesh_client = make_mesh_client(nodes, my_node, tempfile.mkdtemp(prefix='meshbot-bench-'))
+
+    by_kind = {}
+    packets = PacketMix(my_node, nodes, seed=args.seed)
+    for _, (kind, packet) in zip(range(args.count), packets):
+        by_kind.setdefault(kind, []).append(packet)
+    by_kind['all'] = [packet for kind_packets in list(by_kind.values()) for packet in kind_packets]
+
+    results = {}
+    mismatches = 0
+    for kind, kind_packets in by_kind.items():
+        legacy_built = [legacy_packet(packet, mesh_client) for packet in kind_packets]
+        records = [record_packet(packet, mesh_client) for packet in kind_packets]
+        if kind != 'all':
+            for packet, legacy, record in zip(kind_packets, legacy_built, records):
+                diff = compare_rows(legacy_rows(legacy), record_rows(record))
+                if diff:
+                    mismatches += 1
+                    if mismatches <= 5:
+                        print(f'{kind} packet {packet.get("id")}: rows differ in {diff}')
+        results[kind] = {
+            'count': len(kind_packets),
+            'legacy_parse': time_per_packet(lambda p: legacy_packet(p, mesh_client), kind_packets, args.repeat),
+            'record_parse': time_per_packet(lambda p: record_packet(p, mesh_client), kind_packets, args.repeat),
+            'legacy_rows': time_per_packet(legacy_rows, legacy_built, args.repeat),
+            'record_rows': time_per_packet(record_rows, records, args.repeat),
+        }
+    return results, mismatches
+
+
+def print_report(results, mismatches):
+    print()
+    print(f"{'us/packet':<14} {'count':>7} {'parse before':>13} {'parse now':>10} {'rows before':>12} {'rows now':>9} {'total speedup':>14}")
+    for kind, r in results.items():
+        before = r['legacy_parse'] + r['legacy_rows']
+        now = r['record_parse'] + r['record_rows']
+        print(f"{kind:<14} {r['count']:>7} {r['legacy_parse']:>13.1f} {r['record_parse']:>10.1f} {r['legacy_rows']:>12.1f} {r['record_rows']:>9.1f} {before / now:>13.1f}x")
+    print()
+    print(f'Packets with different rows: {mismatches}')
+    print()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='MeshBot packet parse microbenchmark')
+    parser.add_argument('--count', type=int, default=5000, help='Number of packets to generate (default: 5000)')
+    parser.add_argument('--repeat', type=int, default=3, help='Runs per measurement, the best one is reported (default: 3)')
+    parser.add_argument('--nodes', type=int, default=300, help='Nodes in the fake mesh (default: 300)')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING, format="%(asctime)s [%(levelname)s] %(message)s")
+
+    results, mismatches = run(args)
+    print_report(results, mismatches)
+
+
+if __name__ == '__main__':
+    main()
@@ -6,16 +6,22 @@ import json
 class Config():
 
     class InterfaceInfo():
-        def __init__(self, d):
+        def __init__(self, d, index=0):
             self._d = d
+            self._index = index
 
         def __repr__(self):
-            return f'<class {self.__class__.__name__} {self.connection_descriptor}>.'
+            return f'<class {self.__class__.__name__} {self.name}: {self.connection_descriptor}>.'
+
+        @property
+        def name(self):
+            # used in the routing_info config, logs and metrics. Default is radio0, radio1, ... in config order
+            return self._d.get('name') or f'radio{self._index}'
 
         @property
         def connection_descriptor(self):
             if self.interface_type == 'serial':
-                return f'{self.interface_type}'
+                return f'{self.interface_type} {self.interface_dev_path}' if self.interface_dev_path else f'{self.interface_type}'
             elif self.interface_type == 'tcp':
                 return f'{self.interface_type} Address:{self.interface_address} Port:{self.interface_port}'
             elif self.interface_type == 'ble':
@@ -49,6 +55,41 @@ class Config():
                 logging.debug(f'interface_ble_node is invalid for interface_type: {self.interface_type}')
                 return None
 
+        @property
+        def interface_dev_path(self):
+            # serial port, e.g. /dev/ttyUSB0. Found automatically when there's only one radio
+            if self.interface_type == 'serial':
+                return self._d.get('dev_path') or None
+            else:
+                logging.debug(f'interface_dev_path is invalid for interface_type: {self.interface_type}')
+                return None
+
+    class RoutingInfo():
+        def __init__(self, d):
+            self._d = d
+
+        def __repr__(self):
+            return f'<class {self.__class__.__name__} default={self.default} dm={self.dm} channels={self.channels}>.'
+
+        @property
+        def default(self):
+            # interface (by name) that sends everything not routed below, and answers node lookups first.
+            # Default is the first interface
+            return self._d.get('default') or None
+
+        @property
+        def dm(self):
+            # interface that sends /dm: last_heard (the one that heard the node most recently), default, or a name
+            return self._d.get('dm') or 'last_heard'
+
+        @property
+        def channels(self):
+            # interface per channel index: {"0": "longfast", "1": "site2"} or "0=longfast,1=site2"
+            channels = self._d.get('channels') or {}
+            if isinstance(channels, str):
+                channels = dict(item.split('=') for item in channels.replace(' ', '').split(',') if item)
+            return {int(index): name for index, name in channels.items()}
+
     class DatabaseInfo():
         def __init__(self, d):
             self._d = d
@@ -87,6 +128,64 @@ class Config():
             else:
                 return None
 
+        @property
+        def rx_flush_interval(self):
+            # max seconds a received packet waits in the write-behind queue before being written
+            return float(self._d.get('rx_flush_interval') or 1.0)
+
+        @property
+        def rx_batch_size(self):
+            # number of received packets that triggers a write, even if the interval hasn't elapsed
+            return int(self._d.get('rx_batch_size') or 100)
+
+        @property
+        def pool_size(self):
+            # connections kept open (writer thread, mesh thread, slash commands)
+            return int(self._d.get('pool_size') or 5)
+
+        @property
+        def max_overflow(self):
+            # extra connections allowed above pool_size when busy
+            return int(self._d.get('max_overflow') or 10)
+
+        @property
+        def pool_timeout(self):
+            # seconds to wait for a free connection before giving up
+            return float(self._d.get('pool_timeout') or 30)
+
+        @property
+        def pool_recycle(self):
+            # seconds after which a connection is replaced (postgres only)
+            return int(self._d.get('pool_recycle') or 1800)
+
+        @property
+        def sqlite_busy_timeout(self):
+            # milliseconds sqlite waits for the write lock before raising "database is locked"
+            return int(self._d.get('sqlite_busy_timeout') or 5000)
+
+        @property
+        def partition_rx_packets(self):
+            # postgres only: rx_packets range partitioned by month on ts (see db_scripts for converting an existing db)
+            value = self._d.get('partition_rx_packets')
+            if isinstance(value, str):
+                return value.strip().lower() in ('1', 'true', 'yes')
+            return bool(value)
+
+        @property
+        def partition_months_ahead(self):
+            # monthly partitions created in advance
+            return int(self._d.get('partition_months_ahead') or 3)
+
+        @property
+        def query_workers(self):
+            # threads running db reads for slash commands
+            return int(self._d.get('query_workers') or 4)
+
+        @property
+        def query_timeout(self):
+            # seconds a slash command waits for its db reads before giving up
+            return float(self._d.get('query_timeout') or 20)
+
         @property
         def _db_connection_string(self):
             if self.db_type == 'sqlite':
@@ -99,9 +198,152 @@ class Config():
             else:
                 raise ValueError(f'Unsupported database type: {self.db_type}')
 
+    class TXInfo():
+        def __init__(self, d):
+            self._d = d
+
+        def __repr__(self):
+            return f'<class {self.__class__.__name__} duty_cycle={self.duty_cycle} burst_airtime={self.burst_airtime}s>.'
+
+        @property
+        def duty_cycle(self):
+            # fraction of time the bot may keep the radio transmitting, on average
+            return float(self._d.get('duty_cycle') or 0.1)
+
+        @property
+        def burst_airtime(self):
+            # seconds of airtime that can be used at once after being idle
+            return float(self._d.get('burst_airtime') or 10)
+
+        @property
+        def max_queue(self):
+            # messages waiting to be sent before new ones are rejected
+            return int(self._d.get('max_queue') or 50)
+
+    class RetentionInfo():
+        def __init__(self, d):
+            self._d = d
+
+        def __repr__(self):
+            return f'<class {self.__class__.__name__} days={self.days} interval={self.interval}s>.'
+
+        @property
+        def days(self):
+            # days raw rx_packets are kept, per portnum: {"TELEMETRY_APP": 30} or "TELEMETRY_APP=30,POSITION_APP=90"
+            # portnums that aren't listed are kept forever
+            days = self._d.get('days') or {}
+            if isinstance(days, str):
+                days = dict(item.split('=') for item in days.replace(' ', '').split(',') if item)
+            return {portnum: float(value) for portnum, value in days.items()}
+
+        @property
+        def interval(self):
+            # seconds between telemetry rollup / retention passes
+            return float(self._d.get('interval') or 3600)
+
+        @property
+        def drop_partitions_days(self):
+            # postgres with partitioned rx_packets only: whole monthly partitions older than this are dropped, every portnum
+            # (much cheaper than deleting rows). 0 keeps them all
+            return float(self._d.get('drop_partitions_days') or 0)
+
+        @property
+        def batch_size(self):
+            # rows rolled up or deleted per transaction
+            return int(self._d.get('batch_size') or 5000)
+
+    class ArchiveInfo():
+        def __init__(self, d):
+            self._d = d
+
+        def __repr__(self):
+            return f'<class {self.__class__.__name__} enabled={self.enabled} dir={self.archive_dir}>.'
+
+        @property
+        def enabled(self):
+            # append the raw protobuf of every received packet to the packet archive
+            value = self._d.get('enabled')
+            if isinstance(value, str):
+                return value.strip().lower() in ('1', 'true', 'yes')
+            return bool(value)
+
+        @property
+        def archive_dir(self):
+            return self._d.get('dir') or 'archive'
+
+        @property
+        def segment_max_mb(self):
+            # a new segment file is started when the current one is this big...
+            return float(self._d.get('segment_max_mb') or 64)
+
+        @property
+        def segment_max_age(self):
+            # ...or this many seconds old
+            return float(self._d.get('segment_max_age') or 86400)
+
+        @property
+        def block_kb(self):
+            # packets are compressed in blocks of about this size
+            return int(self._d.get('block_kb') or 64)
+
+        @property
+        def flush_interval(self):
+            # max seconds packets are buffered before their block is written
+            return float(self._d.get('flush_interval') or 5.0)
+
+    class MetricsInfo():
+        def __init__(self, d):
+            self._d = d
+
+        def __repr__(self):
+            return f'<class {self.__class__.__name__} enabled={self.enabled} {self.host}:{self.port}>.'
+
+        @property
+        def enabled(self):
+            # serve the bot's metrics for prometheus at http://host:port/metrics
+            value = self._d.get('enabled')
+            if isinstance(value, str):
+                return value.strip().lower() in ('1', 'true', 'yes')
+            return bool(value)
+
+        @property
+        def host(self):
+            # only reachable from the machine itself by default
+            return self._d.get('host') or '127.0.0.1'
+
+        @property
+        def port(self):
+            return int(self._d.get('port') or 9464)
+
+    class TracingInfo():
+        def __init__(self, d):
+            self._d = d
+
+        def __repr__(self):
+            return f'<class {self.__class__.__name__} slow_rx={self.slow_rx_seconds}s slow_tx={self.slow_tx_seconds}s>.'
+
+        @property
+        def slow_rx_seconds(self):
+            # log received packets that took longer than this from the radio to discord (and the db). 0 turns it off
+            value = self._d.get('slow_rx_seconds')
+            return float(value) if value not in (None, '') else 5.0
+
+        @property
+        def slow_tx_seconds(self):
+            # log sent messages that took longer than this from the command to the ACK. 0 turns it off
+            value = self._d.get('slow_tx_seconds')
+            return float(value) if value not in (None, '') else 60.0
+
     def __init__(self):
         self._config = self.load_config()
 
+    @classmethod
+    def from_dict(cls, config):
+        """Config from a dict laid out like config.json, without reading the file or env vars (e.g. for benchmarks)."""
+        obj = cls.__new__(cls)
+        obj._config = config
+        return obj
+
     def load_config(self, config_filepath=None):
         config = {}
         if not config_filepath:
@@ -146,6 +388,24 @@ class Config():
         INTERFACE_ADDRESS = os.environ.get('INTERFACE_ADDRESS')
         INTERFACE_PORT = os.environ.get('INTERFACE_PORT', '4403')
         INTERFACE_BLE_NODE = os.environ.get('INTERFACE_BLE_NODE')
+        INTERFACE_NAME = os.environ.get('INTERFACE_NAME')
+        INTERFACE_DEV_PATH = os.environ.get('INTERFACE_DEV_PATH')
+        # more radios: INTERFACE_1_METHOD, INTERFACE_1_NAME, ... (same settings as above) up to INTERFACE_9_*
+        EXTRA_INTERFACES = []
+        for n in range(1, 10):
+            if os.environ.get(f'INTERFACE_{n}_METHOD'):
+                EXTRA_INTERFACES.append({
+                    'name': os.environ.get(f'INTERFACE_{n}_NAME'),
+                    'method': os.environ.get(f'INTERFACE_{n}_METHOD'),
+                    'address': os.environ.get(f'INTERFACE_{n}_ADDRESS'),
+                    'port': os.environ.get(f'INTERFACE_{n}_PORT', '4403'),
+                    'ble_node': os.environ.get(f'INTERFACE_{n}_BLE_NODE'),
+                    'dev_path': os.environ.get(f'INTERFACE_{n}_DEV_PATH'),
+                })
+        # which interface sends what
+        ROUTING_DEFAULT = os.environ.get('ROUTING_DEFAULT')
+        ROUTING_DM = os.environ.get('ROUTING_DM')
+        ROUTING_CHANNELS = os.environ.get('ROUTING_CHANNELS')
         # database info
         DATABASE_TYPE = os.environ.get('DB_TYPE', 'sqlite')  # sqlite or postgresql/postgres
         DB_HOST = os.environ.get('DB_HOST')
@@ -154,6 +414,42 @@ class Config():
         DB_PASSWORD = os.environ.get('DB_PASSWORD')
         DB_NAME = os.environ.get('DB_NAME', 'mydatabase')  # Default is mydatabase # TODO this doesn't work if using sqlite, I think this is set in connection string, so maybe set the default to NONE
         DB_DIR = os.environ.get('DB_DIR', 'db')
+        DB_RX_FLUSH_INTERVAL = os.environ.get('DB_RX_FLUSH_INTERVAL', '1.0')
+        DB_RX_BATCH_SIZE = os.environ.get('DB_RX_BATCH_SIZE', '100')
+        DB_POOL_SIZE = os.environ.get('DB_POOL_SIZE')
+        DB_MAX_OVERFLOW = os.environ.get('DB_MAX_OVERFLOW')
+        DB_POOL_TIMEOUT = os.environ.get('DB_POOL_TIMEOUT')
+        DB_POOL_RECYCLE = os.environ.get('DB_POOL_RECYCLE')
+        DB_SQLITE_BUSY_TIMEOUT = os.environ.get('DB_SQLITE_BUSY_TIMEOUT')
+        DB_QUERY_WORKERS = os.environ.get('DB_QUERY_WORKERS')
+        DB_QUERY_TIMEOUT = os.environ.get('DB_QUERY_TIMEOUT')
+        DB_PARTITION_RX_PACKETS = os.environ.get('DB_PARTITION_RX_PACKETS')
+        DB_PARTITION_MONTHS_AHEAD = os.environ.get('DB_PARTITION_MONTHS_AHEAD')
+        # mesh tx pacing
+        TX_DUTY_CYCLE = os.environ.get('TX_DUTY_CYCLE')
+        TX_BURST_AIRTIME = os.environ.get('TX_BURST_AIRTIME')
+        TX_MAX_QUEUE = os.environ.get('TX_MAX_QUEUE')
+        # telemetry rollups and raw packet retention
+        RETENTION_DAYS = os.environ.get('RETENTION_DAYS')
+        RETENTION_INTERVAL = os.environ.get('RETENTION_INTERVAL')
+        RETENTION_BATCH_SIZE = os.environ.get('RETENTION_BATCH_SIZE')
+        RETENTION_DROP_PARTITIONS_DAYS = os.environ.get('RETENTION_DROP_PARTITIONS_DAYS')
+        # raw packet archive
+        ARCHIVE_ENABLED = os.environ.get('ARCHIVE_ENABLED')
+        ARCHIVE_DIR = os.environ.get('ARCHIVE_DIR')
+        ARCHIVE_SEGMENT_MAX_MB = os.environ.get('ARCHIVE_SEGMENT_MAX_MB')
+        ARCHIVE_SEGMENT_MAX_AGE = os.environ.get('ARCHIVE_SEGMENT_MAX_AGE')
+        ARCHIVE_BLOCK_KB = os.environ.get('ARCHIVE_BLOCK_KB')
+        ARCHIVE_FLUSH_INTERVAL = os.environ.get('ARCHIVE_FLUSH_INTERVAL')
+
+        # prometheus metrics endpoint
+        METRICS_ENABLED = os.environ.get('METRICS_ENABLED')
+        METRICS_HOST = os.environ.get('METRICS_HOST')
+        METRICS_PORT = os.environ.get('METRICS_PORT')
+
+        # latency tracing
+        TRACE_SLOW_RX_SECONDS = os.environ.get('TRACE_SLOW_RX_SECONDS')
+        TRACE_SLOW_TX_SECONDS = os.environ.get('TRACE_SLOW_TX_SECONDS')
 
         required_vars = {
             'DISCORD_BOT_TOKEN': DISCORD_BOT_TOKEN,
@@ -177,10 +473,18 @@ class Config():
             },
             'interface_info':
             {
+                'name': INTERFACE_NAME,
                 'method': INTERFACE_METHOD,
                 'address': INTERFACE_ADDRESS,
                 'port': INTERFACE_PORT,
-                'ble_node': INTERFACE_BLE_NODE
+                'ble_node': INTERFACE_BLE_NODE,
+                'dev_path': INTERFACE_DEV_PATH
+            },
+            'routing_info':
+            {
+                'default': ROUTING_DEFAULT,
+                'dm': ROUTING_DM,
+                'channels': ROUTING_CHANNELS
             },
             'database_info':
             {
@@ -190,7 +494,51 @@ class Config():
                 'username': DB_USERNAME,
                 'password': DB_PASSWORD,
                 'db_name': DB_NAME,
-                'db_dir': DB_DIR
+                'db_dir': DB_DIR,
+                'rx_flush_interval': DB_RX_FLUSH_INTERVAL,
+                'rx_batch_size': DB_RX_BATCH_SIZE,
+                'pool_size': DB_POOL_SIZE,
+                'max_overflow': DB_MAX_OVERFLOW,
+                'pool_timeout': DB_POOL_TIMEOUT,
+                'pool_recycle': DB_POOL_RECYCLE,
+                'sqlite_busy_timeout': DB_SQLITE_BUSY_TIMEOUT,
+                'query_workers': DB_QUERY_WORKERS,
+                'query_timeout': DB_QUERY_TIMEOUT,
+                'partition_rx_packets': DB_PARTITION_RX_PACKETS,
+                'partition_months_ahead': DB_PARTITION_MONTHS_AHEAD
+            },
+            'tx_info':
+            {
+                'duty_cycle': TX_DUTY_CYCLE,
+                'burst_airtime': TX_BURST_AIRTIME,
+                'max_queue': TX_MAX_QUEUE
+            },
+            'retention_info':
+            {
+                'days': RETENTION_DAYS,
+                'interval': RETENTION_INTERVAL,
+                'batch_size': RETENTION_BATCH_SIZE,
+                'drop_partitions_days': RETENTION_DROP_PARTITIONS_DAYS
+            },
+            'archive_info':
+            {
+                'enabled': ARCHIVE_ENABLED,
+                'dir': ARCHIVE_DIR,
+                'segment_max_mb': ARCHIVE_SEGMENT_MAX_MB,
+                'segment_max_age': ARCHIVE_SEGMENT_MAX_AGE,
+                'block_kb': ARCHIVE_BLOCK_KB,
+                'flush_interval': ARCHIVE_FLUSH_INTERVAL
+            },
+            'metrics_info':
+            {
+                'enabled': METRICS_ENABLED,
+                'host': METRICS_HOST,
+                'port': METRICS_PORT
+            },
+            'tracing_info':
+            {
+                'slow_rx_seconds': TRACE_SLOW_RX_SECONDS,
+                'slow_tx_seconds': TRACE_SLOW_TX_SECONDS
             }
         }
         if CHANNEL_1 is not None:
@@ -211,6 +559,8 @@ class Config():
             config['channel_names'][8] = CHANNEL_8
         if CHANNEL_9 is not None:
             config['channel_names'][9] = CHANNEL_9
+        if EXTRA_INTERFACES:
+            config['interfaces'] = [config['interface_info']] + EXTRA_INTERFACES
 
         return config
 
@@ -238,6 +588,36 @@ class Config():
     def interface_info(self):
         return Config.InterfaceInfo(self._config.get('interface_info', {}))
 
+    @property
+    def interfaces(self):
+        # one entry per radio: the interfaces list, or just interface_info
+        interfaces = self._config.get('interfaces') or [self._config.get('interface_info', {})]
+        return [Config.InterfaceInfo(d, index=i) for i, d in enumerate(interfaces)]
+
+    @property
+    def routing_info(self):
+        return Config.RoutingInfo(self._config.get('routing_info', {}))
+
     @property
     def database_info(self):
         return Config.DatabaseInfo(self._config.get('database_info', {}))
+
+    @property
+    def tx_info(self):
+        return Config.TXInfo(self._config.get('tx_info', {}))
+
+    @property
+    def retention_info(self):
+        return Config.RetentionInfo(self._config.get('retention_info', {}))
+
+    @property
+    def archive_info(self):
+        return Config.ArchiveInfo(self._config.get('archive_info', {}))
+
+    @property
+    def metrics_info(self):
+        return Config.MetricsInfo(self._config.get('metrics_info', {}))
+
+    @property
+    def tracing_info(self):
+        return Config.TracingInfo(self._config.get('tracing_info', {}))
@@ -0,0 +1,371 @@
+import contextlib
+import datetime
+import logging
+import queue
+import threading
+import time
+
+from sqlalchemy import insert, update
+from sqlalchemy.orm import Session
+
+import metrics
+from db_base import Base
+from db_classes import RXPacket, TXPacket, ACK, MeshNodeDB, NodeActivity, NodeActivityHourly, RollupState, TelemetryHourly
+from packet_record import PacketRecord
+from partitions import RXPacketPartitionManager
+
+# sentinel placed on the writer queue alongside packets
+_STOP = object()
+
+
+def create_tables(engine, db_info):
+    """Creates any missing tables. With db_info.partition_rx_packets (postgres only), rx_packets is created
+    partitioned by month. Returns the RXPacketPartitionManager, or None when partitioning is off."""
+    partition_manager = None
+    if db_info.partition_rx_packets:
+        partition_manager = RXPacketPartitionManager(months_ahead=db_info.partition_months_ahead)
+        with engine.begin() as conn:
+            if not partition_manager.setup(conn):
+                partition_manager = None
+    Base.metadata.create_all(engine)
+    return partition_manager
+
+
+class NodeInfoUpdate():
+    '''A received NODEINFO packet (the packet dict) to apply to the publishing client's mesh_nodes row,
+    queued on the RXPacketWriter so the receive thread doesn't wait for the DB.'''
+
+    def __init__(self, packet, mesh_client):
+        self.packet = packet
+        self.mesh_client = mesh_client
+        self.lock = mesh_client._db_lock
+
+    def __repr__(self):
+        return f'<{self.__class__.__name__} from={self.packet.get("from")} via {self.mesh_client.name}>'
+
+
+class RXPacketWriter():
+    '''Write-behind persistence for received packets.
+
+    The mesh receive thread only parses packets and puts them on this writer's queue. A dedicated
+    thread flushes them to the database in batches using bulk Core inserts, either when batch_size
+    packets are waiting or when flush_interval seconds have passed since the first one was queued.
+
+    The port specific side table rows of each packet (positions, metrics, ...) are inserted in the same
+    transaction, once the packets have their ids.
+
+    After each batch, the node_activity summary tables are updated with the packets that were written.
+
+    ACKs matched by the mesh client are queued here too (after the packet they reference), so the ACK row
+    and tx_packets.acknowledge_received are written once the RX packet has its id.
+
+    NODEINFO packets queue a NodeInfoUpdate, applied to mesh_nodes in one transaction per batch.
+    '''
+
+    # how often old node_activity_hourly buckets are deleted
+    prune_interval = 3600
+
+    def __init__(self, engine, flush_interval=1.0, batch_size=100):
+        self._engine = engine
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+
+        self._queue = queue.Queue()
+        self._thread = None
+
+        # tracing.Trace of queued packets, released once the packet is written
+        self._traces = {}
+
+        self._last_prune = 0
+
+        metrics.queue_depth.labels(queue='rx_writer').set_function(self._queue.qsize)
+
+    def __repr__(self):
+        return f'<{self.__class__.__name__} interval={self.flush_interval}s batch={self.batch_size}>'
+
+    @property
+    def queue_depth(self):
+        return self._queue.qsize()
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='rx-packet-writer', daemon=True)
+            self._thread.start()
+
+    def stop(self, timeout=10):
+        """Flushes anything still queued and stops the writer thread."""
+        if self._thread is not None:
+            self._queue.put(_STOP)
+            self._thread.join(timeout=timeout)
+            self._thread = None
+
+    def enqueue(self, pkt, trace=None):
+        """Queues a PacketRecord or an RXPacket to be written. Never blocks."""
+        if trace is not None:
+            self._traces[pkt] = trace.hold()
+            trace.mark('db_queued')
+        self._queue.put(pkt)
+
+    def enqueue_ack(self, ack_obj):
+        """Queues an ACK (with ack_packet and tx_packet_id set) to be written after its RX packet. Never blocks."""
+        self._queue.put(ack_obj)
+
+    def enqueue_node_info(self, node_info_update):
+        """Queues a NodeInfoUpdate to be applied to mesh_nodes in the next batch. Never blocks."""
+        self._queue.put(node_info_update)
+
+    def _collect_batch(self):
+        """Returns (batch, stop_requested). Waits for the first packet, then up to flush_interval for more."""
+        batch = []
+        deadline = None
+        while len(batch) < self.batch_size:
+            timeout = None if deadline is None else max(0, deadline - time.monotonic())
+            try:
+                item = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                break
+            if item is _STOP:
+                return batch, True
+            batch.append(item)
+            if deadline is None:
+                deadline = time.monotonic() + self.flush_interval
+        return batch, False
+
+    def _run(self):
+        stop = False
+        while not stop:
+            batch, stop = self._collect_batch()
+            if batch:
+                try:
+                    self._flush(batch)
+                except Exception as e:
+                    logging.exception('RXPacketWriter: unexpected error while flushing', exc_info=e)
+        logging.info('RXPacketWriter finished.')
+
+    def _flush(self, batch):
+        packets = [item for item in batch if isinstance(item, (PacketRecord, RXPacket))]
+        acks = [item for item in batch if isinstance(item, ACK)]
+        node_infos = [item for item in batch if isinstance(item, NodeInfoUpdate)]
+        if packets:
+            self._flush_packets(packets)
+        if acks:
+            self._flush_acks(acks)
+        if node_infos:
+            self._flush_node_infos(node_infos)
+
+    def _flush_packets(self, batch):
+        # PacketRecords are only turned into rows here, on the writer thread
+        rows = [pkt.to_insert_row() for pkt in batch]
+        details = [pkt.detail_rows() for pkt in batch]
+        stmt = insert(RXPacket).returning(RXPacket.id, sort_by_parameter_order=True)
+
+        tic = time.time()
+        try:
+            with self._engine.begin() as conn:
+                row_ids = conn.execute(stmt, rows).scalars().all()
+                self._insert_details(conn, details, row_ids)
+        except Exception as e:
+            # one bad row shouldn't cost us the whole batch
+            logging.error(f'RXPacketWriter: batch insert of {len(rows)} packets failed, retrying one at a time: {e}')
+            row_ids = self._insert_one_at_a_time(stmt, rows, details)
+        toc = time.time() - tic
+        metrics.db_commit_seconds.labels(writer='rx_packets').observe(toc)
+        written = sum(1 for row_id in row_ids if row_id is not None)
+        metrics.db_packets_written.labels(result='written').inc(written)
+        if written < len(rows):
+            metrics.db_packets_written.labels(result='failed').inc(len(rows) - written)
+
+        for pkt, row_id in zip(batch, row_ids):
+            if row_id is not None:
+                pkt.id = row_id
+
+        if self._traces:
+            for pkt, row_id in zip(batch, row_ids):
+                trace = self._traces.pop(pkt, None)
+                if trace is not None:
+                    trace.release('db_committed' if row_id is not None else 'db_failed')
+
+        logging.info(f'RXPacketWriter: saved {len(batch)} packets to DB in {toc*1000:.1f}ms. {self.queue_depth} still queued.')
+
+        # use the row dicts, the packets may already belong to another thread's session by now
+        self._update_node_activity([row for row, row_id in zip(rows, row_ids) if row_id is not None])
+
+    def _flush_acks(self, acks):
+        # the RX packets were flushed first (same batch or an earlier one), so ack_packet.id is set
+        # unless that insert failed, in which case the ACK is still recorded without it
+        rows = [ack.to_insert_row() for ack in acks]
+        tx_ids = {row['tx_packet_id'] for row in rows if row['tx_packet_id'] is not None}
+        try:
+            with metrics.db_commit_seconds.labels(writer='acks').time(), self._engine.begin() as conn:
+                conn.execute(insert(ACK), rows)
+                if tx_ids:
+                    conn.execute(update(TXPacket).where(TXPacket.id.in_(tx_ids)).values(acknowledge_received=True))
+        except Exception as e:
+            logging.error(f'DB ROLLBACK: {len(rows)} ACKs dropped: {str(e)}')
+            return
+        logging.info(f'RXPacketWriter: saved {len(rows)} ACKs to DB')
+
+    def _flush_node_infos(self, updates):
+        # the mesh clients' node syncs (onConnectionMesh) write mesh_nodes too, hold their locks so a node
+        # isn't inserted twice. Usually there's only one
+        locks = list({id(node_info.lock): node_info.lock for node_info in updates}.values())
+        try:
+            with contextlib.ExitStack() as stack:
+                for lock in locks:
+                    stack.enter_context(lock)
+                with metrics.db_commit_seconds.labels(writer='node_info').time(), self._engine.begin() as conn:
+                    # autoflush lets a later update in the batch find a node inserted by an earlier one
+                    session = Session(bind=conn)
+                    for node_info in updates:
+                        MeshNodeDB.update_from_nodeinfo(node_info.packet, node_info.mesh_client, session)
+                    session.flush()
+        except Exception as e:
+            logging.error(f'DB ROLLBACK: {len(updates)} node info updates dropped: {str(e)}')
+            return
+        logging.info(f'RXPacketWriter: applied {len(updates)} node info updates')
+
+    def _update_node_activity(self, written):
+        # separate transaction: if the summary can't be updated, the packets are still saved
+        # (and the summary can be recalculated with: python db_maintenance.py rebuild-node-activity)
+        try:
+            with metrics.db_commit_seconds.labels(writer='node_activity').time(), self._engine.begin() as conn:
+                NodeActivity.apply_packets(conn, written)
+                if time.monotonic() - self._last_prune > self.prune_interval:
+                    self._last_prune = time.monotonic()
+                    pruned = NodeActivityHourly.prune(conn)
+                    logging.info(f'RXPacketWriter: pruned {pruned} old node_activity_hourly rows')
+        except Exception as e:
+            logging.error(f'RXPacketWriter: failed to update node_activity for {len(written)} packets: {e}')
+
+    @staticmethod
+    def _insert_details(conn, details, row_ids):
+        # one executemany per side table
+        rows_by_table = {}
+        for packet_details, row_id in zip(details, row_ids):
+            for table, row in packet_details:
+                row['packet_id'] = row_id
+                rows_by_table.setdefault(table, []).append(row)
+        for table, rows in rows_by_table.items():
+            conn.execute(insert(table), rows)
+
+    def _insert_one_at_a_time(self, stmt, rows, details):
+        row_ids = []
+        for row, packet_details in zip(rows, details):
+            try:
+                with self._engine.begin() as conn:
+                    row_id = conn.execute(stmt, [row]).scalar_one()
+                    self._insert_details(conn, [packet_details], [row_id])
+                    row_ids.append(row_id)
+            except Exception as e:
+                logging.error(f'DB ROLLBACK: RX packet with pkt_id: {row.get("pkt_id")} dropped: {str(e)}')
+                row_ids.append(None)
+        return row_ids
+
+
+class RetentionJob():
+    '''Telemetry rollups and raw packet retention.
+
+    Every interval seconds, on its own thread:
+    1. New TELEMETRY_APP packets (after the high-water mark in rollup_state) are rolled up into the
+       telemetry_hourly and telemetry_daily tables.
+    2. With a partition_manager (partitioned rx_packets on postgres): the upcoming monthly partitions are
+       created, and partitions older than drop_partitions_days are dropped whole.
+    3. rx_packets older than the retention for their portnum are deleted. Telemetry is only deleted once
+       it has been rolled up.
+
+    Rollups and deletes work in batches of batch_size rows, one short transaction each, so the RX writer is never
+    blocked for long.
+    '''
+
+    # portnums that have to be rolled up before their raw rows can be deleted -> rollup_state name
+    rollups = {'TELEMETRY_APP': TelemetryHourly.rollup_name}
+
+    def __init__(self, engine, retention_days=None, interval=3600, batch_size=5000, partition_manager=None, drop_partitions_days=None):
+        self._engine = engine
+        self.retention_days = retention_days or {}
+        self.interval = interval
+        self.batch_size = batch_size
+        self.partition_manager = partition_manager
+        self.drop_partitions_days = drop_partitions_days
+
+        self._stop = threading.Event()
+        self._thread = None
+
+    def __repr__(self):
+        return f'<{self.__class__.__name__} days={self.retention_days} interval={self.interval}s>'
+
+    def start(self):
+        if self._thread is None:
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name='retention-job', daemon=True)
+            self._thread.start()
+
+    def stop(self, timeout=10):
+        if self._thread is not None:
+            self._stop.set()
+            self._thread.join(timeout=timeout)
+            self._thread = None
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.run_once()
+            except Exception as e:
+                logging.exception('RetentionJob: pass failed', exc_info=e)
+        logging.info('RetentionJob finished.')
+
+    def run_once(self):
+        """One rollup + retention pass. Returns (packets rolled up, {portnum: rows deleted})."""
+        rolled_up = self.rollup_telemetry()
+        self.maintain_partitions()
+        deleted = self.apply_retention()
+        return rolled_up, deleted
+
+    def rollup_telemetry(self):
+        """Rolls up everything after the high-water mark. Returns the number of packets rolled up."""
+        tic = time.time()
+        total = 0
+        while not self._stop.is_set():
+            with metrics.db_commit_seconds.labels(writer='rollup').time(), self._engine.begin() as conn:
+                cnt = TelemetryHourly.rollup(conn, chunk_size=self.batch_size)
+            total += cnt
+            if cnt < self.batch_size:
+                break
+        if total:
+            logging.info(f'RetentionJob: rolled up {total} telemetry packets in {time.time() - tic:.1f}s')
+        return total
+
+    def maintain_partitions(self):
+        """Creates upcoming rx_packets partitions and drops expired ones. Returns the names of the dropped partitions."""
+        if self.partition_manager is None:
+            return []
+        with self._engine.begin() as conn:
+            self.partition_manager.ensure_partitions(conn)
+        if not self.drop_partitions_days:
+            return []
+        cutoff = datetime.datetime.now(datetime.timezone.utc) - datetime.timedelta(days=self.drop_partitions_days)
+        # one transaction per partition would leave less locked, but DROP TABLE is quick and this runs rarely
+        with self._engine.begin() as conn:
+            max_id = RollupState.get(conn, TelemetryHourly.rollup_name)
+            return self.partition_manager.drop_before(conn, cutoff, rollup_max_id=max_id)
+
+    def apply_retention(self):
+        """Deletes rx_packets past their portnum's retention. Returns {portnum: rows deleted}."""
+        deleted = {}
+        for portnum, days in self.retention_days.items():
+            older_than = datetime.datetime.now(datetime.timezone.utc) - datetime.timedelta(days=days)
+            max_id = None
+            if portnum in self.rollups:
+                with self._engine.connect() as conn:
+                    max_id = RollupState.get(conn, self.rollups[portnum])
+            tic = time.time()
+            deleted[portnum] = 0
+            while not self._stop.is_set():
+                with metrics.db_commit_seconds.labels(writer='retention').time(), self._engine.begin() as conn:
+                    cnt = RXPacket.prune(conn, portnum, older_than, max_id=max_id, batch_size=self.batch_size)
+                deleted[portnum] += cnt
+                if cnt < self.batch_size:
+                    break
+            if deleted[portnum]:
+                logging.info(f'RetentionJob: deleted {deleted[portnum]} {portnum} packets older than {days} days in {time.time() - tic:.1f}s')
+        return deleted
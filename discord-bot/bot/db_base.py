@@ -1,3 +1,69 @@
-from sqlalchemy.orm import sessionmaker, declarative_base
+from contextlib import contextmanager
 
-Base = declarative_base()
\ No newline at end of file
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import sessionmaker, scoped_session, declarative_base
+
+import metrics
+
+Base = declarative_base()
+
+# one session per thread, bound to the engine at startup with Session.configure(bind=engine).
+# objects stay usable after commit (no expiry), since units of work are short and the results are
+# usually read after the session is closed
+Session = scoped_session(sessionmaker(expire_on_commit=False))
+
+
+@contextmanager
+def session_scope():
+    """Short-lived unit of work on the calling thread's session. Commits on success, rolls back on error.
+
+    Nested scopes on the same thread share the outer session, and the outer scope commits.
+    """
+    if Session.registry.has():
+        yield Session()
+        return
+
+    session = Session()
+    try:
+        yield session
+        with metrics.db_commit_seconds.labels(writer='session').time():
+            session.commit()
+    except Exception:
+        session.rollback()
+        raise
+    finally:
+        Session.remove()
+
+
+def create_db_engine(db_info):
+    """Creates the engine for a Config.DatabaseInfo, with its pool settings (and pragmas for sqlite)."""
+    if db_info.db_type == 'sqlite':
+        engine = create_engine(
+            db_info._db_connection_string,
+            pool_size=db_info.pool_size,
+            max_overflow=db_info.max_overflow,
+            pool_timeout=db_info.pool_timeout,
+            connect_args={'check_same_thread': False, 'timeout': db_info.sqlite_busy_timeout / 1000},
+        )
+        busy_timeout = db_info.sqlite_busy_timeout
+
+        @event.listens_for(engine, 'connect')
+        def _set_sqlite_pragmas(dbapi_connection, connection_record):
+            # WAL: readers (slash commands) don't block the writer thread and vice versa.
+            # NORMAL is safe with WAL, only a power loss can lose the last commits
+            cursor = dbapi_connection.cursor()
+            cursor.execute('PRAGMA journal_mode=WAL')
+            cursor.execute(f'PRAGMA busy_timeout={int(busy_timeout)}')
+            cursor.execute('PRAGMA synchronous=NORMAL')
+            cursor.close()
+
+        return engine
+
+    return create_engine(
+        db_info._db_connection_string,
+        pool_size=db_info.pool_size,
+        max_overflow=db_info.max_overflow,
+        pool_timeout=db_info.pool_timeout,
+        pool_recycle=db_info.pool_recycle,
+        pool_pre_ping=True,
+    )
@@ -1,14 +1,14 @@
-from sqlalchemy import create_engine, Column, Integer, String, Boolean, Double, ForeignKey, JSON, DateTime, BigInteger
-from sqlalchemy import select, over
+from sqlalchemy import create_engine, Column, Integer, String, Boolean, Double, ForeignKey, JSON, DateTime, BigInteger, Index, UniqueConstraint
+from sqlalchemy import select, over, delete, case, or_
+from sqlalchemy.dialects import postgresql, sqlite
 from sqlalchemy.sql import func
-from db_base import Base
+from db_base import Base, session_scope
 
 
-from sqlalchemy.orm import relationship, aliased
+from sqlalchemy.orm import relationship, contains_eager
 import datetime
 
 import meshtastic
-from google.protobuf.json_format import MessageToDict
 from version import __version__
 
 import logging
@@ -50,50 +50,33 @@ class RXPacket(Base):
     emoji = Column(Integer)
     reply_id = Column(BigInteger)
 
-    # telemetry_data = Column(JSON)
-    telemetry_air_quality_metrics = Column(JSON)
-    telemetry_device_metrics = Column(JSON)
-    telemetry_environment_metrics = Column(JSON)
-    telemetry_power_metrics = Column(JSON)
-
-    has_air_quality_metrics = Column(Boolean)
-    has_device_metrics = Column(Boolean)
-    has_environment_metrics = Column(Boolean)
-    has_power_metrics = Column(Boolean)
-    has_position_data = Column(Boolean)
-
-
-    # position
-    altitude = Column(Double)
-    latitude = Column(Double)
-    latitudeI = Column(Integer)
-    longitude = Column(Double)
-    longitudeI = Column(Integer)
-    pos_time = Column(BigInteger) #presumably GPS time?
-    location_source = Column(String)
-    pdop = Column(Double)
-    ground_speed = Column(Double)
-    ground_track = Column(Double)
-    sats_in_view = Column(Integer)
-    precision_bits = Column(Integer)
-
-    # nodeinfo
-    node_id = Column(String)
-    node_short_name = Column(String)
-    node_long_name = Column(String)
-    mac_address = Column(String)
-    hw_model = Column(String)
-    public_key = Column(String)
-
-    # routing
-    request_id = Column(String) # maybe int?
-    error_reason = Column(String)
-
-    # traceroute
-    traceroute_data = Column(JSON)
-
     ts = Column(DateTime(timezone=True))
 
+    # port specific fields live in side tables, one row per packet (see RXPacketDetail below). Not loaded
+    # unless asked for, query with joinedload()/contains_eager() when they're needed after the session closes
+    position = relationship("RXPosition", primaryjoin="foreign(RXPosition.packet_id) == RXPacket.id", uselist=False)
+    device_metrics = relationship("RXDeviceMetrics", primaryjoin="foreign(RXDeviceMetrics.packet_id) == RXPacket.id", uselist=False)
+    environment_metrics = relationship("RXEnvironmentMetrics", primaryjoin="foreign(RXEnvironmentMetrics.packet_id) == RXPacket.id", uselist=False)
+    power_metrics = relationship("RXPowerMetrics", primaryjoin="foreign(RXPowerMetrics.packet_id) == RXPacket.id", uselist=False)
+    air_quality_metrics = relationship("RXAirQualityMetrics", primaryjoin="foreign(RXAirQualityMetrics.packet_id) == RXPacket.id", uselist=False)
+    nodeinfo = relationship("RXNodeInfo", primaryjoin="foreign(RXNodeInfo.packet_id) == RXPacket.id", uselist=False)
+    routing = relationship("RXRouting", primaryjoin="foreign(RXRouting.packet_id) == RXPacket.id", uselist=False)
+    traceroute = relationship("RXTraceroute", primaryjoin="foreign(RXTraceroute.packet_id) == RXPacket.id", uselist=False)
+
+    detail_relationships = (
+        'position', 'device_metrics', 'environment_metrics', 'power_metrics', 'air_quality_metrics',
+        'nodeinfo', 'routing', 'traceroute',
+    )
+
+    __table_args__ = (
+        # per node, per portnum counts and "latest" lookups (/nodeinfo)
+        Index('ix_rx_packets_publisher_src_num_portnum_ts', 'publisher_mesh_node_num', 'src_num', 'portnum', 'ts'),
+        # latest packet and packet counts per src_id (/active, /all_nodes)
+        Index('ix_rx_packets_publisher_src_id_ts', 'publisher_mesh_node_num', 'src_id', 'ts'),
+        # time window filters
+        Index('ix_rx_packets_publisher_ts', 'publisher_mesh_node_num', 'ts'),
+    )
+
     # postgres db has tz but sqlite doesn't, so if db=postgres, return ts as-is, else return ts with utc tzinfo
     @property
     def ts_with_tz(self):
@@ -131,295 +114,358 @@ class RXPacket(Base):
         else:
             return '?'
 
-    def from_dict(d:dict, mesh_client):
-
-        # metadata (discord)
-        publisher_mesh_node_num = mesh_client.my_node_info.node_num
-        publisher_discord_bot_user_id = mesh_client.discord_client.user.id
-
-        # COMMON SECTION
-        channel = d.get('channel')
-        src_num = d.get('from')
-        dst_num = d.get('to')
-        pkt_id = d.get('id')
-
-        # attempt to get short and long names
-        try:
-            src_id = '!' + hex(src_num)[2:]
-            src_short_name = mesh_client.get_short_name(src_id)
-            src_long_name = mesh_client.get_long_name(src_id)
-        except:
-            src_id = None
-            src_short_name = None
-            src_long_name = None
-
-        try:
-            dst_id = '!' + hex(dst_num)[2:]
-            dst_short_name = mesh_client.get_short_name(dst_id)
-            dst_long_name = mesh_client.get_long_name(dst_id)
-        except:
-            dst_id = None
-            dst_short_name = None
-            dst_long_name = None
-
-        to_all = dst_id == '!ffffffff'
-
-        hop_limit = d.get('hopLimit')
-        hop_start = d.get('hopStart')
-        pki_encrypted = d.get('pkiEncrypted')
-        priority = d.get('priority')
-
-
-        rx_rssi = d.get('rxRssi')
-        rx_snr = d.get('rxSnr')
-        rx_time = d.get('rxTime')
-
-        want_ack = d.get('wantAck')
-        want_reponse = d.get('wantResponse')
-
-        decoded = d.get('decoded', {})
-        portnum = decoded.get('portnum')
-        
-        packet_json = None
-        raw_packet = d.get('raw')
-        if raw_packet is not None:
-            packet_json = MessageToDict(raw_packet)
-
-        text = None
-        bitfield = None
-        emoji = None
-        reply_id = None
-
-        if portnum == 'TEXT_MESSAGE_APP':
-            text = decoded.get('text')
-            bitfield = decoded.get('bitfield')
-            emoji = decoded.get('emoji')
-            reply_id = decoded.get('replyId')
-
-
-        has_position_data = False
-
-        altitude = None
-        latitude = None
-        longitude = None
-        latitudeI = None
-        longitudeI = None
-
-        pos_time = None
-        location_source = None
-        pdop = None
-        ground_speed = None
-        ground_track = None
-        sats_in_view = None
-        precision_bits = None
-
-        if portnum == 'POSITION_APP':
-            has_position_data = True
-            pos_data = decoded.get('position', {})
-            altitude = pos_data.get('altitude')
-            latitude = pos_data.get('latitude')
-            longitude = pos_data.get('longitude')
-            latitudeI = pos_data.get('latitudeI')
-            longitudeI = pos_data.get('longitudeI')
-
-            pos_time = pos_data.get('time')
-            location_source = pos_data.get('locationSource')
-            pdop = pos_data.get('PDOP')
-            ground_speed = pos_data.get('groundSpeed')
-            ground_track = pos_data.get('groundTrack')
-            sats_in_view = pos_data.get('satsInView')
-            precision_bits = pos_data.get('precisionBits')
-
-
-        # initalize
-        telemetry_air_quality_metrics = {}
-        telemetry_device_metrics = {}
-        telemetry_environment_metrics = {}
-        telemetry_power_metrics = {}
-
-        has_air_quality_metrics = False
-        has_device_metrics = False
-        has_environment_metrics = False
-        has_power_metrics = False
-
-        if portnum == 'TELEMETRY_APP':
-            telemetry_data = decoded.get('telemetry', {})
-
-            telemetry_air_quality_metrics = telemetry_data.get('airQualityMetrics', {})
-            telemetry_device_metrics = telemetry_data.get('deviceMetrics', {})
-            telemetry_environment_metrics = telemetry_data.get('environmentMetrics', {})
-            telemetry_power_metrics = telemetry_data.get('powerMetrics', {})
-
-            has_air_quality_metrics = bool(telemetry_air_quality_metrics)
-            has_device_metrics = bool(telemetry_device_metrics)
-            has_environment_metrics = bool(telemetry_environment_metrics)
-            has_power_metrics = bool(telemetry_power_metrics)
-
-        node_id = None
-        node_short_name = None
-        node_long_name = None
-        mac_address = None
-        hw_model = None
-        public_key = None
-
-        if portnum == 'NODEINFO_APP':
-            nodeinfo_data = decoded.get('user', {})
-
-            node_id = nodeinfo_data.get('id')
-            node_short_name = nodeinfo_data.get('shortName')
-            node_long_name = nodeinfo_data.get('longName')
-            mac_address = nodeinfo_data.get('macaddr')
-            hw_model = nodeinfo_data.get('hwModel')
-            public_key = nodeinfo_data.get('publicKey')
-
-        request_id = None
-        error_reason = None
+    # the metrics as the dicts the old wide rx_packets stored, for code that reads them that way (/nodeinfo)
+    @property
+    def telemetry_device_metrics(self):
+        return self.device_metrics.to_dict() if self.device_metrics is not None else {}
 
-        if portnum == 'ROUTING_APP':
-            request_id = decoded.get('requestId')
-            error_reason = decoded.get('routing').get('errorReason')
-
-        traceroute_data = {}
-
-        if portnum == 'TRACEROUTE_APP':
-            traceroute_data = decoded.get('traceroute', {})
-            try:
-                del traceroute_data['raw']
-            except:
-                pass
-
-        out = RXPacket(
-
-            pkt_id = pkt_id,
-
-            publisher_mesh_node_num = publisher_mesh_node_num,
-            publisher_discord_bot_user_id = publisher_discord_bot_user_id,
-            has_device_metrics = has_device_metrics,
-            has_environment_metrics = has_environment_metrics,
-            has_air_quality_metrics = has_air_quality_metrics,
-            has_power_metrics = has_power_metrics,
-            has_position_data = has_position_data,
-            channel = channel,
-            src_num = src_num,
-            src_id = src_id,
-            src_short_name = src_short_name,
-            src_long_name = src_long_name,
-            dst_num = dst_num,
-            dst_id = dst_id,
-            dst_short_name = dst_short_name,
-            dst_long_name = dst_long_name,
-            hop_limit = hop_limit,
-            hop_start = hop_start,
-            pki_encrypted = pki_encrypted,
-            portnum = portnum,
-            priority = priority,
-            rx_time = rx_time,
-            rx_rssi = rx_rssi,
-            rx_snr = rx_snr,
-            to_all = to_all,
-            want_ack = want_ack,
-            # packet_json = packet_json,
-            text = text,
-            bitfield = bitfield,
-            emoji = emoji,
-            reply_id = reply_id,
-            telemetry_air_quality_metrics = telemetry_air_quality_metrics,
-            telemetry_device_metrics = telemetry_device_metrics,
-            telemetry_environment_metrics = telemetry_environment_metrics,
-            telemetry_power_metrics = telemetry_power_metrics,
-            altitude = altitude,
-            latitude = latitude,
-            latitudeI = latitudeI,
-            longitude = longitude,
-            longitudeI = longitudeI,
-            pos_time = pos_time,
-            location_source = location_source,
-            pdop = pdop,
-            ground_speed = ground_speed,
-            ground_track = ground_track,
-            sats_in_view = sats_in_view,
-            precision_bits = precision_bits,
-
-            node_id = node_id,
-            node_short_name = node_short_name,
-            node_long_name = node_long_name,
-            mac_address = mac_address,
-            hw_model = hw_model,
-            public_key = public_key,
-            request_id = request_id,
-            error_reason = error_reason,
-            traceroute_data = traceroute_data,
-            ts=datetime.datetime.now(datetime.timezone.utc)
+    @property
+    def telemetry_environment_metrics(self):
+        return self.environment_metrics.to_dict() if self.environment_metrics is not None else {}
 
-        )
-        return out
+    @property
+    def telemetry_power_metrics(self):
+        return self.power_metrics.to_dict() if self.power_metrics is not None else {}
 
-    def latest_packets_for_publisher(mesh_client, publisher_mesh_node_num, time_limit=None):
-        
-        time_after = None
-        if time_limit is not None:
-            time_limit = int(time_limit)
-            time_after = datetime.datetime.now(datetime.timezone.utc) - datetime.timedelta(minutes=time_limit)
-            
-        if time_after is not None:
-            # Apply your filter first
-            base_q = (
-                mesh_client._db_session.query(RXPacket)
-                .filter(RXPacket.publisher_mesh_node_num == publisher_mesh_node_num)
-                .filter(RXPacket.ts >= time_after)
-                .subquery()
-            )
-        else:
-            base_q = (
-                mesh_client._db_session.query(RXPacket)
-                .filter(RXPacket.publisher_mesh_node_num == publisher_mesh_node_num)
-                .subquery()
-            )
+    @property
+    def telemetry_air_quality_metrics(self):
+        return self.air_quality_metrics.to_dict() if self.air_quality_metrics is not None else {}
 
-        BasePacket = aliased(RXPacket, base_q)  # alias so we can refer to columns
-        
-        
-        row_number = func.row_number().over(
-            partition_by=base_q.c.src_id,
-            order_by=base_q.c.ts.desc()
-        )
-        
-        ranked_q = (
-            mesh_client._db_session.query(base_q, row_number.label("rn"))
-            .subquery()
-        )
-        
-        final_q = (
-            mesh_client._db_session.query(ranked_q)
-            .filter(ranked_q.c.rn == 1)
-        )
+    @property
+    def traceroute_data(self):
+        return self.traceroute.to_dict() if self.traceroute is not None else {}
 
-        latest_packets_out = final_q.all()
-        
-        return latest_packets_out
-    
-    def get_pkt_cnt_for_src_id_within_time(mesh_client, publisher_mesh_node_num, time_limit = None):
-        
-        time_after = None
-        if time_limit is not None:
-            time_limit = int(time_limit)
-            time_after = datetime.datetime.now(datetime.timezone.utc) - datetime.timedelta(minutes=time_limit)
-            
-        # use ORM query to get count of packets group by src_id
-        query = mesh_client._db_session.query(
-            RXPacket.src_id,
-            func.count(RXPacket.id).label('pkt_count')
-        ).filter(
-            RXPacket.publisher_mesh_node_num == publisher_mesh_node_num
+    @property
+    def has_device_metrics(self):
+        return self.device_metrics is not None
+
+    @property
+    def has_environment_metrics(self):
+        return self.environment_metrics is not None
+
+    @property
+    def has_power_metrics(self):
+        return self.power_metrics is not None
+
+    @property
+    def has_air_quality_metrics(self):
+        return self.air_quality_metrics is not None
+
+    @property
+    def has_position_data(self):
+        return self.position is not None
+
+    def to_insert_row(self):
+        """Column values for a bulk Core insert (everything except the autoincrement id)."""
+        return {key: getattr(self, key) for key in RXPacket.insert_columns}
+
+    def details(self):
+        """The side table rows (RXPacketDetail's) set on this packet."""
+        return [detail for detail in (getattr(self, name) for name in RXPacket.detail_relationships) if detail is not None]
+
+    def detail_rows(self):
+        """(side table, insert row without packet_id) for each side table row set on this packet."""
+        return [(type(detail), detail.to_insert_row(None)) for detail in self.details()]
+
+    @staticmethod
+    def prune(conn, portnum, older_than, max_id=None, batch_size=5000):
+        """Deletes up to batch_size rx_packets of portnum received before older_than (and with id <= max_id,
+        if given), with their side table rows. Packets an ACK points to are kept. Returns the number of rows deleted."""
+        ids = (
+            select(RXPacket.id)
+            .where(RXPacket.portnum == portnum)
+            .where(RXPacket.ts < older_than)
+            .order_by(RXPacket.id)
+            .limit(batch_size)
         )
-        if time_after is not None:
-            query = query.filter(RXPacket.ts >= time_after)
-        query = query.group_by(RXPacket.src_id)
-        results = query.all()
-        pkt_count_dict = {row.src_id: row.pkt_count for row in results}
-        return pkt_count_dict
+        if max_id is not None:
+            ids = ids.where(RXPacket.id <= max_id)
+        if portnum == 'ROUTING_APP':
+            ids = ids.where(RXPacket.id.notin_(select(ACK.ack_packet_id).where(ACK.ack_packet_id.isnot(None))))
+        # same transaction, so both deletes see the same batch of ids
+        for detail in RX_PACKET_DETAILS:
+            if detail.portnum == portnum:
+                conn.execute(delete(detail).where(detail.packet_id.in_(ids.scalar_subquery())))
+        return conn.execute(delete(RXPacket).where(RXPacket.id.in_(ids.scalar_subquery()))).rowcount
         
 
+# columns written by RXPacketWriter, everything except the autoincrement id
+RXPacket.insert_columns = tuple(column.key for column in RXPacket.__table__.columns if column.key != 'id')
+
+
+def _json_name(column_name):
+    # the key MessageToDict gives a protobuf field: battery_level -> batteryLevel, rainfall_1h -> rainfall1h
+    first, *rest = column_name.split('_')
+    return first + ''.join(part[:1].upper() + part[1:] for part in rest)
+
+
+class RXPacketDetail():
+    """Columns and helpers shared by the rx_packets side tables.
+
+    Each side table holds the port specific fields of one packet, keyed by rx_packets.id (no db foreign key,
+    see ACK.ack_packet_id), in typed columns. The portnum handlers parse them as dicts, which RXPacketWriter
+    inserts (values_from_dict) after the packet itself, or from_dict() turns into ORM objects.
+
+    The packet dict key of a column is its camelCase name, unless dict_keys says otherwise. Tables with an
+    `extra` column keep the keys that have no column there (e.g. fields added by newer firmware).
+    """
+
+    packet_id = Column(BigInteger, primary_key=True, autoincrement=False)
+
+    # portnum of the packets that have rows in this table, and column -> packet dict key overrides
+    portnum = None
+    dict_keys = {}
+
+    def __repr__(self):
+        return f'<{self.__class__.__name__} packet_id={self.packet_id}>'
+
+    @classmethod
+    def value_columns(cls):
+        """(column, dict key) for every column except packet_id and extra."""
+        columns = cls.__dict__.get('_value_columns')
+        if columns is None:
+            columns = tuple(
+                (column.key, cls.dict_keys.get(column.key) or _json_name(column.key))
+                for column in cls.__table__.columns if column.key not in ('packet_id', 'extra')
+            )
+            cls._value_columns = columns
+        return columns
+
+    @classmethod
+    def values_from_dict(cls, d):
+        """Column values from a packet dict, without building the ORM object (see packet_record.PacketRecord)."""
+        d = d or {}
+        values = {column: d.get(key) for column, key in cls.value_columns()}
+        if 'extra' in cls.__table__.columns:
+            known = {key for _, key in cls.value_columns()}
+            values['extra'] = {key: value for key, value in d.items() if key not in known and key != 'raw'} or None
+        return values
+
+    @classmethod
+    def from_dict(cls, d):
+        return cls(**cls.values_from_dict(d))
+
+    def to_dict(self):
+        """The packet dict keys and values this row was built from (the ones that were set)."""
+        d = {key: getattr(self, column) for column, key in self.value_columns() if getattr(self, column) is not None}
+        d.update(getattr(self, 'extra', None) or {})
+        return d
+
+    def to_insert_row(self, packet_id):
+        row = {column: getattr(self, column) for column, _ in self.value_columns()}
+        if 'extra' in self.__table__.columns:
+            row['extra'] = self.extra
+        row['packet_id'] = packet_id
+        return row
+
+
+class RXPosition(RXPacketDetail, Base):
+    """POSITION_APP fields."""
+    __tablename__ = 'rx_positions'
+
+    portnum = 'POSITION_APP'
+    dict_keys = {'pos_time': 'time', 'pdop': 'PDOP'}
+
+    latitude = Column(Double)
+    longitude = Column(Double)
+    latitude_i = Column(Integer)
+    longitude_i = Column(Integer)
+    altitude = Column(Double)
+    pos_time = Column(BigInteger) #presumably GPS time?
+    location_source = Column(String)
+    pdop = Column(Double)
+    ground_speed = Column(Double)
+    ground_track = Column(Double)
+    sats_in_view = Column(Integer)
+    precision_bits = Column(Integer)
+
+
+class RXDeviceMetrics(RXPacketDetail, Base):
+    """TELEMETRY_APP device metrics."""
+    __tablename__ = 'rx_device_metrics'
+
+    portnum = 'TELEMETRY_APP'
+
+    battery_level = Column(Double)
+    voltage = Column(Double)
+    channel_utilization = Column(Double)
+    air_util_tx = Column(Double)
+    uptime_seconds = Column(BigInteger)
+    extra = Column(JSON)
+
+
+class RXEnvironmentMetrics(RXPacketDetail, Base):
+    """TELEMETRY_APP environment metrics."""
+    __tablename__ = 'rx_environment_metrics'
+
+    portnum = 'TELEMETRY_APP'
+
+    temperature = Column(Double)
+    relative_humidity = Column(Double)
+    barometric_pressure = Column(Double)
+    gas_resistance = Column(Double)
+    voltage = Column(Double)
+    current = Column(Double)
+    iaq = Column(Integer)
+    distance = Column(Double)
+    lux = Column(Double)
+    white_lux = Column(Double)
+    ir_lux = Column(Double)
+    uv_lux = Column(Double)
+    wind_direction = Column(Integer)
+    wind_speed = Column(Double)
+    wind_gust = Column(Double)
+    wind_lull = Column(Double)
+    weight = Column(Double)
+    radiation = Column(Double)
+    rainfall_1h = Column(Double)
+    rainfall_24h = Column(Double)
+    soil_moisture = Column(Integer)
+    soil_temperature = Column(Double)
+    extra = Column(JSON)
+
+
+class RXPowerMetrics(RXPacketDetail, Base):
+    """TELEMETRY_APP power metrics (INA sensor channels)."""
+    __tablename__ = 'rx_power_metrics'
+
+    portnum = 'TELEMETRY_APP'
+
+    ch1_voltage = Column(Double)
+    ch1_current = Column(Double)
+    ch2_voltage = Column(Double)
+    ch2_current = Column(Double)
+    ch3_voltage = Column(Double)
+    ch3_current = Column(Double)
+    ch4_voltage = Column(Double)
+    ch4_current = Column(Double)
+    ch5_voltage = Column(Double)
+    ch5_current = Column(Double)
+    ch6_voltage = Column(Double)
+    ch6_current = Column(Double)
+    ch7_voltage = Column(Double)
+    ch7_current = Column(Double)
+    ch8_voltage = Column(Double)
+    ch8_current = Column(Double)
+    extra = Column(JSON)
+
+
+class RXAirQualityMetrics(RXPacketDetail, Base):
+    """TELEMETRY_APP air quality metrics."""
+    __tablename__ = 'rx_air_quality_metrics'
+
+    portnum = 'TELEMETRY_APP'
+
+    pm10_standard = Column(Integer)
+    pm25_standard = Column(Integer)
+    pm40_standard = Column(Integer)
+    pm100_standard = Column(Integer)
+    pm10_environmental = Column(Integer)
+    pm25_environmental = Column(Integer)
+    pm100_environmental = Column(Integer)
+    particles_03um = Column(Integer)
+    particles_05um = Column(Integer)
+    particles_10um = Column(Integer)
+    particles_25um = Column(Integer)
+    particles_40um = Column(Integer)
+    particles_50um = Column(Integer)
+    particles_100um = Column(Integer)
+    co2 = Column(Integer)
+    co2_temperature = Column(Double)
+    co2_humidity = Column(Double)
+    extra = Column(JSON)
+
+
+class RXNodeInfo(RXPacketDetail, Base):
+    """NODEINFO_APP user fields."""
+    __tablename__ = 'rx_nodeinfo'
+
+    portnum = 'NODEINFO_APP'
+    dict_keys = {'node_id': 'id', 'mac_address': 'macaddr'}
+
+    node_id = Column(String)
+    short_name = Column(String)
+    long_name = Column(String)
+    mac_address = Column(String)
+    hw_model = Column(String)
+    role = Column(String)
+    public_key = Column(String)
+
+
+class RXRouting(RXPacketDetail, Base):
+    """ROUTING_APP fields: the packet it responds to, and the error (NONE for an ACK)."""
+    __tablename__ = 'rx_routing'
+
+    portnum = 'ROUTING_APP'
+
+    request_id = Column(BigInteger)
+    error_reason = Column(String)
+
+
+class RXTraceroute(RXPacketDetail, Base):
+    """TRACEROUTE_APP route discovery: node nums and SNRs (dB * 4) each way."""
+    __tablename__ = 'rx_traceroutes'
+
+    portnum = 'TRACEROUTE_APP'
+
+    route = Column(JSON)
+    snr_towards = Column(JSON)
+    route_back = Column(JSON)
+    snr_back = Column(JSON)
+
+
+RX_PACKET_DETAILS = (
+    RXPosition, RXDeviceMetrics, RXEnvironmentMetrics, RXPowerMetrics, RXAirQualityMetrics, RXNodeInfo, RXRouting, RXTraceroute,
+)
+
+# RXPacket relationship -> side table, for building rows without configuring the mappers
+RXPacket.detail_classes = {
+    'position': RXPosition,
+    'device_metrics': RXDeviceMetrics,
+    'environment_metrics': RXEnvironmentMetrics,
+    'power_metrics': RXPowerMetrics,
+    'air_quality_metrics': RXAirQualityMetrics,
+    'nodeinfo': RXNodeInfo,
+    'routing': RXRouting,
+    'traceroute': RXTraceroute,
+}
+
+
+def _detail_accessor(relationship_name, column):
+    def get(self):
+        detail = getattr(self, relationship_name)
+        return getattr(detail, column) if detail is not None else None
+    return property(get)
+
+
+# read-only RXPacket attributes for the columns that moved to side tables, so code written against the
+# old wide rx_packets keeps working: attribute -> (relationship, side table column)
+RX_PACKET_DETAIL_ATTRIBUTES = {
+    'altitude': ('position', 'altitude'),
+    'latitude': ('position', 'latitude'),
+    'latitudeI': ('position', 'latitude_i'),
+    'longitude': ('position', 'longitude'),
+    'longitudeI': ('position', 'longitude_i'),
+    'pos_time': ('position', 'pos_time'),
+    'location_source': ('position', 'location_source'),
+    'pdop': ('position', 'pdop'),
+    'ground_speed': ('position', 'ground_speed'),
+    'ground_track': ('position', 'ground_track'),
+    'sats_in_view': ('position', 'sats_in_view'),
+    'precision_bits': ('position', 'precision_bits'),
+    'node_id': ('nodeinfo', 'node_id'),
+    'node_short_name': ('nodeinfo', 'short_name'),
+    'node_long_name': ('nodeinfo', 'long_name'),
+    'mac_address': ('nodeinfo', 'mac_address'),
+    'hw_model': ('nodeinfo', 'hw_model'),
+    'public_key': ('nodeinfo', 'public_key'),
+    'request_id': ('routing', 'request_id'),
+    'error_reason': ('routing', 'error_reason'),
+}
+for _attribute, (_relationship_name, _column) in RX_PACKET_DETAIL_ATTRIBUTES.items():
+    setattr(RXPacket, _attribute, _detail_accessor(_relationship_name, _column))
+
+
 class TXPacket(Base):
     __tablename__ = 'tx_packets'  # Name of the table in the database
     id = Column(Integer, primary_key=True)
@@ -449,6 +495,11 @@ class TXPacket(Base):
 
     acks = relationship("ACK", back_populates="tx_packet")
 
+    __table_args__ = (
+        # matching ACKs/responses to the packet they acknowledge
+        Index('ix_tx_packets_publisher_packet_id', 'publisher_mesh_node_num', 'packet_id'),
+    )
+
     def from_sent_packet(sent_packet, discord_interaction_info, mesh_client, ack_requested=True):
         channel = sent_packet.channel
         hop_limit = sent_packet.hop_limit
@@ -496,23 +547,39 @@ class ACK(Base):
     tx_packet_id = Column(BigInteger, ForeignKey('tx_packets.id'))
     tx_packet = relationship("TXPacket", back_populates="acks") # Defines the many-to-one relationship with 'User'
 
-    ack_packet_id = Column(BigInteger, ForeignKey('rx_packets.id'))
-    ack_packet = relationship("RXPacket") # Defines the many-to-one relationship with 'User'
+    # no db foreign key: on postgres rx_packets can be partitioned, and its primary key is then (id, ts)
+    ack_packet_id = Column(BigInteger)
+    ack_packet = relationship("RXPacket", primaryjoin="foreign(ACK.ack_packet_id) == RXPacket.id")
 
     implicit_ack = Column(Boolean)
 
-    def from_rx_packet(pkt, mesh_client):
+    __table_args__ = (
+        Index('ix_acks_tx_packet_id', 'tx_packet_id'),
+    )
+
+    def from_rx_packet(pkt, mesh_client, tx_packet_id=None):
 
         implicit_ack = pkt.src_id == mesh_client.my_node_info.user_info.user_id
 
         ack_obj = ACK(
             publisher_mesh_node_num = mesh_client.my_node_info.node_num,
             publisher_discord_bot_user_id = mesh_client.discord_client.user.id,
+            tx_packet_id = tx_packet_id,
             ack_packet = pkt,
             implicit_ack = implicit_ack
         )
         return ack_obj
 
+    def to_insert_row(self):
+        """Column values for a bulk insert (see database_client.RXPacketWriter). ack_packet must be written first."""
+        return {
+            'publisher_mesh_node_num': self.publisher_mesh_node_num,
+            'publisher_discord_bot_user_id': self.publisher_discord_bot_user_id,
+            'tx_packet_id': self.tx_packet_id,
+            'ack_packet_id': self.ack_packet.id if self.ack_packet is not None else None,
+            'implicit_ack': self.implicit_ack,
+        }
+
 
 # TODO: Refactor this so it can be used for everything node-related - with the possible exception of the local node
 class MeshNodeDB(Base):
@@ -545,6 +612,10 @@ class MeshNodeDB(Base):
     upd_ts_nodedb = Column(DateTime(timezone=True))
     upd_ts_nodeinfo = Column(DateTime(timezone=True))
 
+    __table_args__ = (
+        Index('ix_nodes_publisher_node_num', 'publisher_mesh_node_num', 'node_num'),
+    )
+
     def __repr__(self):
         return f'<{self.__class__.__name__}. {self.descriptive_name_nodedb}>'
 
@@ -604,7 +675,7 @@ class MeshNodeDB(Base):
             return self.user_public_key_nodedb
 
 
-    def update_from_nodeinfo(d, mesh_client):
+    def update_from_nodeinfo(d, mesh_client, session):
         bot_node_num = mesh_client.my_node_info.node_num_str
 
         publisher_mesh_node_num = mesh_client.my_node_info.node_num,
@@ -623,7 +694,7 @@ class MeshNodeDB(Base):
                 hw_model = user_dict.get('hwModel')
                 public_key = user_dict.get('publicKey')
                 
-            matching_node = mesh_client._db_session.query(MeshNodeDB).filter_by(node_num=nodenum).filter(MeshNodeDB.publisher_mesh_node_num == bot_node_num).first()
+            matching_node = session.query(MeshNodeDB).filter_by(node_num=nodenum).filter(MeshNodeDB.publisher_mesh_node_num == bot_node_num).first()
             if matching_node:
                 if user_dict:
                     if user_id is not None:
@@ -673,12 +744,11 @@ class MeshNodeDB(Base):
                     upd_ts_nodeinfo = datetime.datetime.now(datetime.timezone.utc)
 
                 )
-                mesh_client._db_session.add(new_node)
-                mesh_client._db_session.commit()
+                session.add(new_node)
 
-    def update_from_nodedb(node_num, d, mesh_client):
+    def update_from_nodedb(node_num, d, mesh_client, session):
         bot_node_num = mesh_client.my_node_info.node_num_str
-        matching_node = mesh_client._db_session.query(MeshNodeDB).filter_by(node_num=node_num).filter(MeshNodeDB.publisher_mesh_node_num == bot_node_num).first()
+        matching_node = session.query(MeshNodeDB).filter_by(node_num=node_num).filter(MeshNodeDB.publisher_mesh_node_num == bot_node_num).first()
         if matching_node:
             is_favorite = d.get('isFavorite')
             if is_favorite is not None:
@@ -772,3 +842,521 @@ class discord_bot_id(Base):
             publisher_channel_id = d.get('publisher_channel_id'),
             ts = d.get('ts', datetime.datetime.now(datetime.timezone.utc))
         )
+
+
+def _upsert(conn, model):
+    """Returns a dialect specific INSERT (which supports on_conflict_do_update) for the model's table."""
+    if conn.dialect.name == 'postgresql':
+        return postgresql.insert(model)
+    elif conn.dialect.name == 'sqlite':
+        return sqlite.insert(model)
+    else:
+        raise ValueError(f'Upsert not supported for database type: {conn.dialect.name}')
+
+
+class NodeActivity(Base):
+    """Per node "last seen + counters" summary. Kept up to date as received packets are written,
+    so /active and /all_nodes don't have to scan rx_packets."""
+    __tablename__ = 'node_activity'
+
+    id = Column(Integer, primary_key=True)
+
+    publisher_mesh_node_num = Column(String)
+
+    src_num = Column(BigInteger)
+    src_id = Column(String)
+    src_short_name = Column(String)
+    src_long_name = Column(String)
+
+    last_portnum = Column(String)
+    last_ts = Column(DateTime(timezone=True))
+    pkt_count = Column(BigInteger)
+
+    __table_args__ = (
+        UniqueConstraint('publisher_mesh_node_num', 'src_num', name='uq_node_activity_publisher_src_num'),
+        Index('ix_node_activity_publisher_last_ts', 'publisher_mesh_node_num', 'last_ts'),
+    )
+
+    def __repr__(self):
+        return f'<{self.__class__.__name__}. {self.src_descriptive}>'
+
+    @property
+    def src_descriptive(self):
+        return f'{self.src_id} | {self.src_short_name} | {self.src_long_name}'
+
+    # postgres db has tz but sqlite doesn't, so if db=postgres, return ts as-is, else return ts with utc tzinfo
+    @property
+    def last_ts_with_tz(self):
+        if self.last_ts.tzinfo is None:
+            return self.last_ts.replace(tzinfo=datetime.timezone.utc)
+        else:
+            return self.last_ts
+
+    @staticmethod
+    def apply_packets(conn, rows):
+        """Adds a batch of written packets (RXPacket.to_insert_row() dicts) to the summary tables."""
+        nodes = {}
+        hours = {}
+        for row in rows:
+            if row['src_num'] is None or row['ts'] is None:
+                continue
+            publisher = str(row['publisher_mesh_node_num'])
+            key = (publisher, row['src_num'])
+            node = nodes.get(key)
+            if node is None:
+                node = nodes[key] = {
+                    'publisher_mesh_node_num': publisher,
+                    'src_num': row['src_num'],
+                    'pkt_count': 0,
+                    'last_ts': None,
+                }
+            node['pkt_count'] += 1
+            if node['last_ts'] is None or row['ts'] >= node['last_ts']:
+                node.update(
+                    src_id = row['src_id'],
+                    src_short_name = row['src_short_name'],
+                    src_long_name = row['src_long_name'],
+                    last_portnum = row['portnum'],
+                    last_ts = row['ts'],
+                )
+
+            hour_key = (publisher, row['src_num'], row['ts'].replace(minute=0, second=0, microsecond=0))
+            hours[hour_key] = hours.get(hour_key, 0) + 1
+
+        if nodes:
+            NodeActivity._upsert_nodes(conn, list(nodes.values()))
+        if hours:
+            NodeActivityHourly._upsert_hours(conn, [
+                {'publisher_mesh_node_num': p, 'src_num': n, 'hour_ts': h, 'pkt_count': c} for (p, n, h), c in hours.items()
+            ])
+
+    @staticmethod
+    def _upsert_nodes(conn, rows):
+        stmt = _upsert(conn, NodeActivity).values(rows)
+        excluded = stmt.excluded
+        is_newer = or_(NodeActivity.last_ts.is_(None), excluded.last_ts >= NodeActivity.last_ts)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=['publisher_mesh_node_num', 'src_num'],
+            set_={
+                'pkt_count': NodeActivity.pkt_count + excluded.pkt_count,
+                # only move "last seen" forward, packets can be written out of order (e.g. a backfill)
+                'last_ts': case((is_newer, excluded.last_ts), else_=NodeActivity.last_ts),
+                'last_portnum': case((is_newer, excluded.last_portnum), else_=NodeActivity.last_portnum),
+                'src_id': case((is_newer, excluded.src_id), else_=NodeActivity.src_id),
+                'src_short_name': case((is_newer, excluded.src_short_name), else_=NodeActivity.src_short_name),
+                'src_long_name': case((is_newer, excluded.src_long_name), else_=NodeActivity.src_long_name),
+            }
+        )
+        conn.execute(stmt)
+
+    @staticmethod
+    def nodes_for_publisher(session, publisher_mesh_node_num, time_limit=None):
+        """Returns [(NodeActivity, pkt_count_24_hr)] for the publisher, most recently heard first.
+        time_limit (minutes) limits it to nodes heard within that time."""
+
+        now = datetime.datetime.now(datetime.timezone.utc)
+        day_ago = now - datetime.timedelta(days=1)
+
+        cnt_24_hr = (
+            select(NodeActivityHourly.src_num, func.sum(NodeActivityHourly.pkt_count).label('pkt_count'))
+            .where(NodeActivityHourly.publisher_mesh_node_num == publisher_mesh_node_num)
+            .where(NodeActivityHourly.hour_ts >= day_ago)
+            .group_by(NodeActivityHourly.src_num)
+            .subquery()
+        )
+
+        query = (
+            session.query(NodeActivity, func.coalesce(cnt_24_hr.c.pkt_count, 0))
+            .outerjoin(cnt_24_hr, cnt_24_hr.c.src_num == NodeActivity.src_num)
+            .filter(NodeActivity.publisher_mesh_node_num == publisher_mesh_node_num)
+        )
+        if time_limit is not None:
+            time_after = now - datetime.timedelta(minutes=int(time_limit))
+            query = query.filter(NodeActivity.last_ts >= time_after)
+
+        return query.order_by(NodeActivity.last_ts.desc()).all()
+
+    @staticmethod
+    def rebuild(conn, publisher_mesh_node_num=None, chunk_size=5000):
+        """Recalculates the summary tables from rx_packets (all publishers unless one is given).
+        Returns the number of packets read."""
+
+        delete_nodes = delete(NodeActivity)
+        delete_hours = delete(NodeActivityHourly)
+        query = (
+            select(
+                RXPacket.publisher_mesh_node_num, RXPacket.src_num, RXPacket.src_id, RXPacket.src_short_name,
+                RXPacket.src_long_name, RXPacket.portnum, RXPacket.ts
+            )
+            .order_by(RXPacket.id)
+            .execution_options(yield_per=chunk_size)
+        )
+        if publisher_mesh_node_num is not None:
+            publisher_mesh_node_num = str(publisher_mesh_node_num)
+            delete_nodes = delete_nodes.where(NodeActivity.publisher_mesh_node_num == publisher_mesh_node_num)
+            delete_hours = delete_hours.where(NodeActivityHourly.publisher_mesh_node_num == publisher_mesh_node_num)
+            query = query.where(RXPacket.publisher_mesh_node_num == publisher_mesh_node_num)
+
+        conn.execute(delete_nodes)
+        conn.execute(delete_hours)
+
+        # hourly buckets are only kept for NodeActivityHourly.keep_days, don't bother with older ones
+        hours_after = datetime.datetime.now(datetime.timezone.utc) - datetime.timedelta(days=NodeActivityHourly.keep_days)
+
+        nodes = {}
+        hours = {}
+        pkt_cnt = 0
+        for row in conn.execute(query):
+            pkt_cnt += 1
+            if row.src_num is None or row.ts is None:
+                continue
+            key = (row.publisher_mesh_node_num, row.src_num)
+            node = nodes.get(key)
+            if node is None:
+                node = nodes[key] = {
+                    'publisher_mesh_node_num': row.publisher_mesh_node_num,
+                    'src_num': row.src_num,
+                    'pkt_count': 0,
+                    'last_ts': None,
+                }
+            node['pkt_count'] += 1
+            if node['last_ts'] is None or row.ts >= node['last_ts']:
+                node.update(
+                    src_id = row.src_id,
+                    src_short_name = row.src_short_name,
+                    src_long_name = row.src_long_name,
+                    last_portnum = row.portnum,
+                    last_ts = row.ts,
+                )
+            # sqlite gives back naive (utc) timestamps
+            ts_with_tz = row.ts if row.ts.tzinfo else row.ts.replace(tzinfo=datetime.timezone.utc)
+            if ts_with_tz >= hours_after:
+                hour_key = (row.publisher_mesh_node_num, row.src_num, row.ts.replace(minute=0, second=0, microsecond=0))
+                hours[hour_key] = hours.get(hour_key, 0) + 1
+
+        node_rows = list(nodes.values())
+        for i in range(0, len(node_rows), 500):
+            conn.execute(NodeActivity.__table__.insert(), node_rows[i:i + 500])
+        hour_rows = [{'publisher_mesh_node_num': p, 'src_num': n, 'hour_ts': h, 'pkt_count': c} for (p, n, h), c in hours.items()]
+        for i in range(0, len(hour_rows), 500):
+            conn.execute(NodeActivityHourly.__table__.insert(), hour_rows[i:i + 500])
+
+        logging.info(f'Rebuilt node_activity from {pkt_cnt} packets: {len(node_rows)} nodes, {len(hour_rows)} hourly buckets')
+        return pkt_cnt
+
+
+class NodeActivityHourly(Base):
+    """Packets received per node per hour, used for the "in past day" counts in NodeActivity."""
+    __tablename__ = 'node_activity_hourly'
+
+    # buckets older than this are deleted by prune()
+    keep_days = 7
+
+    id = Column(Integer, primary_key=True)
+
+    publisher_mesh_node_num = Column(String)
+    src_num = Column(BigInteger)
+    hour_ts = Column(DateTime(timezone=True))
+    pkt_count = Column(BigInteger)
+
+    __table_args__ = (
+        UniqueConstraint('publisher_mesh_node_num', 'src_num', 'hour_ts', name='uq_node_activity_hourly_publisher_src_num_hour'),
+        Index('ix_node_activity_hourly_publisher_hour_ts', 'publisher_mesh_node_num', 'hour_ts'),
+    )
+
+    @staticmethod
+    def _upsert_hours(conn, rows):
+        stmt = _upsert(conn, NodeActivityHourly).values(rows)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=['publisher_mesh_node_num', 'src_num', 'hour_ts'],
+            set_={'pkt_count': NodeActivityHourly.pkt_count + stmt.excluded.pkt_count}
+        )
+        conn.execute(stmt)
+
+    @staticmethod
+    def prune(conn):
+        older_than = datetime.datetime.now(datetime.timezone.utc) - datetime.timedelta(days=NodeActivityHourly.keep_days)
+        result = conn.execute(delete(NodeActivityHourly).where(NodeActivityHourly.hour_ts < older_than))
+        return result.rowcount
+
+
+# telemetry metrics kept in the rollups: column prefix -> side table column
+TELEMETRY_ROLLUP_METRICS = {
+    'battery_level': RXDeviceMetrics.battery_level,
+    'voltage': RXDeviceMetrics.voltage,
+    'channel_utilization': RXDeviceMetrics.channel_utilization,
+    'air_util_tx': RXDeviceMetrics.air_util_tx,
+    'temperature': RXEnvironmentMetrics.temperature,
+    'relative_humidity': RXEnvironmentMetrics.relative_humidity,
+    'barometric_pressure': RXEnvironmentMetrics.barometric_pressure,
+}
+
+
+class RollupState(Base):
+    """High-water marks (last rx_packets.id processed) for the incremental rollup jobs."""
+    __tablename__ = 'rollup_state'
+
+    name = Column(String, primary_key=True)
+    last_id = Column(BigInteger)
+    upd_ts = Column(DateTime(timezone=True))
+
+    @staticmethod
+    def get(conn, name):
+        return conn.execute(select(RollupState.last_id).where(RollupState.name == name)).scalar() or 0
+
+    @staticmethod
+    def set(conn, name, last_id):
+        stmt = _upsert(conn, RollupState).values(name=name, last_id=last_id, upd_ts=datetime.datetime.now(datetime.timezone.utc))
+        conn.execute(stmt.on_conflict_do_update(index_elements=['name'], set_={'last_id': stmt.excluded.last_id, 'upd_ts': stmt.excluded.upd_ts}))
+
+
+class TelemetryRollupColumns():
+    """Columns shared by the hourly and daily telemetry rollups. Each metric has min/max/sum/count
+    (avg = sum / count), so a bucket can be merged with newer packets as they are rolled up."""
+
+    id = Column(Integer, primary_key=True)
+
+    publisher_mesh_node_num = Column(String)
+    src_num = Column(BigInteger)
+    bucket_ts = Column(DateTime(timezone=True))
+    pkt_count = Column(BigInteger)
+
+    battery_level_min = Column(Double)
+    battery_level_max = Column(Double)
+    battery_level_sum = Column(Double)
+    battery_level_count = Column(Integer)
+
+    voltage_min = Column(Double)
+    voltage_max = Column(Double)
+    voltage_sum = Column(Double)
+    voltage_count = Column(Integer)
+
+    channel_utilization_min = Column(Double)
+    channel_utilization_max = Column(Double)
+    channel_utilization_sum = Column(Double)
+    channel_utilization_count = Column(Integer)
+
+    air_util_tx_min = Column(Double)
+    air_util_tx_max = Column(Double)
+    air_util_tx_sum = Column(Double)
+    air_util_tx_count = Column(Integer)
+
+    temperature_min = Column(Double)
+    temperature_max = Column(Double)
+    temperature_sum = Column(Double)
+    temperature_count = Column(Integer)
+
+    relative_humidity_min = Column(Double)
+    relative_humidity_max = Column(Double)
+    relative_humidity_sum = Column(Double)
+    relative_humidity_count = Column(Integer)
+
+    barometric_pressure_min = Column(Double)
+    barometric_pressure_max = Column(Double)
+    barometric_pressure_sum = Column(Double)
+    barometric_pressure_count = Column(Integer)
+
+    def __repr__(self):
+        return f'<{self.__class__.__name__} {self.src_num} {self.bucket_ts}: {self.pkt_count} packets>'
+
+    def avg(self, metric):
+        count = getattr(self, f'{metric}_count')
+        return getattr(self, f'{metric}_sum') / count if count else None
+
+    @classmethod
+    def _upsert_buckets(cls, conn, rows):
+        stmt = _upsert(conn, cls).values(rows)
+        excluded = stmt.excluded
+        set_ = {'pkt_count': cls.pkt_count + excluded.pkt_count}
+        for metric in TELEMETRY_ROLLUP_METRICS:
+            col_min, col_max = getattr(cls, f'{metric}_min'), getattr(cls, f'{metric}_max')
+            new_min, new_max = getattr(excluded, f'{metric}_min'), getattr(excluded, f'{metric}_max')
+            # NULL means no values yet, sqlite's min()/max() don't skip NULLs so compare explicitly
+            set_[f'{metric}_min'] = case((col_min.is_(None), new_min), (new_min < col_min, new_min), else_=col_min)
+            set_[f'{metric}_max'] = case((col_max.is_(None), new_max), (new_max > col_max, new_max), else_=col_max)
+            set_[f'{metric}_sum'] = func.coalesce(getattr(cls, f'{metric}_sum'), 0) + func.coalesce(getattr(excluded, f'{metric}_sum'), 0)
+            set_[f'{metric}_count'] = func.coalesce(getattr(cls, f'{metric}_count'), 0) + func.coalesce(getattr(excluded, f'{metric}_count'), 0)
+        conn.execute(stmt.on_conflict_do_update(index_elements=['publisher_mesh_node_num', 'src_num', 'bucket_ts'], set_=set_))
+
+
+class TelemetryHourly(TelemetryRollupColumns, Base):
+    """Device and environment metrics per node per hour, rolled up from TELEMETRY_APP packets."""
+    __tablename__ = 'telemetry_hourly'
+
+    __table_args__ = (
+        UniqueConstraint('publisher_mesh_node_num', 'src_num', 'bucket_ts', name='uq_telemetry_hourly_publisher_src_num_bucket'),
+    )
+
+    # high-water mark name in rollup_state
+    rollup_name = 'telemetry'
+
+    @staticmethod
+    def rollup(conn, chunk_size=5000):
+        """Rolls up the next chunk_size TELEMETRY_APP packets after the high-water mark into the hourly and daily
+        tables and moves the mark forward, in the caller's transaction. Returns the number of packets rolled up."""
+        last_id = RollupState.get(conn, TelemetryHourly.rollup_name)
+        rows = conn.execute(
+            select(
+                RXPacket.id, RXPacket.publisher_mesh_node_num, RXPacket.src_num, RXPacket.ts,
+                *(column.label(metric) for metric, column in TELEMETRY_ROLLUP_METRICS.items())
+            )
+            .outerjoin(RXDeviceMetrics, RXDeviceMetrics.packet_id == RXPacket.id)
+            .outerjoin(RXEnvironmentMetrics, RXEnvironmentMetrics.packet_id == RXPacket.id)
+            .where(RXPacket.id > last_id)
+            .where(RXPacket.portnum == 'TELEMETRY_APP')
+            .order_by(RXPacket.id)
+            .limit(chunk_size)
+        ).all()
+        if not rows:
+            return 0
+
+        hours = {}
+        days = {}
+        for row in rows:
+            if row.src_num is None or row.ts is None:
+                continue
+            hour = row.ts.replace(minute=0, second=0, microsecond=0)
+            for buckets, bucket_ts in ((hours, hour), (days, hour.replace(hour=0))):
+                key = (row.publisher_mesh_node_num, row.src_num, bucket_ts)
+                bucket = buckets.get(key)
+                if bucket is None:
+                    bucket = buckets[key] = TelemetryHourly._empty_bucket(*key)
+                bucket['pkt_count'] += 1
+                for metric in TELEMETRY_ROLLUP_METRICS:
+                    value = getattr(row, metric)
+                    if value is None:
+                        continue
+                    bucket[f'{metric}_min'] = value if bucket[f'{metric}_min'] is None else min(bucket[f'{metric}_min'], value)
+                    bucket[f'{metric}_max'] = value if bucket[f'{metric}_max'] is None else max(bucket[f'{metric}_max'], value)
+                    bucket[f'{metric}_sum'] += value
+                    bucket[f'{metric}_count'] += 1
+
+        for i in range(0, len(hours), 500):
+            TelemetryHourly._upsert_buckets(conn, list(hours.values())[i:i + 500])
+        for i in range(0, len(days), 500):
+            TelemetryDaily._upsert_buckets(conn, list(days.values())[i:i + 500])
+        RollupState.set(conn, TelemetryHourly.rollup_name, rows[-1].id)
+        return len(rows)
+
+    @staticmethod
+    def _empty_bucket(publisher_mesh_node_num, src_num, bucket_ts):
+        bucket = {'publisher_mesh_node_num': publisher_mesh_node_num, 'src_num': src_num, 'bucket_ts': bucket_ts, 'pkt_count': 0}
+        for metric in TELEMETRY_ROLLUP_METRICS:
+            bucket.update({f'{metric}_min': None, f'{metric}_max': None, f'{metric}_sum': 0.0, f'{metric}_count': 0})
+        return bucket
+
+
+class TelemetryDaily(TelemetryRollupColumns, Base):
+    """Device and environment metrics per node per day (UTC), filled by TelemetryHourly.rollup."""
+    __tablename__ = 'telemetry_daily'
+
+    __table_args__ = (
+        UniqueConstraint('publisher_mesh_node_num', 'src_num', 'bucket_ts', name='uq_telemetry_daily_publisher_src_num_bucket'),
+    )
+
+
+class PortnumSummary():
+    """Packet count and latest packet time for one portnum, see NodeReport."""
+
+    def __init__(self, portnum, pkt_count, latest_ts):
+        self.portnum = portnum
+        self.pkt_count = pkt_count
+        self.latest_ts = latest_ts
+
+    def __repr__(self):
+        return f'<{self.__class__.__name__} {self.portnum}: {self.pkt_count}, latest {self.latest_ts}>'
+
+
+class NodeReport():
+    """Everything /nodeinfo shows for one node, read with a handful of indexed queries:
+    one GROUP BY portnum for the counts and latest times, and one newest-first lookup per category
+    (position, device metrics, environment metrics), all on ix_rx_packets_publisher_src_num_portnum_ts.
+    The latest packets come with their side table row loaded.
+    """
+
+    def __init__(self, node, portnums, latest_position, latest_device_metrics, latest_environment_metrics):
+        self.node = node
+        self.portnums = portnums # PortnumSummary's, newest first
+        self.latest_position = latest_position
+        self.latest_device_metrics = latest_device_metrics
+        self.latest_environment_metrics = latest_environment_metrics
+
+    def __repr__(self):
+        return f'<{self.__class__.__name__} {self.node.descriptive_name}: {self.pkt_count} packets>'
+
+    @property
+    def pkt_count(self):
+        return sum(x.pkt_count for x in self.portnums)
+
+    @property
+    def last_portnum(self):
+        return self.portnums[0].portnum if self.portnums else None
+
+    @property
+    def last_ts(self):
+        return self.portnums[0].latest_ts if self.portnums else None
+
+    @staticmethod
+    def ts_with_tz(ts):
+        # postgres db has tz but sqlite doesn't
+        if ts is not None and ts.tzinfo is None:
+            return ts.replace(tzinfo=datetime.timezone.utc)
+        return ts
+
+    @staticmethod
+    def matching_nodes(session, publisher_mesh_node_num, node_num):
+        return (
+            session.query(MeshNodeDB)
+            .filter(MeshNodeDB.node_num == node_num)
+            .filter(MeshNodeDB.publisher_mesh_node_num == str(publisher_mesh_node_num))
+            .all()
+        )
+
+    @staticmethod
+    def load(publisher_mesh_node_num, node_num):
+        """Looks up the node and builds its report. Returns (matching nodes, report), report is None unless
+        exactly one node matches."""
+        with session_scope() as session:
+            matching_nodes = NodeReport.matching_nodes(session, publisher_mesh_node_num, node_num)
+            if len(matching_nodes) != 1:
+                return matching_nodes, None
+            return matching_nodes, NodeReport.query(session, publisher_mesh_node_num, matching_nodes[0])
+
+    @staticmethod
+    def query(session, publisher_mesh_node_num, node):
+        """Builds the report for node (a MeshNodeDB)."""
+        publisher_mesh_node_num = str(publisher_mesh_node_num)
+
+        def node_packets():
+            return (
+                session.query(RXPacket)
+                .filter(RXPacket.publisher_mesh_node_num == publisher_mesh_node_num)
+                .filter(RXPacket.src_num == node.node_num)
+            )
+
+        counts = (
+            session.query(RXPacket.portnum, func.count().label('pkt_count'), func.max(RXPacket.ts).label('latest_ts'))
+            .filter(RXPacket.publisher_mesh_node_num == publisher_mesh_node_num)
+            .filter(RXPacket.src_num == node.node_num)
+            .group_by(RXPacket.portnum)
+            .all()
+        )
+        portnums = [PortnumSummary(row.portnum, row.pkt_count, NodeReport.ts_with_tz(row.latest_ts)) for row in counts]
+        epoch = datetime.datetime.min.replace(tzinfo=datetime.timezone.utc)
+        portnums.sort(key=lambda x: x.latest_ts or epoch, reverse=True)
+
+        def latest_with(portnum, detail):
+            return (
+                node_packets()
+                .filter(RXPacket.portnum == portnum)
+                .join(detail)
+                .options(contains_eager(detail))
+                .order_by(RXPacket.ts.desc())
+                .first()
+            )
+
+        latest_position = latest_with('POSITION_APP', RXPacket.position)
+        latest_device_metrics = latest_with('TELEMETRY_APP', RXPacket.device_metrics)
+        latest_environment_metrics = latest_with('TELEMETRY_APP', RXPacket.environment_metrics)
+
+        return NodeReport(node, portnums, latest_position, latest_device_metrics, latest_environment_metrics)
@@ -0,0 +1,149 @@
+"""Database maintenance commands. Uses the same config (config.json or env vars) as the bot.
+
+Usage:
+    python db_maintenance.py rebuild-node-activity [--publisher <node num>]
+    python db_maintenance.py rollup-telemetry
+    python db_maintenance.py apply-retention [--days PORTNUM=DAYS,...]
+    python db_maintenance.py replay <archive dir or .jsonl file> [--start DATE] [--end DATE] [--workers N]
+"""
+import argparse
+import datetime
+import logging
+import os
+import time
+
+import db_base
+from config_classes import Config
+from database_client import RetentionJob, create_tables
+from db_classes import NodeActivity
+from packet_replay import ArchiveSource, BulkPacketWriter, JsonlSource, PacketReplay, ReplayCheckpoint
+from partitions import RXPacketPartitionManager
+
+
+def rebuild_node_activity(engine, config, args):
+    # NOTE: packets received by a running bot while this runs may be counted twice or not at all.
+    # Stop the bot first for exact counts.
+    tic = time.time()
+    with engine.begin() as conn:
+        pkt_cnt = NodeActivity.rebuild(conn, publisher_mesh_node_num=args.publisher)
+    logging.info(f'rebuild-node-activity: read {pkt_cnt} packets in {time.time() - tic:.1f}s')
+
+
+def rollup_telemetry(engine, config, args):
+    # safe to run while the bot is running, the high-water mark is moved in the same transaction as the rollups
+    retention_info = config.retention_info
+    job = RetentionJob(engine, batch_size=retention_info.batch_size)
+    total = job.rollup_telemetry()
+    logging.info(f'rollup-telemetry: rolled up {total} packets')
+
+
+def apply_retention(engine, config, args):
+    retention_info = config.retention_info
+    db_info = config.database_info
+    partition_manager = None
+    if db_info.partition_rx_packets:
+        # does nothing unless rx_packets is actually partitioned (postgres)
+        partition_manager = RXPacketPartitionManager(months_ahead=db_info.partition_months_ahead)
+    days = Config.RetentionInfo({'days': args.days}).days if args.days else retention_info.days
+    if not days and not (partition_manager and retention_info.drop_partitions_days):
+        logging.info('apply-retention: no retention configured (retention_info.days), nothing to delete')
+        return
+    job = RetentionJob(engine, retention_days=days, batch_size=retention_info.batch_size,
+                       partition_manager=partition_manager, drop_partitions_days=retention_info.drop_partitions_days)
+    rolled_up, deleted = job.run_once()
+    logging.info(f'apply-retention: rolled up {rolled_up} telemetry packets, deleted {deleted}')
+
+
+def _epoch(value):
+    # ISO date or datetime, UTC unless it has an offset
+    if value is None:
+        return None
+    dt = datetime.datetime.fromisoformat(value)
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=datetime.timezone.utc)
+    return dt.timestamp()
+
+
+def replay(engine, config, args):
+    # packets already in the db are not skipped, see PacketReplay
+    start, end = _epoch(args.start), _epoch(args.end)
+    if os.path.isdir(args.source):
+        source = ArchiveSource(args.source, start=start, end=end)
+    else:
+        source = JsonlSource(args.source)
+
+    with engine.connect() as conn:
+        publisher_mesh_node_num, publisher_discord_bot_user_id = PacketReplay.publisher(conn)
+        publisher_mesh_node_num = args.publisher or publisher_mesh_node_num
+        publisher_discord_bot_user_id = args.bot_user_id or publisher_discord_bot_user_id
+        if publisher_mesh_node_num is None or publisher_discord_bot_user_id is None:
+            logging.error('replay: no bot has started on this database yet, pass --publisher and --bot-user-id')
+            return
+        nodes = PacketReplay.known_nodes(conn, publisher_mesh_node_num)
+
+    db_info = config.database_info
+    partition_manager = None
+    if db_info.partition_rx_packets:
+        partition_manager = RXPacketPartitionManager(months_ahead=db_info.partition_months_ahead)
+
+    checkpoint = ReplayCheckpoint(args.checkpoint)
+    if args.restart:
+        checkpoint.clear()
+    try:
+        position = checkpoint.load(source)
+    except ValueError as e:
+        logging.error(f'replay: {e}')
+        return
+
+    job = PacketReplay(source, BulkPacketWriter(engine, partition_manager=partition_manager), publisher_mesh_node_num,
+                       publisher_discord_bot_user_id, nodes=nodes, workers=args.workers, batch_size=args.batch_size,
+                       checkpoint=checkpoint, start=start, end=end)
+    stats = job.run(position)
+
+    if stats.packets and not args.skip_node_activity:
+        with engine.begin() as conn:
+            NodeActivity.rebuild(conn)
+        logging.info('replay: rebuilt node_activity')
+
+
+def main():
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] %(message)s")
+
+    parser = argparse.ArgumentParser(description='MeshBot database maintenance')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    rebuild_parser = subparsers.add_parser('rebuild-node-activity', help='Recalculate the node_activity summary (used by /active and /all_nodes) from rx_packets')
+    rebuild_parser.add_argument('--publisher', help='Only rebuild for this bot node num (default: all)')
+    rebuild_parser.set_defaults(func=rebuild_node_activity)
+
+    rollup_parser = subparsers.add_parser('rollup-telemetry', help='Roll up new TELEMETRY_APP packets into the telemetry_hourly/telemetry_daily tables')
+    rollup_parser.set_defaults(func=rollup_telemetry)
+
+    retention_parser = subparsers.add_parser('apply-retention', help='Roll up telemetry, then delete rx_packets older than the retention for their portnum')
+    retention_parser.add_argument('--days', help='Retention to apply instead of the configured one, e.g. TELEMETRY_APP=30,POSITION_APP=90')
+    retention_parser.set_defaults(func=apply_retention)
+
+    replay_parser = subparsers.add_parser('replay', help='Parse archived packets (archive_info.dir) or a JSON lines capture again and write them to rx_packets')
+    replay_parser.add_argument('source', help='Packet archive directory, or a .jsonl file with one packet dict per line')
+    replay_parser.add_argument('--start', help='Only replay packets received at or after this time (ISO format, UTC unless given)')
+    replay_parser.add_argument('--end', help='Only replay packets received before this time')
+    replay_parser.add_argument('--publisher', type=int, help='Bot node num to record as the publisher (default: the last bot that started on the db)')
+    replay_parser.add_argument('--bot-user-id', type=int, help='Discord bot user ID to record (default: the last bot that started on the db)')
+    replay_parser.add_argument('--workers', type=int, help='Parsing processes, 0 parses in this process (default: number of CPUs)')
+    replay_parser.add_argument('--batch-size', type=int, default=5000, help='Packets per transaction (default: 5000)')
+    replay_parser.add_argument('--checkpoint', default='replay_checkpoint.json', help='Progress file, a replay of the same source continues from it (default: replay_checkpoint.json)')
+    replay_parser.add_argument('--restart', action='store_true', help='Ignore the checkpoint and start from the beginning')
+    replay_parser.add_argument('--skip-node-activity', action='store_true', help="Don't rebuild the node_activity summary afterwards")
+    replay_parser.set_defaults(func=replay)
+
+    args = parser.parse_args()
+
+    config = Config()
+    engine = db_base.create_db_engine(config.database_info)
+    create_tables(engine, config.database_info)
+
+    args.func(engine, config, args)
+
+
+if __name__ == '__main__':
+    main()
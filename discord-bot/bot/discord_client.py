@@ -1,68 +1,149 @@
 import logging
-import queue
 import asyncio
+import time
 from functools import wraps
 
 import discord
 from discord import app_commands
 
+import metrics
 import util
+from message_cache import MessageCache
+from message_packer import pack_messages, SendPacer, MAX_DESCRIPTION_CHARS, MAX_EMBEDS_PER_MSG, MAX_EMBED_CHARS_PER_MSG
 from version import __version__
 
+
+class RateLimitMetricsHandler(logging.Handler):
+    '''Counts the seconds discord.py sleeps after a 429, from its log message (it has no hook for them).'''
+
+    retry_message = 'We are being rate limited. %s %s responded with 429. Retrying in %.2f seconds.'
+
+    def emit(self, record):
+        if record.msg == self.retry_message and record.args:
+            metrics.discord_ratelimit_sleep_seconds.labels(source='discord').inc(record.args[-1])
+
+
 class DiscordBot(discord.Client):
-    def __init__(self, mesh_client, config, *args, **kwargs):
+    def __init__(self, mesh_router, config, *args, **kwargs):
 
         self.config = config
-        self._discordqueue = queue.Queue(maxsize=20)
-        self._discord_msg_thread_queue = queue.Queue(maxsize=20)
 
-        self._meshresponsequeue = queue.Queue(maxsize=20)
+        # asyncio queues, fed from the mesh threads with loop.call_soon_threadsafe (see _put_threadsafe)
+        self._discordqueue = asyncio.Queue()
+        self._discord_msg_thread_queue = asyncio.Queue()
+
+        self._meshresponsequeue = asyncio.Queue()
+
+        self._event_loop = None
+        self.bg_tasks = None
+
+        # embeds of sent messages, and edits waiting to be sent (message id -> embed), see _schedule_edit
+        self._message_cache = MessageCache(self.message_cache_size)
+        self._pending_edits = {}
+        self._edit_traces = {}  # message id -> tracing.Traces waiting for that edit
+        self._edit_tasks = set()
+        self.edits_sent = 0
+        self.edits_coalesced = 0
 
-        self.mesh_client = mesh_client
-        self.mesh_client.link_discord(self)
+        # the radios (MeshClients) this bot posts for, see mesh_router.py
+        self.mesh_router = mesh_router
+        self.mesh_router.link_discord(self)
 
         super().__init__(*args, **kwargs)
         self.tree = app_commands.CommandTree(self)
+
+        for name, q in (('discord', self._discordqueue), ('discord_msg_thread', self._discord_msg_thread_queue), ('mesh_response', self._meshresponsequeue)):
+            metrics.queue_depth.labels(queue=name).set_function(q.qsize)
+        # NaN until the first heartbeat
+        metrics.discord_gateway_latency_seconds.set_function(lambda: self.latency)
         # TODO maybe move the mesh parts into a separate class or dict to not possibly conflict with discord.Client super class
         self.channel = None
         self.dis_channel_id = int(self.config.discord_channel_id)
 
 
-    # async def setup_hook(self) -> None:  # Create the background task and run it in the background.
-    #     self.bg_task = self.loop.create_task(self.background_task())
-    #     await self.tree.sync()
+    # discord embeds per message, total characters per message and characters per embed description
+    max_embeds_per_msg = MAX_EMBEDS_PER_MSG
+    max_embed_chars_per_msg = MAX_EMBED_CHARS_PER_MSG
+    max_embed_description_chars = MAX_DESCRIPTION_CHARS
+
+    # how often the mesh side housekeeping (heartbeat, mesh queue) runs
+    mesh_process_interval = 0.5
+
+    # sent messages whose embeds are kept for editing, and how long edits to one message are held to be combined
+    message_cache_size = 500
+    edit_coalesce_delay = 1.0
+
+    async def setup_hook(self) -> None:
+        # the loop the queue consumers run on, the mesh threads hand items to it
+        self._event_loop = asyncio.get_running_loop()
+        self._time_http_requests()
+
+    def _time_http_requests(self):
+        """Times every REST request (including discord.py's rate limit waits) in metrics.discord_request_seconds."""
+        request = self.http.request
+
+        @wraps(request)
+        async def timed_request(route, **kwargs):
+            tic = time.perf_counter()
+            try:
+                return await request(route, **kwargs)
+            finally:
+                metrics.discord_request_seconds.labels(method=route.method, route=route.path).observe(time.perf_counter() - tic)
+
+        self.http.request = timed_request
+        if not any(isinstance(h, RateLimitMetricsHandler) for h in logging.getLogger('discord.http').handlers):
+            logging.getLogger('discord.http').addHandler(RateLimitMetricsHandler())
 
     async def on_ready(self):
         logging.info(f'Logged in as {self.user} (ID: {self.user.id})')
-        self.bg_task = self.loop.create_task(self.background_task())
-        self.mesh_client.connect() # once discord is ready... conncet to mesh
+        self.channel = self.get_channel(self.dis_channel_id)
+        if self.bg_tasks is None:
+            self.bg_tasks = [
+                self.loop.create_task(self._consume_queue(self._discordqueue, '_discordqueue', self.process_discord_msgs)),
+                self.loop.create_task(self._consume_queue(self._meshresponsequeue, '_meshresponsequeue', self.process_mesh_responses)),
+                self.loop.create_task(self._consume_queue(self._discord_msg_thread_queue, '_discord_msg_thread_queue', self.process_discord_msg_threads)),
+                self.loop.create_task(self.mesh_background_task()),
+            ]
+        self.mesh_router.connect() # once discord is ready... conncet to mesh
         await self.tree.sync()
 
     def check_channel_id(self, other_channel_id):
         return other_channel_id == self.dis_channel_id
 
-    def enqueue_msg(self, msg, close_after=False):
-        self._discordqueue.put((msg, close_after))
+    def _put_threadsafe(self, q, item):
+        """Puts an item on one of the asyncio queues. Safe to call from any thread, never blocks."""
+        loop = self._event_loop
+        if loop is None or loop.is_closed():
+            # nothing is consuming yet, so there's no one to race with
+            q.put_nowait(item)
+        else:
+            loop.call_soon_threadsafe(q.put_nowait, item)
+
+    def enqueue_msg(self, msg, close_after=False, trace=None):
+        if trace is not None:
+            trace.hold().mark('discord_queued')
+        self._put_threadsafe(self._discordqueue, (msg, close_after, trace))
 
     def enqueue_msg_thread(self, msg):
-        self._discord_msg_thread_queue.put(msg)
+        self._put_threadsafe(self._discord_msg_thread_queue, msg)
 
     # def enqueue_msg_chain(self, msg, discord_interaction_id, close_after=False):
 
-    def enqueue_ack(self, ack_obj):
+    def enqueue_ack(self, ack_obj, discord_message_id, trace=None):
         self._enqueue_mesh_response({
             'msg_type': 'ACK',
-            'discord_message_id': ack_obj.tx_packet.discord_message_id,
+            'discord_message_id': discord_message_id,
             'response_from_id': ack_obj.ack_packet.src_id,
+            'response_from_descriptive': ack_obj.ack_packet.src_descriptive,
             'response_rx_rssi': ack_obj.ack_packet.rx_rssi_str,
             'response_rx_snr': ack_obj.ack_packet.rx_snr_str,
             'response_hop_start': ack_obj.ack_packet.hop_start,
             'response_hop_limit': ack_obj.ack_packet.hop_limit,
             'is_implicit': ack_obj.implicit_ack,
             'ack_error_reason': ack_obj.ack_packet.error_reason
-        })
+        }, trace)
 
-    def enqueue_mesh_text_msg_received(self, packet):
+    def enqueue_mesh_text_msg_received(self, packet, trace=None):
 
         mesh_channel_index = packet.channel
         if mesh_channel_index is None:
@@ -92,7 +173,7 @@ class DiscordBot(discord.Client):
             embed.add_field(name="To Node", value=packet.dst_descriptive, inline=True)
 
         logging.info(f'Putting Mesh Received message on Discord queue')
-        self.enqueue_msg(embed)
+        self.enqueue_msg(embed, trace=trace)
 
     def enqueue_mesh_ready(self, node_descriptor, modem_preset, batterylevel=None):
         # TODO: Check if this is enabled in config
@@ -126,21 +207,83 @@ class DiscordBot(discord.Client):
             'error_text': error_text,
         })
 
-    def enqueue_tx_confirmation(self, discord_message_id):
+    def enqueue_tx_confirmation(self, discord_message_id, trace=None):
         self._enqueue_mesh_response({
             'msg_type': 'TX_CONFIRMATION',
             'discord_message_id': discord_message_id,
-        })
+        }, trace)
 
-    def enqueue_tx_confirmation_dm(self, discord_message_id, node_descriptor):
+    def enqueue_tx_confirmation_dm(self, discord_message_id, node_descriptor, trace=None):
         self._enqueue_mesh_response({
             'msg_type': 'TX_CONFIRMATION_DM',
             'discord_message_id': discord_message_id,
             'node_descriptive_name': node_descriptor,
-        })
-
-    def _enqueue_mesh_response(self, msg):
-        self._meshresponsequeue.put(msg)
+        }, trace)
+
+    def _enqueue_mesh_response(self, msg, trace=None):
+        # the trace (of the sent message) is held until the discord message has been edited
+        if trace is not None:
+            msg['trace'] = trace.hold()
+        self._put_threadsafe(self._meshresponsequeue, msg)
+
+    def cache_message(self, message_id, embed):
+        """Remembers the embed of a message the bot sent, so mesh responses can edit it without fetching it first."""
+        self._message_cache.put(message_id, embed)
+
+    @property
+    def message_cache(self):
+        return self._message_cache
+
+    async def _get_embed(self, message_id):
+        """The embed to edit for a message: the one waiting to be sent, the cached one, or fetched from discord."""
+        embed = self._pending_edits.get(message_id)
+        if embed is None:
+            embed = self._message_cache.get(message_id)
+        if embed is None:
+            message = await self.channel.fetch_message(message_id)
+            embed = self._message_cache.put(message_id, message.embeds[0])
+        return embed
+
+    def _schedule_edit(self, message_id, embed, trace=None):
+        """Edits the message to embed after edit_coalesce_delay. Any other edits made to embed in the
+        meantime (e.g. the TX confirmation, then an implicit and an explicit ACK) go out with the same edit."""
+        if trace is not None:
+            self._edit_traces.setdefault(message_id, []).append(trace.hold())
+        if message_id in self._pending_edits:
+            self.edits_coalesced += 1
+            return
+        self._pending_edits[message_id] = embed
+        task = asyncio.create_task(self._delayed_edit(message_id))
+        self._edit_tasks.add(task)
+        task.add_done_callback(self._edit_tasks.discard)
+
+    async def _delayed_edit(self, message_id):
+        await asyncio.sleep(self.edit_coalesce_delay)
+        await self._send_edit(message_id)
+
+    async def _send_edit(self, message_id):
+        embed = self._pending_edits.pop(message_id, None)
+        if embed is None:
+            return
+        traces = self._edit_traces.pop(message_id, [])
+        stage = 'discord_edit_failed'
+        try:
+            await self.channel.get_partial_message(message_id).edit(embed=embed)
+            self.edits_sent += 1
+            stage = 'discord_edited'
+        except discord.NotFound:
+            logging.error(f'Message {message_id} not found (deleted?), dropping edit')
+            self._message_cache.discard(message_id)
+        except Exception as e:
+            logging.exception(f'Exception editing message {message_id}', exc_info=e)
+        finally:
+            for trace in traces:
+                trace.release(stage)
+
+    async def flush_edits(self):
+        """Sends all the edits that are waiting, without waiting for edit_coalesce_delay."""
+        for message_id in list(self._pending_edits):
+            await self._send_edit(message_id)
 
     async def process_discord_msg_thread(self, msg):
         """Takes in a message thread packet
@@ -155,6 +298,9 @@ class DiscordBot(discord.Client):
             'original_message_edit': <int>  # (optional) This is the original message edit index
             'original_message_edit_color': <int>  # (optional) Edit the original message to this color
         }
+        The thread content is packed into as few messages as discord allows (see message_packer.pack_messages),
+        text items become embed descriptions. If there is a thread, the time it took to send is added to the
+        original_msg_field value.
         """
         thread_name = msg.get('thread_name', None)
         content = msg.get('content', [])
@@ -165,50 +311,47 @@ class DiscordBot(discord.Client):
         original_message_edit = msg.get('original_message_edit', None)
         original_message_edit_color = msg.get('original_message_edit_color', None)
 
-        original_message = await self.channel.fetch_message(original_msg_id)
+        if isinstance(content, (str, discord.Embed)):
+            content = [content]
+
+        tic = time.perf_counter()
+        original_message = self.channel.get_partial_message(original_msg_id)
+        send_info = None
         if thread_name:
             thread = await original_message.create_thread(name=thread_name, auto_archive_duration=60)
             thread_obj = self.channel.get_thread(thread.id)
 
-            if first_msg:
-                if isinstance(first_msg, discord.Embed):
-                    await thread_obj.send(embed=first_msg)
-                else:
-                    await thread_obj.send(first_msg)
-
-            if isinstance(content, list):
-                for item in content:
-                    if isinstance(item, discord.Embed):
-                        await thread_obj.send(embed=item)
-                    else:
-                        await thread_obj.send(item)
-            elif isinstance(content, discord.Embed):
-                await thread_obj.send(embed=content)
-            elif isinstance(content, str):
-                await thread_obj.send(content)
-
-            if final_msg:
-                if isinstance(final_msg, discord.Embed):
-                    await thread_obj.send(embed=final_msg)
-                else:
-                    await thread_obj.send(final_msg)
+            items = [x for x in [first_msg, *content, final_msg] if x]
+            messages = pack_messages(items, max_description=self.max_embed_description_chars, max_embeds=self.max_embeds_per_msg, max_chars=self.max_embed_chars_per_msg)
+
+            pacer = SendPacer()
+            for embeds in messages:
+                await pacer.wait()
+                await thread_obj.send(embeds=embeds)
+
+            toc = time.perf_counter() - tic
+            send_info = f'Sent {len(messages)} messages in {util.convert_secs_to_pretty(toc)}'
+            logging.info(f'Thread {thread_name}: {len(items)} items in {len(messages)} messages, took {toc:.2f}s ({pacer.waited:.2f}s pacing)')
         else:
             thread_obj = None
 
         # option to edit the original message, assumes its an embed and only lets you add/edit 1 field in the embed
         if original_msg_field:
             # edit the original message
-            e = original_message.embeds[0]
+            e = await self._get_embed(original_msg_id)
+            field_items = original_msg_field.return_field_items()
+            if send_info:
+                field_items['value'] = f"{field_items['value']}\n{send_info}"
             # if edit is None, add new field, otherwise edit the field given
             if original_message_edit is None:
-                e.add_field(**original_msg_field.return_field_items())
+                e.add_field(**field_items)
             else:
-                e.set_field_at(int(original_message_edit), **original_msg_field.return_field_items())
+                e.set_field_at(int(original_message_edit), **field_items)
             # edit color if given
             if original_message_edit_color:
                 e.color = original_message_edit_color
             # save edits
-            await original_message.edit(embed=e)
+            self._schedule_edit(original_msg_id, e)
 
         if thread_obj:
             # Then end thread
@@ -217,6 +360,17 @@ class DiscordBot(discord.Client):
 
     async def process_mesh_response(self, msg):
         msg_type = msg.get('msg_type')
+        trace = msg.get('trace')
+        if trace is None:
+            await self._process_mesh_response(msg, msg_type, trace)
+            return
+        trace.mark(f'{msg_type.lower()}_dequeued')
+        try:
+            await self._process_mesh_response(msg, msg_type, trace)
+        finally:
+            trace.release()
+
+    async def _process_mesh_response(self, msg, msg_type, trace):
 
         if msg_type == 'ACK':
 
@@ -229,8 +383,6 @@ class DiscordBot(discord.Client):
 
             ack_by_id = msg.get('response_from_id')
 
-            message = await self.channel.fetch_message(msg_id)
-
             ack_time_str = f'ACK Time: {util.get_current_time_str()}'
 
             is_implicit = msg.get('is_implicit', True)
@@ -260,7 +412,7 @@ class DiscordBot(discord.Client):
                 ack_text_2.append('**ACK Type:**: Explicit')
                 # if ack_error:
                 ack_text_2.append(f'**Error Reason:** {ack_error}')
-                ack_text_2.append(f'**Node:**: {self.mesh_client.get_node_descriptive_string(node_id=ack_by_id)}')
+                ack_text_2.append(f'**Node:**: {msg.get("response_from_descriptive") or ack_by_id}')
 
             if signal_metrics_available:
                 ack_text_2.append(f'**RSSI/SNR:** {rx_rssi}/{rx_snr}')
@@ -268,11 +420,11 @@ class DiscordBot(discord.Client):
             ack_text_2.append(f'**Hop Start/Limit:** {hop_start}/{hop_limit}')
 
 
-            e = message.embeds[0]
+            e = await self._get_embed(msg_id)
             e.color = util.MeshBotColors.TX_ACK()
             e.set_field_at(1, name='TX State', value=ack_text)
             e.add_field(name='ACK Info', value='\n'.join(ack_text_2), inline=False)
-            await message.edit(embed=e)
+            self._schedule_edit(msg_id, e, trace)
 
         elif msg_type == 'TX_CONFIRMATION':
 
@@ -283,13 +435,11 @@ class DiscordBot(discord.Client):
                 logging.error('No discord_message_id found in mesh response.')
                 return
 
-            message = await self.channel.fetch_message(msg_id)
-
             # modify the original message
-            e = message.embeds[0]
+            e = await self._get_embed(msg_id)
             e.color = util.MeshBotColors.TX_SENT()
             e.set_field_at(1, name='TX State', value='Sent')
-            await message.edit(embed=e)
+            self._schedule_edit(msg_id, e, trace)
 
         elif msg_type == 'TX_CONFIRMATION_DM':
 
@@ -302,14 +452,12 @@ class DiscordBot(discord.Client):
 
             node_descriptor = msg.get('node_descriptive_name')
 
-            message = await self.channel.fetch_message(msg_id)
-
             # modify the original message
-            e = message.embeds[0]
+            e = await self._get_embed(msg_id)
             e.color = util.MeshBotColors.TX_SENT()
             e.set_field_at(0, name='To Node', value=node_descriptor, inline=False)
             e.set_field_at(1, name='TX State', value='Sent', inline=False)
-            await message.edit(embed=e)
+            self._schedule_edit(msg_id, e, trace)
 
         elif msg_type == 'TX_ERROR':
 
@@ -322,68 +470,94 @@ class DiscordBot(discord.Client):
 
             error_text = msg.get('error_text')
 
-            message = await self.channel.fetch_message(msg_id)
-
             # modify the original message
-            e = message.embeds[0]
+            e = await self._get_embed(msg_id)
             e.color = util.MeshBotColors.error()
             e.set_field_at(1, name='TX State', value='Error')
             e.add_field(name='Error Description', value=error_text, inline=False)
-            await message.edit(embed=e)
-
-    async def background_task(self):
-        await self.wait_until_ready()
-        counter = 0
-        self.channel = self.get_channel(self.dis_channel_id)
-
-        while not self.is_closed():
-            # handle messages coming from mesh to discord
-            try:
-                meshmessage = self._discordqueue.get_nowait()
-                close_after = False
-                if isinstance(meshmessage, tuple):
-                    msg = meshmessage[0]
-                    close_after = meshmessage[1]
-                else:
-                    msg = meshmessage
-
-                if isinstance(msg, discord.Embed):
-                    await self.channel.send(embed=msg)
-                else:
-                    await self.channel.send(msg)
-
-                if close_after:
-                    await asyncio.sleep(0.1)
-                    await self.close()
+            self._schedule_edit(msg_id, e)
+
+    async def process_discord_msgs(self, batch):
+        """Sends a batch of (msg, close_after, trace) items from _discordqueue.
+        Consecutive embeds are combined into as few messages as discord allows."""
+        embeds = []
+        embed_chars = 0
+        traces = []
+
+        async def send_embeds():
+            nonlocal embeds, embed_chars, traces
+            if embeds:
+                for trace in traces:
+                    trace.mark('discord_send')
+                await self.channel.send(embeds=embeds)
+                for trace in traces:
+                    trace.release('discord_sent')
+            embeds = []
+            embed_chars = 0
+            traces = []
+
+        for msg, close_after, trace in batch:
+            if isinstance(msg, discord.Embed):
+                if len(embeds) >= self.max_embeds_per_msg or embed_chars + len(msg) > self.max_embed_chars_per_msg:
+                    await send_embeds()
+                embeds.append(msg)
+                embed_chars += len(msg)
+                if trace is not None:
+                    traces.append(trace)
+            else:
+                await send_embeds()
+                await self.channel.send(msg)
+                if trace is not None:
+                    trace.release('discord_sent')
+
+            if close_after:
+                await send_embeds()
+                await self.flush_edits()
+                await asyncio.sleep(0.1)
+                await self.close()
+                return
 
-                self._discordqueue.task_done()
-            except queue.Empty:
-                pass
-            except Exception as e:
-                logging.exception('Exception processing discord queue', exc_info=e)
+        await send_embeds()
 
+    async def process_mesh_responses(self, batch):
+        for msg in batch:
             try:
-                meshresponse = self._meshresponsequeue.get_nowait()
-                await self.process_mesh_response(meshresponse)
-                self._meshresponsequeue.task_done()
-            except queue.Empty:
-                pass
+                await self.process_mesh_response(msg)
             except Exception as e:
                 logging.exception('Exception processing _meshresponsequeue', exc_info=e)
 
+    async def process_discord_msg_threads(self, batch):
+        for thread_packet in batch:
             try:
-                thread_packet = self._discord_msg_thread_queue.get_nowait()
                 await self.process_discord_msg_thread(thread_packet)
-                self._discord_msg_thread_queue.task_done()
-            except queue.Empty:
-                pass
             except Exception as e:
                 logging.exception('Exception processing _discord_msg_thread_queue', exc_info=e)
 
-            # process stuff on mesh side
-            self.mesh_client.background_process()
+    async def _consume_queue(self, q, name, handler, batch_size=20):
+        """Waits for items on q and hands everything that is waiting (up to batch_size) to handler."""
+        await self.wait_until_ready()
+        while not self.is_closed():
+            batch = [await q.get()]
+            while len(batch) < batch_size and not q.empty():
+                batch.append(q.get_nowait())
+            try:
+                await handler(batch)
+            except Exception as e:
+                logging.exception(f'Exception processing {name}', exc_info=e)
+            finally:
+                for _ in batch:
+                    q.task_done()
+        logging.info(f'Discord client {name} consumer finished.')
 
-            await asyncio.sleep(0.5)
+    async def mesh_background_task(self):
+        await self.wait_until_ready()
+        while not self.is_closed():
+            # process stuff on mesh side
+            try:
+                self.mesh_router.background_process()
+            except Exception as e:
+                logging.exception('Exception in mesh background process', exc_info=e)
+            await asyncio.sleep(self.mesh_process_interval)
         logging.info('Discord client background task finished.')
 
     @staticmethod
@@ -10,13 +10,18 @@ from discord import ButtonStyle
 from discord.ui import View, Button
 import pytz
 from pprint import pprint
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker
 import db_base
+from db_base import create_db_engine
 import db_classes
 from functools import wraps
 from config_classes import Config
-from mesh_client import MeshClient
+from mesh_router import MeshRouter
+from database_client import RXPacketWriter, RetentionJob, create_tables
+from packet_archive import PacketArchiveWriter
+import metrics
+import prometheus_client
+from tracing import Trace
+from query_service import QueryService, QueryTimeout
 from discord_client import DiscordBot
 from util import get_current_time_str, uptime_str, get_current_time_discord_str, convert_secs_to_pretty, get_discord_ts_from_ts
 from util import MeshBotColors, DiscordInteractionInfo, embed_field, get_discord_ts_from_dt
@@ -53,19 +58,59 @@ class HelpView(View):
         self.add_item(Button(label="Meshmap", style=ButtonStyle.link, url="https://meshmap.net"))
         self.add_item(Button(label="Python Meshtastic Docs", style=ButtonStyle.link, url="https://python.meshtastic.org/index.html"))
 
+def query_timeout_embed(command_name):
+    return discord.Embed(
+        title='Database Busy',
+        description=f'/{command_name} took too long to read from the database. Try again in a bit.',
+        color=MeshBotColors.error()
+    )
+
 config = Config()
 db_info = config.database_info
 
 # Setup database connection
-DATABASE_URL = db_info._db_connection_string
-engine = create_engine(DATABASE_URL)
-db_base.Base.metadata.create_all(engine)
-Session = sessionmaker(bind=engine)
-session = Session()
-
-# Create the mesh client and discord client
-mesh_client = MeshClient(db_session=session, config=config) # create the mesh client but do not connect yet
-discord_client = DiscordBot(mesh_client, config, intents=discord.Intents.default())
+engine = create_db_engine(db_info)
+partition_manager = create_tables(engine, db_info)
+# per-thread sessions, use db_base.session_scope() for each unit of work
+db_base.Session.configure(bind=engine)
+
+# received packets are written to the db in batches on their own thread
+rx_writer = RXPacketWriter(engine, flush_interval=db_info.rx_flush_interval, batch_size=db_info.rx_batch_size)
+rx_writer.start()
+
+# raw copy of every received packet, written on its own thread
+archive_info = config.archive_info
+packet_archive = None
+if archive_info.enabled:
+    packet_archive = PacketArchiveWriter(archive_info.archive_dir, segment_max_bytes=int(archive_info.segment_max_mb * 1024 * 1024),
+                                         segment_max_age=archive_info.segment_max_age, block_bytes=archive_info.block_kb * 1024,
+                                         flush_interval=archive_info.flush_interval)
+    packet_archive.start()
+
+# telemetry rollups and deleting old raw packets, on their own thread
+retention_info = config.retention_info
+retention_job = RetentionJob(engine, retention_days=retention_info.days, interval=retention_info.interval, batch_size=retention_info.batch_size,
+                             partition_manager=partition_manager, drop_partitions_days=retention_info.drop_partitions_days)
+retention_job.start()
+
+# received packets and sent messages slower than this get their stage times logged, see tracing.py
+tracing_info = config.tracing_info
+Trace.slow_seconds = {'rx': tracing_info.slow_rx_seconds, 'tx': tracing_info.slow_tx_seconds}
+
+# prometheus endpoint for the metrics in metrics.py, on its own thread
+metrics_info = config.metrics_info
+metrics_server = None
+if metrics_info.enabled:
+    metrics_server, _ = prometheus_client.start_http_server(metrics_info.port, addr=metrics_info.host, registry=metrics.registry)
+    logging.info(f'Serving metrics at http://{metrics_info.host}:{metrics_info.port}/metrics')
+
+# db reads for slash commands run on worker threads, not on the discord event loop
+query_service = QueryService(workers=db_info.query_workers, timeout=db_info.query_timeout)
+
+# Create the mesh clients (one per radio) and discord client
+mesh_router = MeshRouter(config=config, rx_writer=rx_writer, packet_archive=packet_archive) # create the mesh clients but do not connect yet
+mesh_client = mesh_router.default # answers the node list and debug commands
+discord_client = DiscordBot(mesh_router, config, intents=discord.Intents.default())
 
 # discord commands
 @discord_client.tree.command(name="help", description="Shows the help message.")
@@ -102,20 +147,27 @@ async def help_command(interaction: discord.Interaction):
 @discord_client.only_in_channel(discord_client.dis_channel_id)
 async def dm(interaction: discord.Interaction, node: str, message: str):
     logging.info(f'/dm command received. Node Input: {node}. Sending message: {message}')
+    trace = Trace('tx', f'/dm to {node}')
 
     current_time = get_current_time_str()
 
+    # resolved once here, the mesh thread sends to node_ref.num without parsing the input again
+    dm_client, node_ref = mesh_router.route_dm(node)
+
     # craft message
     embed = discord.Embed(title="Sending Message", description=message, color=MeshBotColors.TX_PENDING())
-    embed.add_field(name="To Node", value=f'{node}', inline=False)
+    embed.add_field(name="To Node", value=node_ref.descriptive_string if node_ref.found else f'{node}', inline=False)
     embed.add_field(name='TX State', value='Pending', inline=False)
-    embed.set_footer(text=f"{current_time}")
+    embed.set_footer(text=f"{current_time} via {dm_client.name}" if len(mesh_router) > 1 else f"{current_time}")
     # send message to discord
     out = await interaction.response.send_message(embed=embed)
+    discord_client.cache_message(out.message_id, embed)
+    trace.mark('discord_replied')
 
     # queue message to be sent on mesh
     discord_interaction_info = DiscordInteractionInfo(interaction.guild_id, interaction.channel_id, out.message_id)
-    mesh_client.enqueue_send_dm(node, message, discord_interaction_info)
+    dm_client.enqueue_send_dm(node_ref, message, discord_interaction_info, trace)
+    trace.release()
 
 # Dynamically create commands based on mesh_channel_names
 for mesh_channel_index, mesh_channel_name in config.channel_names.items():
@@ -123,17 +175,22 @@ for mesh_channel_index, mesh_channel_name in config.channel_names.items():
     @discord_client.only_in_channel(discord_client.dis_channel_id)
     async def send_channel_message(interaction: discord.Interaction, message: str, mesh_channel_index: int = mesh_channel_index):
         logging.info(f'/{interaction.command.name} command received. Sending message: {message}')
+        trace = Trace('tx', f'/{interaction.command.name}')
         current_time = get_current_time_str()
+        channel_client = mesh_router.for_channel(mesh_channel_index)
 
         embed = discord.Embed(title=f"Sending Message", description=message, color=MeshBotColors.TX_PENDING())
         embed.add_field(name="To Channel", value=config.channel_names[mesh_channel_index], inline=False)
         embed.add_field(name='TX State', value='Pending', inline=False)
-        embed.set_footer(text=f"{current_time}")
+        embed.set_footer(text=f"{current_time} via {channel_client.name}" if len(mesh_router) > 1 else f"{current_time}")
 
         out = await interaction.response.send_message(embed=embed)
+        discord_client.cache_message(out.message_id, embed)
+        trace.mark('discord_replied')
 
         discord_interaction_info = DiscordInteractionInfo(interaction.guild_id, interaction.channel_id, out.message_id, interaction.user.id, interaction.user.display_name, interaction.user.global_name, interaction.user.name, interaction.user.mention)
-        mesh_client.enqueue_send_channel(mesh_channel_index, message, discord_interaction_info=discord_interaction_info)
+        channel_client.enqueue_send_channel(mesh_channel_index, message, discord_interaction_info=discord_interaction_info, trace=trace)
+        trace.release()
 
 
 # @discord_client.tree.command(name="traceroute", description="Traceroute a node.")
@@ -161,17 +218,22 @@ async def active(interaction: discord.Interaction, active_time: str='61'):
 
     # Send first message
     out = await interaction.response.send_message(embed=embed)
+    discord_client.cache_message(out.message_id, embed)
 
     tic = time.time()
     # Get message to reference later
     msg_id = out.message_id
 
-    chunks, num_results = mesh_client.get_nodes_from_db(time_limit=active_time)
+    try:
+        nodes, num_results = await query_service.run(mesh_client.get_nodes_from_db, time_limit=active_time)
+    except QueryTimeout:
+        await interaction.followup.send(embed=query_timeout_embed('active'))
+        return
 
-    if len(chunks) > 0 and active_time:
+    if len(nodes) > 0 and active_time:
         final_text = f'Finished listing active nodes for the last {active_time} minutes.'
         no_thread = False
-    elif len(chunks) == 0:
+    elif len(nodes) == 0:
         # No thread, edit original message
         final_text = None
         no_thread = True
@@ -195,12 +257,12 @@ async def active(interaction: discord.Interaction, active_time: str='61'):
         original_message_edit_color = MeshBotColors.error()
     else:
         thread_name = '/active cmd'
-        original_msg_field = embed_field(name="Results", value=f'{num_results} Found (Took {convert_secs_to_pretty(toc)})', inline=False)
+        original_msg_field = embed_field(name="Results", value=f'{num_results} Found (Query took {convert_secs_to_pretty(toc)})', inline=False)
         original_message_edit = None # None means add, 1 means replace first field
         original_message_edit_color = MeshBotColors.green()
 
     packet = {
-        'content': chunks,
+        'content': nodes,
         'thread_name': thread_name,
         'final_msg': final_msg,
         'original_msg_field': original_msg_field,
@@ -208,7 +270,7 @@ async def active(interaction: discord.Interaction, active_time: str='61'):
         'original_message_edit': original_message_edit,
         'original_message_edit_color': original_message_edit_color
     }
-    logging.info(f'Got nodes, formatted data, sending to enqueue_msg_thread. Total of {len(chunks)} chunks (of up to 10 items per chunk).')
+    logging.info(f'Got nodes, formatted data, sending to enqueue_msg_thread. Total of {len(nodes)} nodes.')
     discord_client.enqueue_msg_thread(packet)
 
 @discord_client.tree.command(name="nodeinfo", description="Gets info for a node from the database")
@@ -233,13 +295,21 @@ async def nodeinfo(interaction: discord.Interaction, node_id: str):
 
     embeds = []
 
-    n = mesh_client.get_node_num(node_id=node_id)
+    node_client, node_ref = mesh_router.resolve_node(node_id)
+    if not node_ref.found:
+        await interaction.followup.send(embed=discord.Embed(title=f"Error", description=node_ref.error, color=MeshBotColors.error()))
+        return
 
     # TODO: Should try to show RX packets even if the node doesn't exist in MeshNodeDB
 
 
-    # convert id to num to look up node
-    matching_nodes = mesh_client._db_session.query(db_classes.MeshNodeDB).filter(db_classes.MeshNodeDB.node_num == n).filter(db_classes.MeshNodeDB.publisher_mesh_node_num == mesh_client.my_node_info.node_num_str).all()
+    # read on a query worker (with its own session), not on the event loop
+    try:
+        matching_nodes, report = await query_service.run(db_classes.NodeReport.load, node_client.my_node_info.node_num_str, node_ref.num)
+    except QueryTimeout:
+        await interaction.followup.send(embed=query_timeout_embed('nodeinfo'))
+        return
+
     if len(matching_nodes) > 1:
         error_embed = discord.Embed(title=f"Error", description=f'More than 1 node matching ID: {node_id}', color=MeshBotColors.error())
         embeds.append(error_embed)
@@ -247,26 +317,22 @@ async def nodeinfo(interaction: discord.Interaction, node_id: str):
         error_embed = discord.Embed(title=f"Error", description=f'No node matching ID: {node_id}', color=MeshBotColors.error())
         embeds.append(error_embed)
     else:
-        matching_node = matching_nodes[0]
-        matching_packets = mesh_client._db_session.query(db_classes.RXPacket).filter(db_classes.RXPacket.src_num == matching_node.node_num).filter(db_classes.RXPacket.publisher_mesh_node_num == mesh_client.my_node_info.node_num_str).order_by(db_classes.RXPacket.ts.desc()).all()
-        portnums = list(set([x.portnum for x in matching_packets]))
+        matching_node = report.node
 
         ni_embed = discord.Embed(title=f"Node Info", description=f'From DB for Node: {node_id}', color=MeshBotColors.violet())
         ni_embed.add_field(name='Node ID/Name', value=matching_node.descriptive_name, inline=False)
 
-        # get first packet
-        first_matching_packet = matching_packets[0]
-        first_packet_type = first_matching_packet.portnum
-        first_packet_discord_ts = get_discord_ts_from_dt(first_matching_packet.ts)
-        ni_embed.add_field(name="Last Packet", value=f'{first_packet_type}\nReceived at: {first_packet_discord_ts}', inline=False)
+        # most recent packet
+        if report.last_ts is not None:
+            ni_embed.add_field(name="Last Packet", value=f'{report.last_portnum}\nReceived at: {get_discord_ts_from_dt(report.last_ts)}', inline=False)
+        else:
+            ni_embed.add_field(name="Last Packet", value='No packets received', inline=False)
 
-        ni_embed.add_field(name="Cnt Packets RX'd", value=f'{len(matching_packets)}', inline=False)
+        ni_embed.add_field(name="Cnt Packets RX'd", value=f'{report.pkt_count}', inline=False)
 
-        for portnum in portnums:
-            portnum_packets = [x for x in matching_packets if x.portnum == portnum]
-            latest_packet_for_portnum = portnum_packets[0]
-            discord_ts = get_discord_ts_from_dt(latest_packet_for_portnum.ts)
-            ni_embed.add_field(name=f"{portnum}", value=f'Count: {len(portnum_packets)}\nLatest: {discord_ts}', inline=False)
+        for portnum_summary in report.portnums:
+            discord_ts = get_discord_ts_from_dt(portnum_summary.latest_ts)
+            ni_embed.add_field(name=f"{portnum_summary.portnum}", value=f'Count: {portnum_summary.pkt_count}\nLatest: {discord_ts}', inline=False)
 
         if matching_node.hw_model is not None:
             ni_embed.add_field(name=f"HW Model", value=matching_node.hw_model, inline=False)
@@ -279,8 +345,8 @@ async def nodeinfo(interaction: discord.Interaction, node_id: str):
             discord_ts = get_discord_ts_from_dt(matching_node.upd_ts_nodeinfo)
             ni_embed.add_field(name=f"Node Info updated via NODEINFO_APP Packet", value=discord_ts, inline=False)
 
-        # get most recent position packet
-        latest_position_packet = mesh_client._db_session.query(db_classes.RXPacket).filter(db_classes.RXPacket.src_num == matching_node.node_num).filter(db_classes.RXPacket.portnum == 'POSITION_APP').filter(db_classes.RXPacket.publisher_mesh_node_num == mesh_client.my_node_info.node_num_str).order_by(db_classes.RXPacket.ts.desc()).first()
+        # most recent position packet
+        latest_position_packet = report.latest_position
         if latest_position_packet:
             lat = latest_position_packet.latitude
             lon = latest_position_packet.longitude
@@ -311,8 +377,8 @@ async def nodeinfo(interaction: discord.Interaction, node_id: str):
             embeds.append((position_embed, latest_position_packet.ts))
 
 
-        # get most recent position packet
-        latest_device_metrics_packet = mesh_client._db_session.query(db_classes.RXPacket).filter(db_classes.RXPacket.src_num == matching_node.node_num).filter(db_classes.RXPacket.publisher_mesh_node_num == mesh_client.my_node_info.node_num_str).filter(db_classes.RXPacket.portnum == 'TELEMETRY_APP').filter(db_classes.RXPacket.has_device_metrics == True).order_by(db_classes.RXPacket.ts.desc()).first()
+        # most recent device metrics packet
+        latest_device_metrics_packet = report.latest_device_metrics
         if latest_device_metrics_packet:
             device_metrics = latest_device_metrics_packet.telemetry_device_metrics
             # this will be JSON
@@ -332,7 +398,8 @@ async def nodeinfo(interaction: discord.Interaction, node_id: str):
                 device_info_embed.add_field(name='Updated via TELEMETRY_APP Packet', value=discord_ts, inline=False)
                 embeds.append((device_info_embed, latest_device_metrics_packet.ts))
 
-        latest_environment_metrics_packet = mesh_client._db_session.query(db_classes.RXPacket).filter(db_classes.RXPacket.src_num == matching_node.node_num).filter(db_classes.RXPacket.publisher_mesh_node_num == mesh_client.my_node_info.node_num_str).filter(db_classes.RXPacket.portnum == 'TELEMETRY_APP').filter(db_classes.RXPacket.has_environment_metrics == True).order_by(db_classes.RXPacket.ts.desc()).first()
+        # most recent environment metrics packet
+        latest_environment_metrics_packet = report.latest_environment_metrics
         if latest_environment_metrics_packet:
             env_metrics = latest_environment_metrics_packet.telemetry_environment_metrics
             # this will be JSON
@@ -371,21 +438,28 @@ async def nodeinfo(interaction: discord.Interaction, node_id: str):
 async def describe_self(interaction: discord.Interaction):
     logging.info(f'/self received.')
 
-    text = [
-        f'**MeshBot Version:** {__version__}',
-        f'**Node ID:** {mesh_client.my_node_info.user_info.user_id}',
-        f'**Node Num:** {mesh_client.my_node_info.node_num_str}',
-        f'**Discord Bot ID:** {discord_client.user.id}',
-        f'**Short Name:** {mesh_client.my_node_info.user_info.short_name}',
-        f'**Long Name:** {mesh_client.my_node_info.user_info.long_name}',
-        f'**MAC Address:** {mesh_client.my_node_info.user_info.mac_address}',
-        f'**HW Model:** {mesh_client.my_node_info.user_info.hw_model}',
-        f'**Battery Level:** {mesh_client.my_node_info.device_metrics.battery_level}%',
-        f'**Battery Voltage:** {mesh_client.my_node_info.device_metrics.voltage}V',
-    ]
-
-    embed = discord.Embed(title='Local Node Information', description='\n'.join(text))
-    await interaction.response.send_message(embed=embed)
+    # one embed per radio
+    embeds = []
+    for client in mesh_router:
+        if client.my_node_info is None:
+            embeds.append(discord.Embed(title=f'Local Node Information ({client.name})', description=f'Not connected: {client.interface_info.connection_descriptor}', color=MeshBotColors.error()))
+            continue
+        text = [
+            f'**MeshBot Version:** {__version__}',
+            f'**Node ID:** {client.my_node_info.user_info.user_id}',
+            f'**Node Num:** {client.my_node_info.node_num_str}',
+            f'**Discord Bot ID:** {discord_client.user.id}',
+            f'**Short Name:** {client.my_node_info.user_info.short_name}',
+            f'**Long Name:** {client.my_node_info.user_info.long_name}',
+            f'**MAC Address:** {client.my_node_info.user_info.mac_address}',
+            f'**HW Model:** {client.my_node_info.user_info.hw_model}',
+            f'**Battery Level:** {client.my_node_info.device_metrics.battery_level}%',
+            f'**Battery Voltage:** {client.my_node_info.device_metrics.voltage}V',
+        ]
+        title = f'Local Node Information ({client.name})' if len(mesh_router) > 1 else 'Local Node Information'
+        embeds.append(discord.Embed(title=title, description='\n'.join(text)))
+
+    await interaction.response.send_message(embeds=embeds[:discord_client.max_embeds_per_msg])
 
 @discord_client.tree.command(name="all_nodes", description="Lists all nodes.")
 @discord_client.only_in_channel(discord_client.dis_channel_id)
@@ -401,14 +475,19 @@ async def all_nodes(interaction: discord.Interaction):
 
     # Send first message
     out = await interaction.response.send_message(embed=embed)
+    discord_client.cache_message(out.message_id, embed)
 
     tic = time.time()
     # Get message to reference later
     msg_id = out.message_id
 
-    chunks, num_results = mesh_client.get_nodes_from_db()
+    try:
+        nodes, num_results = await query_service.run(mesh_client.get_nodes_from_db)
+    except QueryTimeout:
+        await interaction.followup.send(embed=query_timeout_embed('all_nodes'))
+        return
 
-    if len(chunks) == 0:
+    if len(nodes) == 0:
         # No thread, edit original message
         final_text = None
         no_thread = True
@@ -433,12 +512,12 @@ async def all_nodes(interaction: discord.Interaction):
         original_message_edit_color = MeshBotColors.error()
     else:
         thread_name = '/all_nodes cmd'
-        original_msg_field = embed_field(name="Results", value=f'{num_results} Found (Took {convert_secs_to_pretty(toc)})', inline=False)
+        original_msg_field = embed_field(name="Results", value=f'{num_results} Found (Query took {convert_secs_to_pretty(toc)})', inline=False)
         original_message_edit = None
         original_message_edit_color = MeshBotColors.green()
 
     packet = {
-        'content': chunks,
+        'content': nodes,
         'thread_name': thread_name,
         'final_msg': final_msg,
         'original_msg_field': original_msg_field,
@@ -446,7 +525,7 @@ async def all_nodes(interaction: discord.Interaction):
         'original_message_edit': original_message_edit,
         'original_message_edit_color': original_message_edit_color
     }
-    logging.info(f'Got nodes, formatted data, sending to enqueue_msg_thread. Total of {len(chunks)} chunks (of up to 10 items per chunk).')
+    logging.info(f'Got nodes, formatted data, sending to enqueue_msg_thread. Total of {len(nodes)} nodes.')
     discord_client.enqueue_msg_thread(packet)
 
 
@@ -469,6 +548,19 @@ async def debug(interaction: discord.Interaction):
         debug_text += f'{thing} items:\n'
         for key, value in mesh_client.myNodeInfo.get(thing,{}).items():
             debug_text += f"  {key}: {value}\n"
+    for client in mesh_router:
+        # per radio, the node info above (and the dumps below) are the default radio's
+        radio = f' ({client.name}, {"connected" if client.connected else "not connected"})' if len(mesh_router) > 1 else ''
+        debug_text += f'packet handlers{radio}:\n'
+        for portnum, stats in client.portnum_handlers.stats().items():
+            debug_text += f"  {portnum}: {stats.count} pkts, {stats.errors} errors, avg {stats.avg_ms:.2f}ms, max {stats.max_time*1000:.2f}ms\n"
+        debug_text += f'tx scheduler{radio} ({client.tx_scheduler.modem_preset_name}):\n'
+        tx_depth = client.tx_scheduler.depth_by_priority()
+        for name, stats in client.tx_scheduler.stats().items():
+            debug_text += f"  {name}: {tx_depth[name]} queued, {stats.sent} sent, {stats.rejected} rejected, {stats.errors} errors, avg wait {stats.avg_wait:.1f}s, max {stats.max_wait:.1f}s\n"
+    debug_text += f'db queries: {query_service.stats.count} run, {query_service.stats.errors} errors, {query_service.stats.timeouts} timed out, avg {query_service.stats.avg_ms:.1f}ms, max {query_service.stats.max_time*1000:.1f}ms\n'
+    message_cache = discord_client.message_cache
+    debug_text += f'message edits: {discord_client.edits_sent} sent, {discord_client.edits_coalesced} coalesced, cache {len(message_cache)}/{message_cache.max_size} ({message_cache.hits} hits, {message_cache.misses} fetched)\n'
     debug_text += '```'
 
     embed = discord.Embed(title='Debug Information', description=debug_text)
@@ -537,28 +629,25 @@ async def ham(interaction: discord.Interaction, callsign: str):
 async def get_node_map(interaction: discord.Interaction, node_name: str, map_zoom_level: int = 12):
     logging.info(f'/map command received.')
 
-    node = mesh_client.get_node_info(shortname=node_name)
+    _, node_ref = mesh_router.resolve_node(node_name)
     current_time = get_current_time_str()
 
     if not config.gmaps_api_key:
         embed = discord.Embed(title=f"Error: This command requires a google maps API key in config.json.", color=MeshBotColors.red())
-
-    if node:
+    elif not node_ref.known:
+        embed = discord.Embed(title=f"Error: Node {node_name} not found.", description=node_ref.error, color=MeshBotColors.red())
+    elif 'position' in node_ref.node:
         # get the lat/long
-        if isinstance(node, dict) and 'position' in node:
-            embed = discord.Embed(title=f"Location for Node: {node_name}:", color=MeshBotColors.green())
-            embed.add_field(name='Lat/Lon', value=f'{lat},{lon}')
-            pos_data = node['position']
-            lat = pos_data.get('latitude')
-            lon = pos_data.get('longitude')
-            url = f'https://maps.googleapis.com/maps/api/staticmap?center={lat},{lon}&zoom={map_zoom_level}&size=400x400&key={config.gmaps_api_key}&markers=color:green|label:{node_name}|{lat},{lon}'
-            embed.set_image(url=url)
-        else:
-            embed = discord.Embed(title=f"Location data unavailable for Node: {node_name}.", color=MeshBotColors.red())
-
+        pos_data = node_ref.node['position']
+        lat = pos_data.get('latitude')
+        lon = pos_data.get('longitude')
+        label = node_ref.short_name or node_name
+        embed = discord.Embed(title=f"Location for Node: {node_ref.descriptive_string}:", color=MeshBotColors.green())
+        embed.add_field(name='Lat/Lon', value=f'{lat},{lon}')
+        url = f'https://maps.googleapis.com/maps/api/staticmap?center={lat},{lon}&zoom={map_zoom_level}&size=400x400&key={config.gmaps_api_key}&markers=color:green|label:{label}|{lat},{lon}'
+        embed.set_image(url=url)
     else:
-        embed = discord.Embed(title=f"Error: Node with shotname {node_name} not found.", color=MeshBotColors.red())
-
+        embed = discord.Embed(title=f"Location data unavailable for Node: {node_name}.", color=MeshBotColors.red())
 
     embed.set_footer(text=f"{current_time}")
 
@@ -573,10 +662,15 @@ async def kms(interaction: discord.Interaction):
     await interaction.response.send_message(embed=embed)
     logging.info(f'Killing myself as requested by {interaction.user.name} ({interaction.user.id})')
     await discord_client.close()
-    try:
-        mesh_client.iface.close()
-    except Exception as e:
-        logging.error(f"An error occurred while closing mesh client interface: {e}")
+    close_mesh_interfaces()
+
+def close_mesh_interfaces():
+    for client in mesh_router:
+        if client.iface:
+            try:
+                client.iface.close()
+            except Exception as e:
+                logging.error(f"An error occurred while closing mesh client interface {client.name}: {e}")
 
 def run_discord_bot():
     try:
@@ -588,12 +682,15 @@ def run_discord_bot():
     finally:
         if discord_client:
             asyncio.run(discord_client.close())
-        if mesh_client:
-            if mesh_client.iface:
-                try:
-                    mesh_client.iface.close()
-                except Exception as e:
-                    logging.error(f"An error occurred while closing mesh client interface: {e}")
+        close_mesh_interfaces()
+        query_service.shutdown()
+        retention_job.stop()
+        # write out anything still waiting in the write-behind queue
+        rx_writer.stop()
+        if packet_archive:
+            packet_archive.stop()
+        if metrics_server:
+            metrics_server.shutdown()
 
 if __name__ == "__main__":
     run_discord_bot()
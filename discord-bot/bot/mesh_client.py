@@ -1,24 +1,27 @@
 from pprint import pprint
 import logging
-import queue
-import sys
 import time
-import re
 import threading
-from difflib import SequenceMatcher
-
-import datetime
 
 import meshtastic
 import meshtastic.ble_interface
 import meshtastic.serial_interface
 import meshtastic.tcp_interface
-import pytz
 from pubsub import pub
 
+import metrics
 from mesh_node_classes import MeshNode
-
-from db_classes import TXPacket, RXPacket, ACK, MeshNodeDB, discord_bot_id
+from node_directory import NodeDirectory
+from node_ref import NodeRef, NodeRefResolver
+from packet_record import PacketRecord
+from db_base import session_scope
+from pending_tx import PendingTX, PendingTXTable
+from portnum_handlers import PortnumHandlerRegistry
+from tracing import Trace
+from tx_scheduler import TXScheduler, TXPriority
+
+from db_classes import TXPacket, ACK, MeshNodeDB, NodeActivity, discord_bot_id
+from database_client import NodeInfoUpdate
 from version import __version__
 
 
@@ -31,82 +34,32 @@ class MeshClient():
     '''Class to handle meshtastic interactions.'''
 
     def onReceiveMesh(self, packet, interface):  # Called when a packet arrives from mesh.
-        """Called when a packet arrives from the mesh."""
+        """Called when a packet arrives from the mesh.
+
+        Parsing and side effects (e.g. forwarding text messages to discord, matching ACKs) are done by the
+        handler registered for the packet's portnum, see portnum_handlers.py.
+        """
+        # meshtastic's pubsub events are global, with several radios every client gets every packet
+        if interface is not self.iface:
+            return
 
+        pkt_id = packet.get('id')
+        from_id = None
+        portnum = None
+        # follows the packet through parsing, the DB writer and (text messages) discord, see tracing.py
+        trace = Trace('rx', f'{packet.get("decoded", {}).get("portnum", "ENCRYPTED")} pkt_id={pkt_id} from={packet.get("fromId")}')
         try:
-            pkt_id = packet.get('id')
-            from_id = None
+            if self._packet_archive is not None:
+                self._packet_archive.enqueue(packet)
             if 'from' in packet and packet['from']:
                 from_id = '!' + hex(packet['from'])[2:]
             portnum = packet.get('decoded', {}).get('portnum')
 
-            db_packet = RXPacket.from_dict(packet, self)
+            logging.info(f"START onReceiveMesh: {portnum} packet (id: [{pkt_id}]) received from: {from_id}") # For debugging.
 
-            logging.info(f"START onReceiveMesh: {db_packet.portnum} packet (id: [{pkt_id}]) received from: {db_packet.src_descriptive}") # For debugging.
-            with self._db_lock:
-                self._db_session.add(db_packet)
-                try:
-                    self._db_session.commit() # save back to db
-                    logging.info(f'Packet saved to DB with pkt_id: {db_packet.pkt_id}')
-                except Exception as e:
-                    logging.error(f'DB ROLLBACK: {str(e)}')
-                    self._db_session.rollback()
-
-            # This section is to notify the discord client when different packets are received
-            # for example, when a text message is received, we want that message to be sent to discord
-            # when a nodeinfo packet is received, we want to update the nodeinfo in the database
-            # when an ACK is received, we want to update the corresponding TXPacket in the database (and notify discord that the ACK was received)
-
-            # text messages: both channel and DMs
-            if db_packet.is_text_message:
-                self.discord_client.enqueue_mesh_text_msg_received(db_packet)
-
-            # nodeinfo packets - update the MeshNodeDB
-            elif db_packet.portnum == 'NODEINFO_APP':
-                # get the nodeinfo and update the MeshNodeDB
-                MeshNodeDB.update_from_nodeinfo(packet, self)
-
-            # traceroute packets - not implemented yet
-            elif db_packet.portnum == 'TRACEROUTE_APP':
-                # get the nodeinfo and update the MeshNodeDB
-                pass
+            db_packet = self.portnum_handlers.process(self, packet, trace)
 
-            # ACK packets
-            elif db_packet.portnum == 'ROUTING_APP':
-                # NOTE: There are 2 types of ACK - implicit and explicit
-                # Implicit means that your node heard a relay of your message, so you know it was received by at least 1 node
-                # Explicit means that the destination node sent an ACK back to you (this only works for DMs, not channel messages)
-
-                if db_packet.priority == 'ACK':
-                    if db_packet.request_id:
-                        logging.info(f'Got ACK from {db_packet.src_descriptive}. Request ID: {db_packet.request_id}')
-                        with self._db_lock:
-                            lock_acquired = self._tx_ack_lock.acquire(timeout=10)
-                            if not lock_acquired:
-                                logging.error(f'Failed to acquire lock')
-                            matching_packet = self._db_session.query(TXPacket).filter_by(packet_id=db_packet.request_id).filter(TXPacket.publisher_mesh_node_num == self.my_node_info.node_num_str).first()
-                            self._tx_ack_lock.release()
-                        if matching_packet:
-                            # if we find the packet in the db matching the request ID of the ACK... update it to say
-                            # it is acknowledged
-
-                            matching_packet.acknowledge_received = True
-                            implicit_ack = db_packet.src_id == self.my_node_info.user_info.user_id
-                            ack_obj = ACK.from_rx_packet(db_packet, self)
-                            with self._db_lock:
-                                self._db_session.add(ack_obj)
-                                matching_packet.acks.append(ack_obj)
-                                try:
-                                    self._db_session.commit() # save back to db
-                                except Exception as e:
-                                    logging.error(f'DB ROLLBACK: {str(e)}')
-                                    self._db_session.rollback()
-
-                            self.discord_client.enqueue_ack(ack_obj)
-                        else:
-                            logging.error(f'No matching packet found for request_id: {db_packet.request_id}.\n Maybe the packet isnt in the DB yet, and/or is this a self-ack?')
-
-            else:
+            if db_packet is None:
                 if portnum:
                     logging.info(f'Received unhandled packet type: {portnum} from: {from_id}')
                 else:
@@ -119,7 +72,8 @@ class MeshClient():
         except Exception as e:
             logging.error(f'Error parsing packet. Type: {portnum}. From: {from_id}. Packet ID: {pkt_id}. Exception: {str(type(e))}. Exception Detail: {e}')
         finally:
-            logging.info(f"END onReceiveMesh: {db_packet.portnum} packet (id: [{pkt_id}]) received from: {db_packet.src_descriptive}") # For debugging.
+            trace.release('handled')
+            logging.info(f"END onReceiveMesh: {portnum} packet (id: [{pkt_id}]) received from: {from_id}") # For debugging.
 
     def onConnectionMesh(self, interface, topic=None):
         """Called when connection to mesh device is established.
@@ -127,32 +81,39 @@ class MeshClient():
         This is where we can first talk to the node, get our local node info, and get the list of nodes from the device database.
         """
         # called the first time we connect to the node. Initialize the db from the device's node db
+        if interface is not self.iface:
+            return
+        # connect() calls this too, in case the event was published before it subscribed
+        with self._connection_lock:
+            if self._established:
+                return
+            self._established = True
 
-        logging.info('onConnectionMesh: Connection Established')
+        logging.info(f'onConnectionMesh: Connection Established ({self.name})')
 
         self.myNodeInfo = interface.getMyNodeInfo()
         self.my_node_info = MeshNode(self.myNodeInfo) # TODO: this is the only place this is used. probably remove this class and reference it from the DB or soemthing
 
         self.nodes = self.iface.nodes # this should take precedence
+        self.node_directory.load(self.iface.nodesByNum)
 
         with self._db_lock:
 
             # use nodesByNum because it will include ones that we do not have userInfo for
-            for node_num, node in self.iface.nodesByNum.items():
-                # see if node with num exists in db
-                matching_node = self._db_session.query(MeshNodeDB).filter_by(node_num=node_num).filter(MeshNodeDB.publisher_mesh_node_num == self.my_node_info.node_num_str).first()
-                if matching_node:
-                    pass
-                    #MeshNodeDB.update_from_nodedb(node_num, node, self)
-                else:
-                    new_node = MeshNodeDB.from_dict(node, self)
-                    self._db_session.add(new_node)
             # should only need to commit once
             try:
-                self._db_session.commit() # save back to db
+                with session_scope() as session:
+                    for node_num, node in self.iface.nodesByNum.items():
+                        # see if node with num exists in db
+                        matching_node = session.query(MeshNodeDB).filter_by(node_num=node_num).filter(MeshNodeDB.publisher_mesh_node_num == self.my_node_info.node_num_str).first()
+                        if matching_node:
+                            pass
+                            #MeshNodeDB.update_from_nodedb(node_num, node, self, session)
+                        else:
+                            new_node = MeshNodeDB.from_dict(node, self)
+                            session.add(new_node)
             except Exception as e:
                 logging.error(f'FAILURE MeshNodeDB COMMIT. DB ROLLBACK: {str(e)}')
-                self._db_session.rollback()
 
             self.discord_bot_data = {
                 'publisher_discord_bot_user_id' : self.discord_client.user.id,
@@ -162,13 +123,11 @@ class MeshClient():
                 'publisher_mesh_node_longname' : self.my_node_info.user_info.long_name,
                 'publisher_channel_id' : self.discord_client.dis_channel_id
             }
-            discord_bot = discord_bot_id.from_dict(self.discord_bot_data)
-            self._db_session.add(discord_bot)
             try:
-                self._db_session.commit() # save back to db
+                with session_scope() as session:
+                    session.add(discord_bot_id.from_dict(self.discord_bot_data))
             except Exception as e:
                 logging.error(f'FAILURE discord_bot_id COMMIT. DB ROLLBACK: {str(e)}')
-                self._db_session.rollback()
 
         logging.info('***********************')
         logging.info('** MESHBOT CONNECTED **')
@@ -197,6 +156,10 @@ class MeshClient():
         logging.info(f'Bot Channel ID:        {self.discord_client.dis_channel_id}')
         logging.info('***********************')
 
+        # airtime estimates for the TX scheduler depend on the preset
+        self.tx_scheduler.set_modem_preset(interface.localNode.localConfig.lora.modem_preset)
+        logging.info(f'TX Scheduler:          {self.tx_scheduler}')
+
         node_descriptor = f'{self.my_node_info.user_info.user_id} | {self.my_node_info.user_info.short_name} | {self.my_node_info.user_info.long_name}'
         self.discord_client.enqueue_mesh_ready(node_descriptor, interface.localNode.localConfig.lora.modem_preset, self.my_node_info.device_metrics.battery_level)
 
@@ -207,123 +170,192 @@ class MeshClient():
         pub.subscribe(self.onDisconnect, 'meshtastic.connection.lost')
 
     def onDisconnect(self, interface):
-        # this happens when a node gets updated... we should update the database
-        self.discord_client.enqueue_lost_comm('Disconnect Event Received')
+        if interface is not self.iface:
+            return
+        with self._connection_lock:
+            self._established = False
+        self.discord_client.enqueue_lost_comm(f'Disconnect Event Received ({self.name})')
         logging.error('mesh device disconnected')
 
     def onNodeUpdated(self, node, interface):
         # this happens when a node gets updated... we should update the database
-        logging.info('START: onNodeUpdated')
-        logging.info(str(type(node)))
-        logging.info(str(dir(node)))
-        logging.info('END: onNodeUpdated')
+        if interface is not self.iface:
+            return
+        logging.info(f'onNodeUpdated: {node.get("num")}')
+        self.node_directory.upsert(node)
 
     def onMsgResponse(self, d):
-        # if there is a request Id... look it up in the Db and acknowledge
+        # if there is a request Id... look it up in the pending TX table and acknowledge
 
-        db_packet = RXPacket.from_dict(d, self)
-        with self._db_lock:
-            self._db_session.add(db_packet)
-            try:
-                self._db_session.commit() # save back to db
-            except Exception as e:
-                logging.error(f'DB ROLLBACK: {str(e)}')
-                self._db_session.rollback()
+        db_packet = self.portnum_handlers.get('ROUTING_APP').build_packet(self, d)
+        self.save_rx_packet(db_packet)
 
         logging.info(f'onMsgResponse: Got Response to packet: {db_packet.request_id} from {db_packet.src_descriptive})')
 
-        with self._db_lock:
-            lock_acquired = self._tx_ack_lock.acquire(timeout=10)
-            if not lock_acquired:
-                logging.error(f'Failed to acquire lock')
-            matching_packet = self._db_session.query(TXPacket).filter_by(packet_id=db_packet.request_id).filter(TXPacket.publisher_mesh_node_num == self.my_node_info.node_num_str).first()
-            self._tx_ack_lock.release()
-        if matching_packet:
-            # if we find the packet in the db matching the request ID of the ACK... update it to say
-            # it is acknowledged
-            matching_packet.acknowledge_received = True
-
-            implicit_ack = db_packet.request_id == self.my_node_info.user_info.user_id
-            ack_obj = ACK.from_rx_packet(db_packet, self)
-
-            with self._db_lock:
-
-                self._db_session.add(ack_obj)
-                matching_packet.acks.append(ack_obj)
-                try:
-                    self._db_session.commit() # save back to db
-                except Exception as e:
-                    logging.error(f'DB ROLLBACK: {str(e)}')
-                    self._db_session.rollback()
+        if db_packet.request_id:
+            self.process_ack(db_packet)
+
+    def packet_record(self, packet):
+        """Parses the common fields of a received packet dict into a PacketRecord."""
+        return PacketRecord.from_packet(packet, self.my_node_info.node_num, self.discord_client.user.id, self.node_directory)
+
+    def save_rx_packet(self, db_packet, trace=None):
+        """Queues a received packet (PacketRecord or RXPacket) to be written to the DB in the next batch."""
+        self._rx_writer.enqueue(db_packet, trace)
+
+    def save_node_info(self, packet):
+        """Queues the mesh_nodes update for a received NODEINFO packet, applied by the RX writer thread."""
+        self._rx_writer.enqueue_node_info(NodeInfoUpdate(packet, self))
+
+    def process_ack(self, db_packet):
+        # matched against the in-memory table of sent packets, no DB round trip on the receive thread.
+        # if the packet isn't in the table yet (the ACK beat the TX commit), the ACK is parked and
+        # handled when the packet is registered
+        pending_tx = self._pending_tx.resolve_or_park(self.my_node_info.node_num_str, db_packet.request_id, db_packet)
+        if pending_tx:
+            self._handle_ack(db_packet, pending_tx)
+
+    def _handle_ack(self, db_packet, pending_tx):
+        # routing packets are delivered to both onReceiveMesh and onMsgResponse (and parked ones are handled
+        # on the TX thread), only count them once. The trace ends with the first ACK's discord edit
+        claimed, trace = self._pending_tx.claim_ack(pending_tx, db_packet.pkt_id)
+        if not claimed:
+            return
 
-            # enqueue response to be sent back to discord
-            self.discord_client.enqueue_ack(ack_obj)
-        else:
-            logging.error(f'No matching packet found for request_id: {db_packet.request_i}.\n Maybe the packet isnt in the DB yet, and/or is this a self-ack?')
+        ack_obj = ACK.from_rx_packet(db_packet, self, tx_packet_id=pending_tx.tx_packet_row_id)
+        ack_type = 'implicit' if ack_obj.implicit_ack else 'explicit'
+        metrics.tx_ack_delay_seconds.labels(ack_type=ack_type).observe(time.monotonic() - pending_tx.sent_at)
+
+        # written (with acknowledge_received on the TXPacket) by the writer thread, after db_packet itself
+        self._rx_writer.enqueue_ack(ack_obj)
+
+        # enqueue response to be sent back to discord
+        if trace is not None:
+            trace.mark(f'{ack_type}_ack')
+        self.discord_client.enqueue_ack(ack_obj, pending_tx.discord_message_id, trace)
+        if trace is not None:
+            trace.release()
+
+    def _register_pending_tx(self, tx_pkt, discord_interaction_info, trace=None):
+        pending_tx = PendingTX(
+            self.my_node_info.node_num_str,
+            tx_pkt.packet_id,
+            tx_pkt.id,
+            discord_interaction_info.message_id if discord_interaction_info else None,
+            dest_id=tx_pkt.dest_id,
+            trace=trace.hold() if trace is not None else None
+        )
+        for db_packet in self._pending_tx.add(pending_tx):
+            logging.info(f'Handling early ACK from {db_packet.src_descriptive}. Request ID: {db_packet.request_id}')
+            self._handle_ack(db_packet, pending_tx)
 
-    def __init__(self, db_session, config):
+    def __init__(self, config, rx_writer, packet_archive=None, interface_info=None):
         self.config = config
 
-        # queue for incoming requests (e.g. from discord bot commands) to send things over the mesh
-        self._meshqueue = queue.Queue(maxsize=20)
+        # the radio this client talks to (Config.InterfaceInfo), one of config.interfaces. See mesh_router.py
+        self.interface_info = interface_info or config.interface_info
+        self.name = self.interface_info.name
+
+        # queues requests (e.g. from discord bot commands) to send things over the mesh, and paces
+        # them to the radio's airtime budget. Admin actions involving the node go first
+        tx_info = config.tx_info
+        self.tx_scheduler = TXScheduler(
+            self.process_tx_request,
+            ready_fn=lambda: self.connected,
+            duty_cycle=tx_info.duty_cycle,
+            burst_airtime=tx_info.burst_airtime,
+            max_queue=tx_info.max_queue
+        )
+        for name in TXPriority.names.values():
+            metrics.queue_depth.labels(queue=f'{self.name}/tx_{name}').set_function(lambda name=name: self.tx_scheduler.depth_by_priority()[name])
 
-        # queue to perform admin actions involving the node
-        self._adminqueue = queue.Queue(maxsize=20)
+        # batched writer for received packets (database_client.RXPacketWriter)
+        self._rx_writer = rx_writer
 
-        # sqlalchemy database session
-        self._db_session = db_session
+        # raw copy of every received packet (packet_archive.PacketArchiveWriter), None if not enabled
+        self._packet_archive = packet_archive
 
         # reference to discord client - used for sending responses to user
         self.discord_client = None
 
+        # parsing + side effects per portnum, used by onReceiveMesh
+        self.portnum_handlers = PortnumHandlerRegistry.default()
+
         # meshtastic stuff
         self.iface = None
         self.nodes = {}
+        self.node_directory = NodeDirectory() # indexed view of iface.nodesByNum, use this for lookups
+        self.node_resolver = NodeRefResolver(self.node_directory) # parses node input from users, see resolve_node
         self.myNodeInfo = None #TODO: switch this to use the node object created onConnectionMesh
         self.my_node_info = None
 
-        self._tx_ack_lock = threading.Lock()
-        self._db_lock = threading.Lock()
+        # serializes writes to this client's mesh_nodes rows (the node sync in onConnectionMesh and NODEINFO
+        # updates, applied by the RX writer), so a node can't be inserted twice. Everything else writes in its own session without it.
+        # Records its wait times in metrics.lock_wait_seconds
+        self._db_lock = metrics.TimedLock(f'{self.name}/db_lock')
+
+        # whether onConnectionMesh has run for the current connection
+        self._established = False
+        self._connection_lock = threading.Lock()
+
+        # packets sent recently, keyed by (publisher, packet_id), to match ACKs against
+        self._pending_tx = PendingTXTable()
 
         self.discord_bot_data = None
 
+    def __repr__(self):
+        return f'<{self.__class__.__name__} {self.name} {self.interface_info.connection_descriptor} connected={self.connected}>'
+
+    @property
+    def connected(self):
+        return self.iface is not None and self.iface.isConnected.is_set()
+
     def connect(self):
-        """Connect to meshtastic device and subscribe to events for processing."""
+        """Connect to meshtastic device and subscribe to events for processing. Returns False if it couldn't connect."""
 
-        interface_info = self.config.interface_info
+        interface_info = self.interface_info
 
-        logging.info(f'Connecting with interface: {interface_info.connection_descriptor}')
+        logging.info(f'Connecting {self.name} with interface: {interface_info.connection_descriptor}')
 
-        # subscribe to the connection.established event first - since we do some setup in that,
-        # it needs to be ready to be called when connection is first established
-        logging.info('Subscribing to connection.established event')
-        pub.subscribe(self.onConnectionMesh, "meshtastic.connection.established")
+        self.tx_scheduler.start()
+        with self._connection_lock:
+            self._established = False
 
         if interface_info.interface_type == 'serial':
             try:
-                self.iface = meshtastic.serial_interface.SerialInterface()
+                self.iface = meshtastic.serial_interface.SerialInterface(interface_info.interface_dev_path)
             except Exception as ex:
-                logging.info(f"Error: Could not connect {ex}")
-                sys.exit(1)
+                logging.error(f"Error: Could not connect {self.name}: {ex}")
+                return False
         elif interface_info.interface_type == 'tcp':
             addr = interface_info.interface_address
             if not addr:
-                logging.info(f'interface.address required for tcp connection')
+                logging.error(f'interface.address required for tcp connection ({self.name})')
+                return False
             try:
                 self.iface = meshtastic.tcp_interface.TCPInterface(addr)
             except Exception as ex:
-                logging.info(f"Error: Could not connect {ex}")
-                sys.exit(1)
+                logging.error(f"Error: Could not connect {self.name}: {ex}")
+                return False
         elif interface_info.interface_type == 'ble':
             try:
                 ble_node = interface_info.interface_ble_node
                 self.iface = meshtastic.ble_interface.BLEInterface(address=ble_node)
             except Exception as ex:
-                logging.info(f'Error: Could not connect {ex}')
-                sys.exit(1)
+                logging.error(f'Error: Could not connect {self.name}: {ex}')
+                return False
         else:
-            logging.info(f'Unsupported interface: {interface_info.interface_type}')
-            return
+            logging.error(f'Unsupported interface: {interface_info.interface_type} ({self.name})')
+            return False
+
+        # the interface connects (and publishes connection.established) before its constructor returns.
+        # Events are only handled once self.iface is set, since with several radios they have to be told
+        # apart by interface, so do the setup here if the event came first
+        logging.info('Subscribing to connection.established event')
+        pub.subscribe(self.onConnectionMesh, "meshtastic.connection.established")
+        if self.iface.isConnected.is_set():
+            self.onConnectionMesh(self.iface)
+        return True
 
     def link_discord(self, discord_client):
         self.discord_client = discord_client
@@ -332,16 +364,18 @@ class MeshClient():
 
     def get_long_name(self, node_id=None, default = '?'):
         # TODO: Update this to use the MeshNodeDB class
-        if node_id in self.nodes:
-            return self.nodes[node_id]['user'].get('longName', default)
+        node = self.node_directory.get_by_id(node_id)
+        if node and 'user' in node:
+            return node['user'].get('longName', default)
         elif node_id.lower() == '!ffffffff':
             return 'Broadcast'
         return default
 
     def get_short_name(self, node_id, default = '?'):
         # TODO: Update this to use the MeshNodeDB class
-        if node_id in self.nodes:
-            return self.nodes[node_id]['user'].get('shortName', default)
+        node = self.node_directory.get_by_id(node_id)
+        if node and 'user' in node:
+            return node['user'].get('shortName', default)
         elif node_id.lower() == '!ffffffff':
             return '^all'
         return default
@@ -349,7 +383,7 @@ class MeshClient():
     def get_node_descriptive_string(self, node_id=None, nodenum=None, shortname=None, default = '?'):
 
         if node_id:
-            if node_id in self.nodes:
+            if self.node_directory.get_by_id(node_id):
                 return f'{node_id} | {self.get_short_name(node_id,default=default)} | {self.get_long_name(node_id, default=default)}'
             else:
                 return f'{node_id} | ? | ?'
@@ -357,80 +391,33 @@ class MeshClient():
             node_id = self.get_node_id(node_id=node_id, nodenum=nodenum, shortname=shortname)
             return self.get_node_descriptive_string(node_id=node_id)
 
-    def determine_node_type(self, node):
-        """Gets an input that could be a node shortname, ID or number, and determines which it is
-        It always returns a node num (because a node ID can always be converted to number)
-        UNLESS the node is a shortname, in which case it returns the shortname - error checking for an invalid node shortname is later
-        It does not check if the node ID/short name is valid, just that it is in the correct format.
-        """
-        # Regex has 4 options:  node shortname, node ID (starts with !), node ID (starts with 0x), or node number
-        # must convert 0x to !
-        regex = '(^.{1,4}$)|(^![a-zA-Z0-9]{8}$)|(^0x[a-zA-Z0-9]{8}$)|(\\d{1,10}$)'
-
-        matches = re.findall(regex, node)
-        if not matches:
-            logging.error(f'Error: Node input {node} does not match any known formats.')
-            return None, None
-        elif len(matches) > 1:
-            logging.error(f'Error: Node input {node} matches multiple formats: {matches}. This is not expected.')
-            return None, None
-        else:
-            matches = list(matches[0])
-            # find which one is not empty. matches should be a list of 1 tuple, and the tuple will have 4 elements, all should be empty strings except 1
-            # check if tuple has 3 empty strings and 1 non-empty string
-            empty_str_cnt = matches.count('')
-            if empty_str_cnt == 3:
-                # find index for non-empty string
-                non_empty_index = matches.index(next(filter(lambda x: x != '', matches)))
-                match non_empty_index:
-                    case 0:
-                        # node shortname
-                        node_type = 'shortname'
-                    case 1:
-                        # node ID (starts with !)
-                        node = self.get_node_num(node_id=node)
-                        node_type = 'nodenum'
-                    case 2:
-                        # node ID (starts with 0x)
-                        node = self.get_node_num(node_id='!'+node[2:])
-                        node_type = 'nodenum'
-                    case 3:
-                        # node number
-                        node = int(node)
-                        node_type = 'nodenum'
-                    case _:
-                        logging.error(f'Error: Node input {node} matches an unexpected format: {matches}. This is not expected.')
-                        return None
-                return node_type, node
-            else:
-                logging.error(f'Error: Node input {node} matches multiple formats: {matches}. This is not expected.')
-                return None, None
+    def resolve_node(self, node):
+        """Resolves a node shortname, longname, ID (!hex or 0x hex) or node number typed by a user to a NodeRef.
+        Resolve once and pass the NodeRef on, instead of the text."""
+        if isinstance(node, NodeRef):
+            return node
+        ref = self.node_resolver.resolve(node)
+        logging.info(f'Resolved node input {node} to {ref}')
+        return ref
 
     def get_similar_nodes(self, shortname):
-        """Given a shortname (that is not in the database), returns a list of the 3 nodes that are most similar shortnames"""
-        similar_nodes = []
-        for node in self.nodes.values():
-            node_shortname = node.get('user', {}).get('shortName', '')
-            if node_shortname:
-                similarity = SequenceMatcher(None, shortname.lower(), node_shortname.lower()).ratio()
-                similar_nodes.append([node_shortname, similarity])
-        # sort by similarity
-        similar_nodes = sorted(similar_nodes, key=lambda x: x[1], reverse=True)
-        # return the top 3 most similar nodes; [:3] syntax protects against empty list
+        """Given a shortname (that is not in the database), returns a list of the 3 nodes with the most similar
+        shortname, longname or node ID (if it starts with !), as [descriptive string, similarity]"""
+        similar_nodes = [
+            [NodeRef.describe(node), similarity]
+            for node, similarity in self.node_directory.similar(shortname, limit=3)
+        ]
         logging.info(f'Found {len(similar_nodes)} similar nodes for shortname: {shortname}')
-        return similar_nodes[:3]
+        return similar_nodes
 
     def get_node_info(self, node_id=None, nodenum=None, shortname=None, longname=None):
         if node_id:
-            if not node_id.startswith('!'):
-                node_id = '!' + node_id
-            return self.nodes.get(node_id, {})
+            return self.node_directory.get_by_id(node_id) or {}
         if nodenum:
-            node_id = '!' + hex(nodenum)[2:]
-            return self.get_node_info(node_id=node_id)
+            return self.node_directory.get(nodenum) or {}
 
         if shortname:
-            nodes = [node_data for node_data in self.nodes.values() if node_data.get('user',{}).get('shortName',)==shortname]
+            nodes = self._pick_name_match(self.node_directory.find_by_shortname(shortname), 'shortName', shortname)
             if len(nodes) == 1:
                 return nodes[0]
             else:
@@ -438,13 +425,22 @@ class MeshClient():
                 return {}
 
         if longname:
-            nodes = [node_data for node_data in self.nodes.values() if node_data.get('user',{}).get('longName',)==longname]
+            nodes = self._pick_name_match(self.node_directory.find_by_longname(longname), 'longName', longname)
             if len(nodes) == 1:
                 return nodes[0]
             else:
-                logging.info(f'Number of nodes found matching this shortname was {len(nodes)}')
+                logging.info(f'Number of nodes found matching this longname was {len(nodes)}')
                 return {}
 
+    @staticmethod
+    def _pick_name_match(nodes, key, name):
+        """Name lookups ignore case, but if that is ambiguous and exactly one node matches exactly, use it."""
+        if len(nodes) > 1:
+            exact = [node for node in nodes if node.get('user', {}).get(key) == name]
+            if len(exact) == 1:
+                return exact
+        return nodes
+
     def get_node_id(self, node_id=None, nodenum=None, shortname=None, longname=None):
         if node_id:
             return node_id
@@ -475,49 +471,27 @@ class MeshClient():
     def get_nodes_from_db(self, time_limit=None):
         """
         Gets nodes from DB with optional lookback time filter applied.
+        Returns a list with a text description of each node (newest first), and the number of nodes.
         """
 
         logging.info(f'get_nodes_from_db has been called with: {time_limit} mins')
 
-        with self._db_lock:
-            latest_packet_info = RXPacket.latest_packets_for_publisher(self, self.my_node_info.node_num_str, time_limit=time_limit)
-            pkt_cnt_by_id_all_time = RXPacket.get_pkt_cnt_for_src_id_within_time(self, self.my_node_info.node_num_str, time_limit=None)
-            pkt_cnt_by_id_24_hr = RXPacket.get_pkt_cnt_for_src_id_within_time(self, self.my_node_info.node_num_str, time_limit=60*24)
-
+        # one indexed read of the node_activity summary, sorted by last packet (newest first)
+        with session_scope() as session:
+            node_activity = NodeActivity.nodes_for_publisher(session, self.my_node_info.node_num_str, time_limit=time_limit)
 
         nodelist = []
-        for node_pkt in latest_packet_info:
-            # this will be per node because the query uses a window function to get latest per src_id
-
-            pkt_cnt = pkt_cnt_by_id_all_time.get(node_pkt.src_id, 0)
-            pkt_cnt_24 = pkt_cnt_by_id_24_hr.get(node_pkt.src_id, 0)
-
-            # TODO: not sure why this needs to be here... it isn't returning an object...
-
-            if node_pkt.ts.tzinfo is None:
-                ts_with_tz = node_pkt.ts.replace(tzinfo=pytz.UTC)
-            else:
-                ts_with_tz = node_pkt.ts
-
-            last_packet_str = f'{node_pkt.portnum} - {util.get_discord_ts_from_dt(ts_with_tz, relative=True)}'
+        for node, pkt_cnt_24 in node_activity:
 
             # exclude self node
-            if node_pkt.src_id == self.my_node_info.user_info.user_id:
+            if node.src_id == self.my_node_info.user_info.user_id:
                 continue
 
-            nodelist.append([f"**{node_pkt.src_id} | {node_pkt.src_short_name} | {node_pkt.src_long_name} **\nLast Packet: {last_packet_str}\n{pkt_cnt} Packets RX'd ({pkt_cnt_24} in past day)", ts_with_tz])
+            last_packet_str = f'{node.last_portnum} - {util.get_discord_ts_from_dt(node.last_ts_with_tz, relative=True)}'
 
-        try:
-            # sort nodelist and remove ts from it
-            nodelist_sorted = sorted(nodelist, key=lambda x: x[1], reverse=True)
-            nodelist_sorted = [x[0] for x in nodelist_sorted]
-        except:
-            logging.error(f'Failed to sort list of nodes. Using unsorted list')
-            nodelist_sorted = [x[0] for x in nodelist]
-            nodelist_sorted.insert(0, 'WARNING: The following list is not sorted!')
+            nodelist.append(f"**{node.src_id} | {node.src_short_name} | {node.src_long_name} **\nLast Packet: {last_packet_str}\n{node.pkt_count} Packets RX'd ({pkt_cnt_24} in past day)")
 
-        nodelist_chunks = ["\n\n".join(nodelist_sorted[i:i + 10]) for i in range(0, len(nodelist_sorted), 10)]
-        return nodelist_chunks, len(nodelist)
+        return nodelist, len(nodelist)
 
     def check_battery(self, channel, battery_warning=battery_warning):
         # runs every minute, not eff but idk what else to do
@@ -542,7 +516,7 @@ class MeshClient():
 
     # methods to ensure we enqueue the proper type of command/message
 
-    def enqueue_send_channel(self, channel, message, discord_interaction_info):
+    def enqueue_send_channel(self, channel, message, discord_interaction_info, trace=None):
         """
         Puts a message on the queue to be sent on the specified channel.
 
@@ -550,6 +524,7 @@ class MeshClient():
             channel: Channel Index to send the message on.
             message: Message text to send.
             discord_interaction_info: Information about discord message to fascilitate replies.
+            trace: tracing.Trace started by the command, if any.
         """
 
         self._enqueue_msg(
@@ -558,26 +533,36 @@ class MeshClient():
                 'channel': channel,
                 'message': message,
                 'discord_interaction_info': discord_interaction_info,
-            }
+                'trace': trace,
+            },
+            TXPriority.CHANNEL,
+            fair_key=channel,
+            payload=message
         )
 
-    def enqueue_send_dm(self, node, message, discord_interaction_info):
+    def enqueue_send_dm(self, node, message, discord_interaction_info, trace=None):
         """
         Puts a message on the queue to be sent to a specific node (DM).
 
         Args:
-            node: Node to DM.
+            node: Node to DM, a NodeRef or any input resolve_node accepts.
             message: Message text to send.
             discord_interaction_info: Information about discord message to fascilitate replies.
+            trace: tracing.Trace started by the command, if any.
         """
 
+        node_ref = self.resolve_node(node)
         self._enqueue_msg(
             {
                 'msg_type': f'send_dm',
-                'node': node,
+                'node_ref': node_ref,
                 'message': message,
                 'discord_interaction_info': discord_interaction_info,
-            }
+                'trace': trace,
+            },
+            TXPriority.DM,
+            fair_key=node_ref.num if node_ref.found else node_ref.text,
+            payload=message
         )
 
     def enqueue_telemetry_broadcast(self, discord_interaction_info):
@@ -592,60 +577,36 @@ class MeshClient():
             {
                 'msg_type': 'telemetry_broadcast',
                 'discord_interaction_info': discord_interaction_info,
-            }
+            },
+            TXPriority.TELEMETRY
         )
 
-    def enqueue_telemetry_nodenum(self, nodenum, discord_interaction_info):
+    def enqueue_telemetry_node(self, node, discord_interaction_info):
         """
         Enqueues a telemetry request to the specified node.
 
         Args:
-            nodenum: Node to send telemetry request to.
+            node: Node to send telemetry request to, a NodeRef or any input resolve_node accepts.
             discord_interaction_info: Information about discord message to fascilitate replies.
         """
 
         self._enqueue_msg(
             {
-                'msg_type': 'telemetry_nodenum',
-                'nodenum': nodenum,
+                'msg_type': 'telemetry_node',
+                'node_ref': self.resolve_node(node),
                 'discord_interaction_info': discord_interaction_info,
-            }
+            },
+            TXPriority.TELEMETRY
         )
 
-    def enqueue_telemetry_nodeid(self, nodeid, discord_interaction_info):
-        """
-        Enqueues a telemetry request to the specified node.
-
-        Args:
-            nodeid: Node tp send telemetry request to.
-            discord_interaction_info: Information about discord message to fascilitate replies.
-        """
+    def enqueue_telemetry_nodenum(self, nodenum, discord_interaction_info):
+        self.enqueue_telemetry_node(self.node_resolver.from_num(nodenum), discord_interaction_info)
 
-        self._enqueue_msg(
-            {
-                'msg_type': 'telemetry_nodeid',
-                'nodeid': nodeid,
-                'discord_interaction_info': discord_interaction_info,
-            }
-        )
+    def enqueue_telemetry_nodeid(self, nodeid, discord_interaction_info):
+        self.enqueue_telemetry_node(nodeid, discord_interaction_info)
 
     def enqueue_telemetry_shortname(self, shortname, discord_interaction_info):
-        """
-        Enqueues a telemetry request to the specified node.
-
-        Args:
-            nodeid: Node tp send telemetry request to.
-            discord_interaction_info: Information about discord message to fascilitate replies.
-        """
-
-
-        self._enqueue_msg(
-            {
-                'msg_type': 'telemetry_shortname',
-                'shortname': shortname,
-                'discord_interaction_info': discord_interaction_info,
-            }
-        )
+        self.enqueue_telemetry_node(shortname, discord_interaction_info)
 
     def enqueue_active_nodes(self, active_time, method='node_db'):
         """
@@ -697,80 +658,118 @@ class MeshClient():
             }
         )
 
-    def _enqueue_msg(self, msg):
+    def _enqueue_msg(self, msg, priority, fair_key=None, payload=None):
         """
-        Puts a message on the queue for processing.
+        Puts a message on the TX scheduler for processing. Never blocks, if the queue is full
+        the discord message gets an error instead.
 
         Args:
             msg: Command message
+            priority: TXPriority class
+            fair_key: Messages with different keys (e.g. channels) in the same class take turns
+            payload: Text that will be sent, used to estimate airtime
 
         """
-        self._meshqueue.put(msg)
+        payload_bytes = len(payload.encode('utf-8')) if payload else 0
+        # held by the scheduler until the message has been processed (see process_queue_message)
+        trace = msg.get('trace')
+        if trace is not None:
+            trace.hold().mark('tx_queued')
+        if not self.tx_scheduler.submit(msg, priority, fair_key=fair_key, payload_bytes=payload_bytes):
+            if trace is not None:
+                trace.release('tx_rejected')
+            discord_interaction_info = msg.get('discord_interaction_info')
+            if discord_interaction_info:
+                self.discord_client.enqueue_tx_error(discord_interaction_info.message_id, f'Too many messages are waiting to be sent ({self.tx_scheduler.queue_depth}). Please try again later.')
 
     def _enqueue_admin_msg(self, msg):
         """
-        Puts a message on the queue for processing.
+        Puts a message on the TX scheduler for processing, ahead of everything else.
 
         Args:
             msg: Command message
 
         """
-        self._adminqueue.put(msg)
+        self._enqueue_msg(msg, TXPriority.ADMIN)
 
     # single-point to the meshtastic APIs
 
-    def _send_channel(self, channel, message, discord_interaction_info=None):
+    def _send_channel(self, channel, message, discord_interaction_info=None, trace=None):
         logging.info(f'Sending message to channel: {channel}')
-        with self._db_lock:
-            with self._tx_ack_lock:
-                sent_packet = self.iface.sendText(message, channelIndex=channel, wantResponse=True, wantAck=True)
-                if sent_packet:
-                    self.discord_client.enqueue_tx_confirmation(discord_interaction_info.message_id)
-                pkt = TXPacket.from_sent_packet(sent_packet=sent_packet, discord_interaction_info=discord_interaction_info, mesh_client=self)
-                self._db_session.add(pkt)
-                try:
-                    self._db_session.commit() # save back to db
-                except Exception as e:
-                    logging.error(f'DB ROLLBACK: {str(e)}')
-                    self._db_session.rollback()
+        if trace is not None:
+            trace.mark('send')
+        sent_packet = self.iface.sendText(message, channelIndex=channel, wantResponse=True, wantAck=True)
+        if trace is not None:
+            trace.mark('sent')
+        if sent_packet:
+            self.discord_client.enqueue_tx_confirmation(discord_interaction_info.message_id, trace)
+        pkt = TXPacket.from_sent_packet(sent_packet=sent_packet, discord_interaction_info=discord_interaction_info, mesh_client=self)
+        try:
+            with session_scope() as session:
+                session.add(pkt)
+        except Exception as e:
+            logging.error(f'DB ROLLBACK: {str(e)}')
+        if trace is not None:
+            trace.mark('tx_saved')
+        self._register_pending_tx(pkt, discord_interaction_info, trace)
 
-    def _send_dm(self, nodenum, message, discord_interaction_info=None):
+    def _send_dm(self, nodenum, message, discord_interaction_info=None, trace=None):
         logging.info(f'Sending message to: {nodenum}')
-        with self._db_lock:
-            with self._tx_ack_lock:
-                sent_packet = self.iface.sendText(message, destinationId=nodenum, wantResponse=True, wantAck=True, onResponse=self.onMsgResponse)
-                if sent_packet:
-                    pkt = TXPacket.from_sent_packet(sent_packet=sent_packet, discord_interaction_info=discord_interaction_info, mesh_client=self)
-                    node_desc = self.get_node_descriptive_string(nodenum=nodenum)
-                    self.discord_client.enqueue_tx_confirmation_dm(discord_interaction_info.message_id, node_desc)
+        if trace is not None:
+            trace.mark('send')
+        sent_packet = self.iface.sendText(message, destinationId=nodenum, wantResponse=True, wantAck=True, onResponse=self.onMsgResponse)
+        if trace is not None:
+            trace.mark('sent')
+        if sent_packet:
+            pkt = TXPacket.from_sent_packet(sent_packet=sent_packet, discord_interaction_info=discord_interaction_info, mesh_client=self)
+            node_desc = self.get_node_descriptive_string(nodenum=nodenum)
+            self.discord_client.enqueue_tx_confirmation_dm(discord_interaction_info.message_id, node_desc, trace)
 
-                    self._db_session.add(pkt)
-
-                    try:
-                        self._db_session.commit() # save back to db
-                    except Exception as e:
-                        logging.error(f'DB ROLLBACK: {str(e)}')
-                        self._db_session.rollback()
+            try:
+                with session_scope() as session:
+                    session.add(pkt)
+            except Exception as e:
+                logging.error(f'DB ROLLBACK: {str(e)}')
+            if trace is not None:
+                trace.mark('tx_saved')
+            self._register_pending_tx(pkt, discord_interaction_info, trace)
 
     def _send_telemetry(self, nodenum=None, discord_interaction_info=None):
-        with self._db_lock:
-            with self._tx_ack_lock:
-                sent_packet = self.iface.sendTelemetry(wantResponse=True)
-                # sent_packet = self.iface.sendTelemetry(nodenum, wantResponse=True)
-                if sent_packet:
-                    self.discord_client.enqueue_tx_confirmation(discord_interaction_info.message_id)
-                    pkt = TXPacket.from_sent_packet(sent_packet=sent_packet, discord_interaction_info=discord_interaction_info, mesh_client=self)
-
-                    self._db_session.add(pkt)
-                    try:
-                        self._db_session.commit() # save back to db
-                    except Exception as e:
-                        logging.error(f'DB ROLLBACK: {str(e)}')
-                        self._db_session.rollback()
+        sent_packet = self.iface.sendTelemetry(wantResponse=True)
+        # sent_packet = self.iface.sendTelemetry(nodenum, wantResponse=True)
+        if sent_packet:
+            self.discord_client.enqueue_tx_confirmation(discord_interaction_info.message_id)
+            pkt = TXPacket.from_sent_packet(sent_packet=sent_packet, discord_interaction_info=discord_interaction_info, mesh_client=self)
+
+            try:
+                with session_scope() as session:
+                    session.add(pkt)
+            except Exception as e:
+                logging.error(f'DB ROLLBACK: {str(e)}')
+            self._register_pending_tx(pkt, discord_interaction_info)
 
     # queue processing/background loop
 
+    def process_tx_request(self, request):
+        """Called by the TX scheduler's thread when a request is due to be sent."""
+        if request.priority == TXPriority.ADMIN:
+            self.process_admin_queue_message(request.msg)
+        else:
+            self.process_queue_message(request.msg)
+
     def process_queue_message(self, msg):
+        if isinstance(msg, dict) and msg.get('trace') is not None:
+            # held since _enqueue_msg
+            trace = msg['trace']
+            trace.mark('tx_dequeued')
+            try:
+                self._process_queue_message(msg, trace)
+            finally:
+                trace.release()
+        else:
+            self._process_queue_message(msg)
+
+    def _process_queue_message(self, msg, trace=None):
         if isinstance(msg, dict):
             msg_type = msg.get('msg_type')
             message = msg.get('message')
@@ -778,47 +777,23 @@ class MeshClient():
 
             if msg_type == 'send_channel':
                 channel = msg.get('channel')
-                self._send_channel(channel, message, discord_interaction_info)
+                self._send_channel(channel, message, discord_interaction_info, trace)
             elif msg_type == 'send_dm':
-                node = msg.get('node')
-                node_type, proc_node = self.determine_node_type(node)
-                if node_type == 'shortname':
-                    nodenum = self.get_node_num(shortname=proc_node)
-                    if not nodenum:
-                        # TODO maybe move this into a separate function?
-                        # get list of possible shortnames
-                        similar_nodes = self.get_similar_nodes(proc_node)
-                        if similar_nodes:
-                            similar_nodes_str = ''
-                            for node in similar_nodes:
-                                similar_nodes_str += f'`{node[0]}`\n'
-                            self.discord_client.enqueue_tx_error(discord_interaction_info.message_id, f'Node shortname: `{proc_node}` is not found.\nDid you mean:\n{similar_nodes_str}')
-                        else:
-                            self.discord_client.enqueue_tx_error(discord_interaction_info.message_id, f'Node shortname: `{proc_node}` is not found. Please check the spelling and try again.')
-                    else:
-                        self._send_dm(nodenum, message, discord_interaction_info)
-                elif node_type == 'nodenum':
-                    self._send_dm(proc_node, message, discord_interaction_info)
-                else:
-                    error_str = f'Input `{node}` is an invalid node format.\nPlease use a shortname, node ID (starting with !), or node number.'
-                    self.discord_client.enqueue_tx_error(discord_interaction_info.message_id, error_str)
+                # resolved when it was enqueued
+                node_ref = msg.get('node_ref')
+                if not node_ref.found:
+                    self.discord_client.enqueue_tx_error(discord_interaction_info.message_id, node_ref.error)
+                    return
+                self._send_dm(node_ref.num, message, discord_interaction_info, trace)
             elif msg_type == 'telemetry_broadcast':
                 # TODO: Add ability to send on other channels if this even makes sense
                 self._send_telemetry(discord_interaction_info=discord_interaction_info)
-            elif msg_type == 'telemetry_nodenum':
-                nodenum = msg.get('nodenum')
-                self._send_telemetry(nodenum=nodenum, discord_interaction_info=discord_interaction_info)
-            elif msg_type == 'telemetry_nodeid':
-                nodeid = msg.get('nodeid')
-                nodenum = self.get_node_num(node_id=nodeid)
-                if not nodenum:
-                    self.discord_client.enqueue_tx_error(discord_interaction_info.message_id, f'Node ID: {nodeid} is invalid.')
+            elif msg_type == 'telemetry_node':
+                node_ref = msg.get('node_ref')
+                if not node_ref.found:
+                    self.discord_client.enqueue_tx_error(discord_interaction_info.message_id, node_ref.error)
                     return
-                self._send_telemetry(nodenum=nodenum, discord_interaction_info=discord_interaction_info)
-            elif msg_type == 'telemetry_shortname':
-                shortname = msg.get('shortname')
-                nodenum = self.get_node_num(shortname=shortname)
-                self._send_telemetry(nodenum=nodenum, discord_interaction_info=discord_interaction_info)
+                self._send_telemetry(nodenum=node_ref.num, discord_interaction_info=discord_interaction_info)
 
         else:
             logging.error(f'Unknown message type in mesh queue: {type(msg)}')
@@ -846,7 +821,7 @@ class MeshClient():
         #TODO: use Node obj created in onConnectionMesh. Possibly make it auto-updating when accessed
         # instead of updating here
 
-        if self.iface.isConnected:
+        if self.iface and self.iface.isConnected:
             self.myNodeInfo = self.iface.getMyNodeInfo()
 
             try:
@@ -859,22 +834,8 @@ class MeshClient():
                 except Exception as e:
                     logging.error(f"An error occurred while closing mesh client interface: {e}")
 
-            # do this stuff every time
-            try:
-                meshmessage = self._meshqueue.get_nowait()
-                self.process_queue_message(meshmessage)
-                self._meshqueue.task_done()
-            except queue.Empty:
-                pass
-            except Exception as e:
-                logging.exception('Exception processing meshqueue', exc_info=e)
+            # outbound messages are sent by the TX scheduler's thread
 
-            try:
-                adminmessage = self._adminqueue.get_nowait()
-                self.process_admin_queue_message(adminmessage)
-                self._adminqueue.task_done()
-            except queue.Empty:
-                pass
-            except Exception as e:
-                logging.exception('Exception processing adminqueue', exc_info=e)
+        # drop sent packets that are too old to be ACKed and report ACKs that never matched anything
+        self._pending_tx.expire()
 
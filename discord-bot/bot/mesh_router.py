@@ -0,0 +1,120 @@
+import logging
+import sys
+
+from mesh_client import MeshClient
+from node_ref import NodeRef
+
+
+class MeshRouter():
+    '''The MeshClients of the bot, one per radio in config.interfaces, and which one sends what.
+
+    Every client has its own interface (and its receive thread) and TX scheduler; they share the RX writer,
+    the packet archive and the discord bot. Channel messages go out on the radio routing_info.channels gives
+    for the channel index, DMs on the one in routing_info.dm, and everything else on the default radio
+    (routing_info.default, or the first one).
+    '''
+
+    LAST_HEARD = 'last_heard'
+    DEFAULT = 'default'
+
+    def __init__(self, config, rx_writer, packet_archive=None):
+        self.config = config
+        self.routing_info = config.routing_info
+
+        self.clients = {}
+        for interface_info in config.interfaces:
+            if interface_info.name in self.clients:
+                raise ValueError(f'Interface name {interface_info.name} is used more than once')
+            self.clients[interface_info.name] = MeshClient(config, rx_writer, packet_archive=packet_archive, interface_info=interface_info)
+
+        names = [self.routing_info.default, *self.routing_info.channels.values()]
+        if self.routing_info.dm not in (self.LAST_HEARD, self.DEFAULT):
+            names.append(self.routing_info.dm)
+        for name in names:
+            if name is not None and name not in self.clients:
+                raise ValueError(f'routing_info refers to unknown interface {name}, interfaces are: {", ".join(self.clients)}')
+
+        self.default = self.clients[self.routing_info.default or next(iter(self.clients))]
+        logging.info(f'Mesh router: {len(self.clients)} interface(s), default {self.default.name}, {self.routing_info}')
+
+    def __repr__(self):
+        return f'<{self.__class__.__name__} {", ".join(self.clients)} default={self.default.name}>'
+
+    def __iter__(self):
+        return iter(self.clients.values())
+
+    def __len__(self):
+        return len(self.clients)
+
+    def get(self, name):
+        return self.clients.get(name)
+
+    def link_discord(self, discord_client):
+        for client in self:
+            client.link_discord(discord_client)
+
+    def connect(self):
+        # one at a time: a radio that fails to connect shouldn't keep the others from connecting. Without any
+        # radio there's nothing for the bot to do
+        connected = []
+        for client in self:
+            try:
+                if client.connect():
+                    connected.append(client.name)
+            except Exception as e:
+                logging.exception(f'Could not connect {client.name}', exc_info=e)
+        if not connected:
+            logging.error('Could not connect to any radio, exiting')
+            sys.exit(1)
+        logging.info(f'Connected radios: {", ".join(connected)} of {len(self)}')
+
+    def background_process(self):
+        for client in self:
+            try:
+                client.background_process()
+            except Exception as e:
+                logging.exception(f'Exception in mesh background process of {client.name}', exc_info=e)
+
+    def for_channel(self, channel_index):
+        """The client that sends messages to a channel index."""
+        name = self.routing_info.channels.get(channel_index)
+        return self.clients[name] if name is not None else self.default
+
+    def route_dm(self, node):
+        """The client that sends a DM to node (as typed by the user, or a NodeRef), and node resolved by it.
+
+        With dm routing last_heard, that's the connected radio that heard the node most recently; if none of
+        them knows the node, the default radio."""
+        dm = self.routing_info.dm
+        if dm == self.DEFAULT or len(self) == 1:
+            client = self.default
+        elif dm != self.LAST_HEARD:
+            client = self.clients[dm]
+        else:
+            best = None
+            for client in self:
+                if not client.connected:
+                    continue
+                node_ref = client.resolve_node(node)
+                if node_ref.known:
+                    last_heard = node_ref.node.get('lastHeard') or 0
+                    if best is None or last_heard > best[0]:
+                        best = (last_heard, client, node_ref)
+            if best is not None:
+                logging.info(f'Routing DM to {best[2]} via {best[1].name}')
+                return best[1], best[2]
+            client = self.default
+        return client, client.resolve_node(node)
+
+    def resolve_node(self, node):
+        """Resolves node on the default radio, or the first other radio that knows it. Returns (client, NodeRef)."""
+        node_ref = self.default.resolve_node(node)
+        if node_ref.known or isinstance(node, NodeRef):
+            return self.default, node_ref
+        for client in self:
+            if client is self.default or not client.connected:
+                continue
+            other_ref = client.resolve_node(node)
+            if other_ref.known:
+                return client, other_ref
+        return self.default, node_ref
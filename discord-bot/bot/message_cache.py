@@ -0,0 +1,46 @@
+import collections
+
+
+class MessageCache():
+    """Bounded LRU of the embeds of messages the bot sent, keyed by discord message id.
+
+    Lets mesh responses (TX confirmations, ACKs, errors) edit a message without fetching it first.
+    Stores a copy of the embed, which is then edited in place and sent with the next edit.
+    """
+
+    def __init__(self, max_size=500):
+        self.max_size = max_size
+        self._embeds = collections.OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def __repr__(self):
+        return f'<{self.__class__.__name__} {len(self._embeds)}/{self.max_size} hits={self.hits} misses={self.misses}>'
+
+    def __len__(self):
+        return len(self._embeds)
+
+    def __contains__(self, message_id):
+        return message_id in self._embeds
+
+    def put(self, message_id, embed):
+        """Caches a copy of embed and returns the copy."""
+        embed = embed.copy()
+        self._embeds[message_id] = embed
+        self._embeds.move_to_end(message_id)
+        while len(self._embeds) > self.max_size:
+            self._embeds.popitem(last=False)
+        return embed
+
+    def get(self, message_id):
+        """Returns the cached embed (not a copy), or None."""
+        embed = self._embeds.get(message_id)
+        if embed is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self._embeds.move_to_end(message_id)
+        return embed
+
+    def discard(self, message_id):
+        self._embeds.pop(message_id, None)
@@ -0,0 +1,84 @@
+import asyncio
+
+import discord
+
+import metrics
+from tx_scheduler import TokenBucket
+
+
+# discord's limits per embed description, embeds per message and total embed characters per message
+MAX_DESCRIPTION_CHARS = 4096
+MAX_EMBEDS_PER_MSG = 10
+MAX_EMBED_CHARS_PER_MSG = 6000
+
+
+def pack_messages(items, color=None, separator='\n\n', max_description=MAX_DESCRIPTION_CHARS,
+                  max_embeds=MAX_EMBEDS_PER_MSG, max_chars=MAX_EMBED_CHARS_PER_MSG):
+    """Packs items into as few messages as discord allows. Returns a list of messages, each a list of embeds.
+
+    Text items are joined (with separator) into the descriptions of new embeds, each item stays whole
+    unless it is longer than max_description on its own. discord.Embed items are added as they are.
+    Order is kept.
+    """
+    messages = []
+    embeds = []
+    msg_chars = 0
+    description = ''
+
+    def close_embed():
+        nonlocal description, msg_chars
+        if description:
+            embeds.append(discord.Embed(description=description, color=color))
+            msg_chars += len(description)
+            description = ''
+
+    def close_message():
+        nonlocal embeds, msg_chars
+        close_embed()
+        if embeds:
+            messages.append(embeds)
+        embeds = []
+        msg_chars = 0
+
+    def make_room(size):
+        # closes the current message unless another embed of this size fits in it
+        if len(embeds) >= max_embeds or msg_chars + size > max_chars:
+            close_message()
+
+    for item in items:
+        if isinstance(item, discord.Embed):
+            close_embed()
+            make_room(len(item))
+            embeds.append(item)
+            msg_chars += len(item)
+            continue
+
+        item = str(item)[:max_description]
+        if description:
+            joined = f'{description}{separator}{item}'
+            if len(joined) <= max_description and msg_chars + len(joined) <= max_chars:
+                description = joined
+                continue
+            close_embed()
+        make_room(len(item))
+        description = item
+
+    close_message()
+    return messages
+
+
+class SendPacer():
+    """Spaces out sends to one channel or thread, to stay under discord's per-channel limit (5 messages
+    per 5 seconds) instead of running into 429s and waiting out the retry-after."""
+
+    def __init__(self, rate=1.0, burst=5):
+        self._bucket = TokenBucket(rate=rate, capacity=burst)
+        self.waited = 0.0
+
+    async def wait(self):
+        delay = self._bucket.time_until(1)
+        if delay > 0:
+            self.waited += delay
+            metrics.discord_ratelimit_sleep_seconds.labels(source='send_pacer').inc(delay)
+            await asyncio.sleep(delay)
+        self._bucket.consume(1)
@@ -0,0 +1,71 @@
+import threading
+import time
+
+import prometheus_client
+from prometheus_client import Counter, Gauge, Histogram
+
+
+# histogram buckets (seconds): FAST_BUCKETS for things on the receive path, DEFAULT_BUCKETS for DB and
+# discord round trips, SLOW_BUCKETS for the mesh itself
+FAST_BUCKETS = (0.00001, 0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.05, 0.1)
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SLOW_BUCKETS = (0.5, 1.0, 2.0, 5.0, 10.0, 20.0, 30.0, 60.0, 120.0, 300.0, 600.0)
+# from a few ms (parsing) to minutes (ACKs), for the stages of tracing.Trace
+TRACE_BUCKETS = (0.001, 0.005, 0.025, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0)
+
+
+class TimedLock():
+    '''threading.Lock that records how long every acquire waited in lock_wait_seconds, labeled with name.'''
+
+    def __init__(self, name):
+        self.name = name
+        self._lock = threading.Lock()
+        self._wait_seconds = lock_wait_seconds.labels(lock=name)
+
+    def __repr__(self):
+        return f'<{self.__class__.__name__} {self.name} locked={self.locked()}>'
+
+    def acquire(self, blocking=True, timeout=-1):
+        if self._lock.acquire(False):
+            # uncontended, the common case: don't time it
+            self._wait_seconds.observe(0.0)
+            return True
+        if not blocking:
+            return False
+        tic = time.perf_counter()
+        acquired = self._lock.acquire(True, timeout)
+        self._wait_seconds.observe(time.perf_counter() - tic)
+        return acquired
+
+    def release(self):
+        self._lock.release()
+
+    def locked(self):
+        return self._lock.locked()
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
+
+
+# the bot's metrics, in prometheus_client's default registry (served by prometheus_client.start_http_server,
+# see main.py). Collected whether or not the endpoint is enabled, they're cheap
+registry = prometheus_client.REGISTRY
+# no <name>_created series for every counter and histogram
+prometheus_client.disable_created_metrics()
+
+packets_received = Counter('meshbot_packets_received_total', 'Packets received from the mesh', ['portnum'])
+packet_parse_seconds = Histogram('meshbot_packet_parse_seconds', 'Time to parse a received packet into a PacketRecord', ['portnum'], buckets=FAST_BUCKETS)
+db_commit_seconds = Histogram('meshbot_db_commit_seconds', 'Time to write and commit a DB transaction', ['writer'], buckets=DEFAULT_BUCKETS)
+db_packets_written = Counter('meshbot_db_packets_written_total', 'Received packets the RX writer saved (written) or dropped (failed)', ['result'])
+lock_wait_seconds = Histogram('meshbot_lock_wait_seconds', 'Time spent waiting to acquire a lock', ['lock'], buckets=FAST_BUCKETS)
+queue_depth = Gauge('meshbot_queue_depth', 'Items waiting in a queue', ['queue'])
+discord_request_seconds = Histogram('meshbot_discord_request_seconds', 'Discord REST API request time, including rate limit waits', ['method', 'route'], buckets=DEFAULT_BUCKETS)
+discord_ratelimit_sleep_seconds = Counter('meshbot_discord_ratelimit_sleep_seconds_total', 'Time spent sleeping because of discord rate limits', ['source'])
+discord_gateway_latency_seconds = Gauge('meshbot_discord_gateway_latency_seconds', 'Discord gateway heartbeat latency')
+trace_stage_seconds = Histogram('meshbot_trace_stage_seconds', 'Time from receiving a packet (rx) or a send command (tx) until it reached a stage', ['path', 'stage'], buckets=TRACE_BUCKETS)
+trace_seconds = Histogram('meshbot_trace_seconds', 'Time from receiving a packet (rx) or a send command (tx) until its last stage', ['path'], buckets=TRACE_BUCKETS)
+tx_ack_delay_seconds = Histogram('meshbot_tx_ack_delay_seconds', 'Time from sending a packet to receiving an ACK for it', ['ack_type'], buckets=SLOW_BUCKETS)
@@ -0,0 +1,231 @@
+import bisect
+import collections
+import logging
+import threading
+from difflib import SequenceMatcher
+
+
+class NodeDirectory():
+    '''In-memory index of the nodes known to the connected device.
+
+    Holds the same node dicts as iface.nodesByNum, indexed by node num, node ID (!hex), shortname and
+    longname, so name lookups don't have to scan every node. Shortname/longname keys are case-folded and
+    can map to more than one node. Kept up to date from meshtastic.node.updated events and NODEINFO_APP packets.
+
+    For "did you mean" suggestions (see similar()), shortnames and longnames are also indexed by their
+    n-grams, and node IDs are kept sorted for prefix matches.
+    '''
+
+    # n-gram size for the similar-name index, and how many n-gram candidates are reranked with SequenceMatcher
+    ngram_size = 3
+    rerank_candidates = 20
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._source = {}  # iface.nodesByNum, used to pick up nodes the library created without an update event
+        self._by_num = {}
+        self._by_id = {}
+        self._by_shortname = {}
+        self._by_longname = {}
+        self._index_keys = {}  # num -> (node_id, shortname key, longname key) currently indexed for that node
+        self._shortname_ngrams = {}  # n-gram -> node nums
+        self._longname_ngrams = {}
+        self._sorted_ids = []  # indexed node IDs, for prefix matches
+
+    def __repr__(self):
+        return f'<{self.__class__.__name__} {len(self)} nodes>'
+
+    def __len__(self):
+        return len(self._by_num)
+
+    @staticmethod
+    def _name_key(name):
+        return name.casefold() if name else None
+
+    @classmethod
+    def _ngrams(cls, key):
+        # padded so short names still get a few n-grams, and matches at the start/end count more
+        if not key:
+            return frozenset()
+        padded = ' ' * (cls.ngram_size - 1) + key + ' '
+        return frozenset(padded[i:i + cls.ngram_size] for i in range(len(padded) - cls.ngram_size + 1))
+
+    @staticmethod
+    def _num_from_id(node_id):
+        try:
+            return int(node_id.lstrip('!'), 16)
+        except (AttributeError, ValueError):
+            return None
+
+    def load(self, nodes_by_num):
+        """Rebuilds the directory from iface.nodesByNum."""
+        with self._lock:
+            self._source = nodes_by_num
+            self._by_num = {}
+            self._by_id = {}
+            self._by_shortname = {}
+            self._by_longname = {}
+            self._index_keys = {}
+            self._shortname_ngrams = {}
+            self._longname_ngrams = {}
+            self._sorted_ids = []
+            for node in nodes_by_num.values():
+                self.upsert(node)
+        logging.info(f'NodeDirectory loaded with {len(self)} nodes')
+
+    def upsert(self, node):
+        """Adds or re-indexes a node dict (same format as the values of iface.nodesByNum)."""
+        num = node.get('num')
+        if num is None:
+            return
+        with self._lock:
+            self._by_num[num] = node
+            self._reindex(num)
+
+    def update_user(self, num, user_dict):
+        """Merges the user section of a NODEINFO_APP packet into the node and re-indexes its names."""
+        if num is None or not user_dict:
+            return
+        with self._lock:
+            node = self._by_num.get(num)
+            if node is None:
+                node = self._source.get(num, {'num': num})
+                self._by_num[num] = node
+            node['user'] = {**node.get('user', {}), **user_dict}
+            self._reindex(num)
+
+    def _reindex(self, num):
+        node = self._by_num[num]
+        user = node.get('user', {})
+        keys = (user.get('id'), self._name_key(user.get('shortName')), self._name_key(user.get('longName')))
+        old_keys = self._index_keys.get(num)
+        if old_keys == keys:
+            return
+
+        if old_keys:
+            old_id, old_short, old_long = old_keys
+            if old_id and self._by_id.get(old_id) == num:
+                del self._by_id[old_id]
+                self._discard_id(old_id)
+            self._discard(self._by_shortname, old_short, num)
+            self._discard(self._by_longname, old_long, num)
+            for ngram in self._ngrams(old_short):
+                self._discard(self._shortname_ngrams, ngram, num)
+            for ngram in self._ngrams(old_long):
+                self._discard(self._longname_ngrams, ngram, num)
+
+        node_id, short_key, long_key = keys
+        if node_id:
+            if node_id not in self._by_id:
+                bisect.insort(self._sorted_ids, node_id.casefold())
+            self._by_id[node_id] = num
+        if short_key:
+            self._by_shortname.setdefault(short_key, set()).add(num)
+            for ngram in self._ngrams(short_key):
+                self._shortname_ngrams.setdefault(ngram, set()).add(num)
+        if long_key:
+            self._by_longname.setdefault(long_key, set()).add(num)
+            for ngram in self._ngrams(long_key):
+                self._longname_ngrams.setdefault(ngram, set()).add(num)
+        self._index_keys[num] = keys
+
+    def _discard_id(self, node_id):
+        key = node_id.casefold()
+        i = bisect.bisect_left(self._sorted_ids, key)
+        if i < len(self._sorted_ids) and self._sorted_ids[i] == key:
+            del self._sorted_ids[i]
+
+    @staticmethod
+    def _discard(index, key, num):
+        if key is None:
+            return
+        nums = index.get(key)
+        if nums is not None:
+            nums.discard(num)
+            if not nums:
+                del index[key]
+
+    def get(self, num):
+        """Returns the node dict for a node num, or None."""
+        with self._lock:
+            node = self._by_num.get(num)
+            if node is None and num in self._source:
+                # the library adds nodes to nodesByNum without publishing an update, pick them up here
+                node = self._source[num]
+                self.upsert(node)
+            return node
+
+    def get_by_id(self, node_id):
+        """Returns the node dict for a node ID (with or without the !, zero padded or not), or None."""
+        if not node_id:
+            return None
+        with self._lock:
+            num = self._by_id.get(node_id)
+        if num is None:
+            num = self._num_from_id(node_id)
+        if num is None:
+            return None
+        return self.get(num)
+
+    def find_by_shortname(self, shortname):
+        """Returns all nodes whose shortname matches, ignoring case."""
+        return self._find(self._by_shortname, shortname)
+
+    def find_by_longname(self, longname):
+        """Returns all nodes whose longname matches, ignoring case."""
+        return self._find(self._by_longname, longname)
+
+    def _find(self, index, name):
+        key = self._name_key(name)
+        if key is None:
+            return []
+        with self._lock:
+            return [self._by_num[num] for num in index.get(key, ())]
+
+    def similar(self, name, limit=3):
+        """Returns up to limit (node, score) pairs for the nodes whose shortname, longname or node ID is most
+        like name, best first. Score is 0..1. If name starts with !, nodes whose ID starts with it score 1.
+
+        Candidates are the nodes sharing the most n-grams with name (shortname or longname), only those
+        are compared with SequenceMatcher."""
+        key = self._name_key(name)
+        if key is None:
+            return []
+        query_ngrams = self._ngrams(key)
+        with self._lock:
+            overlap = collections.Counter()
+            for index in (self._shortname_ngrams, self._longname_ngrams):
+                counts = collections.Counter()
+                for ngram in query_ngrams:
+                    counts.update(index.get(ngram, ()))
+                for num, count in counts.items():
+                    overlap[num] = max(overlap[num], count)
+
+            scores = {}
+            for num, _ in overlap.most_common(self.rerank_candidates):
+                _, short_key, long_key = self._index_keys[num]
+                scores[num] = max(SequenceMatcher(None, key, name_key).ratio() for name_key in (short_key, long_key) if name_key)
+
+            for num in self._nums_with_id_prefix(key):
+                scores[num] = 1.0
+
+            best = sorted(scores.items(), key=lambda x: x[1], reverse=True)[:limit]
+            return [(self._by_num[num], score) for num, score in best]
+
+    def _nums_with_id_prefix(self, prefix, limit=None):
+        # only for explicit IDs, (default) shortnames look like hex too. A bare ! would match every node
+        if not prefix.startswith('!') or len(prefix) < 3:
+            return []
+        limit = limit or self.rerank_candidates
+        nums = []
+        i = bisect.bisect_left(self._sorted_ids, prefix)
+        while i < len(self._sorted_ids) and self._sorted_ids[i].startswith(prefix) and len(nums) < limit:
+            num = self._num_from_id(self._sorted_ids[i])
+            if num in self._by_num:
+                nums.append(num)
+            i += 1
+        return nums
+
+    def nodes(self):
+        with self._lock:
+            return list(self._by_num.values())
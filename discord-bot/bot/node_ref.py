@@ -0,0 +1,159 @@
+import logging
+import re
+
+
+class NodeRef():
+    '''A node reference typed by a user (in /dm, /nodeinfo, /map, ...), resolved by NodeRefResolver.
+
+    num is the node num to use, or None if the input didn't resolve to a node. node_id is num as a
+    canonical (zero padded) !hex ID. node is the node dict from the NodeDirectory, None if the node isn't
+    known to the device (a node num or ID is still usable then, e.g. to DM it). candidates is a list of
+    (node, score) pairs: the matching nodes if a name was ambiguous, or suggestions if nothing matched.
+    '''
+
+    SHORTNAME = 'shortname'
+    LONGNAME = 'longname'
+    NODE_ID = 'node_id'  # !a1b2c3d4, or a1b2c3d4
+    HEX = 'hex'  # 0xa1b2c3d4
+    NODENUM = 'nodenum'
+
+    def __init__(self, text, kind=None, num=None, node=None, candidates=None, ambiguous=False):
+        self.text = text
+        self.kind = kind  # one of the kinds above, None if the input isn't in any known format
+        self.num = num
+        self.node = node
+        self.candidates = candidates or []
+        self.ambiguous = ambiguous  # candidates all match the name
+
+    def __repr__(self):
+        return f'<{self.__class__.__name__} {self.text!r} kind={self.kind} id={self.node_id} candidates={len(self.candidates)}>'
+
+    @property
+    def found(self):
+        return self.num is not None
+
+    @property
+    def known(self):
+        return self.node is not None
+
+    @property
+    def node_id(self):
+        return f'!{self.num:08x}' if self.num is not None else None
+
+    @property
+    def short_name(self):
+        return (self.node or {}).get('user', {}).get('shortName')
+
+    @property
+    def descriptive_string(self):
+        return self.describe(self.node) if self.node else f'? | ? | {self.node_id}'
+
+    @staticmethod
+    def describe(node):
+        user = node.get('user', {})
+        return f'{user.get("shortName", "?")} | {user.get("longName", "?")} | {user.get("id", "?")}'
+
+    @property
+    def error(self):
+        """Why the input didn't resolve (formatted for discord), None if it did."""
+        if self.found:
+            return None
+        names = ''.join(f'`{self.describe(node)}`\n' for node, _ in self.candidates)
+        if self.kind in (self.SHORTNAME, self.LONGNAME):
+            if self.ambiguous:
+                return f'Node {self.kind}: `{self.text}` matches {len(self.candidates)} nodes:\n{names}Please use the node ID instead.'
+            if names:
+                return f'Node {self.kind}: `{self.text}` is not found.\nDid you mean:\n{names}'
+            return f'Node {self.kind}: `{self.text}` is not found. Please check the spelling and try again.'
+        if self.kind in (self.NODE_ID, self.HEX):
+            return f'Node ID: `{self.text}` is not found.' + (f'\nDid you mean:\n{names}' if names else '')
+        error = f'Input `{self.text}` is an invalid node format.\nPlease use a shortname, node ID (starting with !), or node number.'
+        if names:
+            error += f'\nDid you mean:\n{names}'
+        return error
+
+
+class NodeRefResolver():
+    '''Parses a node reference (shortname, longname, !hex or bare 8 digit hex node ID, 0x hex, or decimal
+    node num) in one pass and resolves it against a NodeDirectory.
+
+    Inputs of up to 4 characters that are a known shortname are that node, even if they'd also parse as
+    a number or ID. Otherwise the format decides: numbers and full 8 digit IDs resolve even if the node
+    isn't known, names have to match a node (ignoring case, an exact match wins if that is ambiguous).
+    '''
+
+    max_shortname_len = 4
+    max_node_num = 0xFFFFFFFF
+
+    _pattern = re.compile(
+        r'!(?P<node_id>[0-9a-fA-F]{1,8})'
+        r'|0[xX](?P<hex>[0-9a-fA-F]{1,8})'
+        r'|(?P<nodenum>[0-9]{1,10})'
+        r'|(?P<bare_id>[0-9a-fA-F]{8})'
+    )
+
+    def __init__(self, node_directory, suggestions=3):
+        self.node_directory = node_directory
+        self.suggestions = suggestions
+
+    def __repr__(self):
+        return f'<{self.__class__.__name__} {self.node_directory}>'
+
+    def resolve(self, text):
+        """Returns a NodeRef for text, never raises."""
+        text = (text or '').strip()
+        if not text:
+            return NodeRef(text)
+
+        if len(text) <= self.max_shortname_len:
+            ref = self._resolve_name(text, NodeRef.SHORTNAME, self.node_directory.find_by_shortname, 'shortName')
+            if ref.found or ref.candidates:
+                return ref
+
+        match = self._pattern.fullmatch(text)
+        if match is not None:
+            kind = match.lastgroup
+            if kind == 'nodenum':
+                ref = self._from_num(text, NodeRef.NODENUM, int(match[kind]))
+                # 8 digits could be a decimal num or an ID without the !, take the one the device knows
+                if not ref.known and len(text) == 8:
+                    as_id = self._from_num(text, NodeRef.NODE_ID, int(text, 16))
+                    if as_id.known:
+                        return as_id
+                return ref
+            ref = self._from_num(text, NodeRef.HEX if kind == 'hex' else NodeRef.NODE_ID, int(match[kind], 16))
+            if not ref.known and len(match[kind]) < 8:
+                # a short ID of an unknown node is most likely a typo or the start of an ID
+                return NodeRef(text, ref.kind, candidates=self.node_directory.similar(text, limit=self.suggestions))
+            return ref
+
+        if len(text) > self.max_shortname_len:
+            ref = self._resolve_name(text, NodeRef.LONGNAME, self.node_directory.find_by_longname, 'longName')
+            if ref.found or ref.candidates:
+                return ref
+            return NodeRef(text, candidates=self.node_directory.similar(text, limit=self.suggestions))
+
+        return NodeRef(text, NodeRef.SHORTNAME, candidates=self.node_directory.similar(text, limit=self.suggestions))
+
+    def from_num(self, num):
+        """A NodeRef for a node num that is already known to be one (e.g. from a packet)."""
+        return self._from_num(str(num), NodeRef.NODENUM, num)
+
+    def _from_num(self, text, kind, num):
+        if num > self.max_node_num:
+            logging.info(f'Node input {text} is out of range for a node num')
+            return NodeRef(text)
+        return NodeRef(text, kind, num=num, node=self.node_directory.get(num))
+
+    def _resolve_name(self, text, kind, find, key):
+        nodes = find(text)
+        if len(nodes) > 1:
+            # ignoring case is ambiguous, use the exact match if there's exactly one
+            exact = [node for node in nodes if node.get('user', {}).get(key) == text]
+            if len(exact) == 1:
+                nodes = exact
+        if len(nodes) == 1:
+            return NodeRef(text, kind, num=nodes[0].get('num'), node=nodes[0])
+        if nodes:
+            logging.info(f'Number of nodes found matching {kind} {text} was {len(nodes)}')
+        return NodeRef(text, kind, candidates=[(node, 1.0) for node in nodes], ambiguous=bool(nodes))
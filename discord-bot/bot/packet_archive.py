@@ -0,0 +1,415 @@
+import bisect
+import datetime
+import logging
+import mmap
+import os
+import queue
+import struct
+import threading
+import time
+import zlib
+
+from meshtastic.protobuf import mesh_pb2
+
+import metrics
+
+
+# sentinel placed on the writer queue alongside packets
+_STOP = object()
+
+SEGMENT_SUFFIX = '.pkts'
+INDEX_SUFFIX = '.idx'
+
+# segment file: header, then blocks of (block header, zlib compressed records)
+SEGMENT_MAGIC = b'MPKA\x01'
+BLOCK_HEADER = struct.Struct('<III')  # compressed length, record count, crc32 of the compressed bytes
+RECORD_HEADER = struct.Struct('<dI')  # received at (epoch seconds), length of the MeshPacket bytes
+
+# index file: one entry per packet, in the order they were written (so sorted by received at)
+INDEX_ENTRY = struct.Struct('<dIIQI')  # received at, src_num, pkt_id, block offset, record number in the block
+
+
+class ArchivedPacket():
+    """One packet read back from the archive. received_at is when the bot got it (epoch seconds)."""
+
+    __slots__ = ('received_at', 'data', '_mesh_packet')
+
+    def __init__(self, received_at, data):
+        self.received_at = received_at
+        self.data = data
+        self._mesh_packet = None
+
+    def __repr__(self):
+        return f'<{self.__class__.__name__} from={self.src_num:x} pkt_id={self.pkt_id} at={self.received_at:.3f}>'
+
+    @property
+    def mesh_packet(self):
+        """The MeshPacket, parsed on first use."""
+        if self._mesh_packet is None:
+            self._mesh_packet = mesh_pb2.MeshPacket()
+            self._mesh_packet.ParseFromString(self.data)
+        return self._mesh_packet
+
+    @property
+    def src_num(self):
+        return getattr(self.mesh_packet, 'from')
+
+    @property
+    def pkt_id(self):
+        return self.mesh_packet.id
+
+
+class SegmentIndex():
+    '''Memory-mapped sidecar index of one segment: (received at, src_num, pkt_id) -> block offset and record
+    number, INDEX_ENTRY.size bytes per packet. Entries are in write order, which the writer keeps sorted
+    by received at, so seeks to a time are a binary search. A partly written last entry is ignored.
+    '''
+
+    def __init__(self, path):
+        self.path = path
+        self._file = open(path, 'rb')
+        size = os.fstat(self._file.fileno()).st_size
+        self._count = size // INDEX_ENTRY.size
+        self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ) if self._count else None
+
+    def __repr__(self):
+        return f'<{self.__class__.__name__} {os.path.basename(self.path)} {self._count} packets>'
+
+    def __len__(self):
+        return self._count
+
+    def __getitem__(self, i):
+        """(received_at, src_num, pkt_id, block_offset, record_number)"""
+        if i < 0:
+            i += self._count
+        if not 0 <= i < self._count:
+            raise IndexError(i)
+        return INDEX_ENTRY.unpack_from(self._mmap, i * INDEX_ENTRY.size)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def bisect(self, received_at):
+        """Position of the first entry received at or after received_at."""
+        return bisect.bisect_left(self, received_at, key=lambda entry: entry[0])
+
+    def find(self, received_at, src_num, pkt_id):
+        """The entry for a packet, or None. received_at has to match exactly (e.g. from a previous read)."""
+        for i in range(self.bisect(received_at), self._count):
+            entry = self[i]
+            if entry[0] != received_at:
+                break
+            if entry[1] == src_num and entry[2] == pkt_id:
+                return entry
+        return None
+
+    def close(self):
+        if self._mmap is not None:
+            self._mmap.close()
+        self._file.close()
+
+
+class ArchiveSegment():
+    """One segment file of the archive and its index."""
+
+    def __init__(self, path):
+        self.path = path
+        self.index_path = path[:-len(SEGMENT_SUFFIX)] + INDEX_SUFFIX
+
+    def __repr__(self):
+        return f'<{self.__class__.__name__} {self.name}>'
+
+    @property
+    def name(self):
+        return os.path.basename(self.path)
+
+    def index(self):
+        """The SegmentIndex, or None if there is no index file."""
+        if not os.path.exists(self.index_path):
+            return None
+        return SegmentIndex(self.index_path)
+
+    def read_block(self, f, offset):
+        """Returns (records, next block offset), records as (received_at, bytes). None at the end of the
+        file or at a partly written block."""
+        f.seek(offset)
+        header = f.read(BLOCK_HEADER.size)
+        if len(header) < BLOCK_HEADER.size:
+            return None
+        compressed_len, count, crc = BLOCK_HEADER.unpack(header)
+        compressed = f.read(compressed_len)
+        if len(compressed) < compressed_len or zlib.crc32(compressed) != crc:
+            logging.warning(f'{self.name}: incomplete or corrupt block at offset {offset}, stopping there')
+            return None
+        data = zlib.decompress(compressed)
+        records = []
+        pos = 0
+        for _ in range(count):
+            received_at, length = RECORD_HEADER.unpack_from(data, pos)
+            pos += RECORD_HEADER.size
+            records.append((received_at, data[pos:pos + length]))
+            pos += length
+        return records, offset + BLOCK_HEADER.size + compressed_len
+
+    def find(self, received_at, src_num, pkt_id):
+        """Returns the ArchivedPacket with this index key, or None."""
+        index = self.index()
+        if index is None:
+            return None
+        with index:
+            entry = index.find(received_at, src_num, pkt_id)
+        if entry is None:
+            return None
+        with open(self.path, 'rb') as f:
+            block = self.read_block(f, entry[3])
+        if block is None:
+            return None
+        _, data = block[0][entry[4]]
+        return ArchivedPacket(received_at, data)
+
+    def blocks(self, offset=None):
+        """Yields (records, next block offset) for each block from offset (default: the first one) on, see
+        read_block. Stops at the first partly written block."""
+        with open(self.path, 'rb') as f:
+            if f.read(len(SEGMENT_MAGIC)) != SEGMENT_MAGIC:
+                logging.error(f'{self.name} is not a packet archive segment')
+                return
+            offset = offset or len(SEGMENT_MAGIC)
+            while True:
+                block = self.read_block(f, offset)
+                if block is None:
+                    return
+                yield block
+                offset = block[1]
+
+    def packets(self, start=None, end=None):
+        """Yields the ArchivedPackets received in [start, end) (epoch seconds, None = unbounded), in order."""
+        offset, skip = None, 0
+        index = self.index()
+        if index is not None:
+            with index:
+                if start is not None:
+                    i = index.bisect(start)
+                    if i == len(index):
+                        return
+                    _, _, _, offset, skip = index[i]
+        for records, _ in self.blocks(offset):
+            for received_at, data in records[skip:]:
+                if start is not None and received_at < start:
+                    continue
+                if end is not None and received_at >= end:
+                    return
+                yield ArchivedPacket(received_at, data)
+            skip = 0
+
+
+class PacketArchive():
+    '''Reads a packet archive directory (see PacketArchiveWriter).'''
+
+    def __init__(self, archive_dir):
+        self.archive_dir = archive_dir
+
+    def __repr__(self):
+        return f'<{self.__class__.__name__} {self.archive_dir}>'
+
+    def segments(self):
+        """The segments, oldest first (the file names start with the time they were started)."""
+        if not os.path.isdir(self.archive_dir):
+            return []
+        names = sorted(name for name in os.listdir(self.archive_dir) if name.endswith(SEGMENT_SUFFIX))
+        return [ArchiveSegment(os.path.join(self.archive_dir, name)) for name in names]
+
+    def packets(self, start=None, end=None):
+        """Yields the ArchivedPackets received in [start, end) (epoch seconds or datetimes), oldest first."""
+        start, end = self._epoch(start), self._epoch(end)
+        segments = self.segments()
+        for i, segment in enumerate(segments):
+            # a segment ends where the next one starts
+            if start is not None and i + 1 < len(segments):
+                next_index = segments[i + 1].index()
+                if next_index is not None:
+                    with next_index:
+                        if len(next_index) and next_index[0][0] <= start:
+                            continue
+            yield from segment.packets(start=start, end=end)
+
+    def find(self, received_at, src_num, pkt_id):
+        """Returns the ArchivedPacket with this index key, or None."""
+        for segment in self.segments():
+            packet = segment.find(received_at, src_num, pkt_id)
+            if packet is not None:
+                return packet
+        return None
+
+    @staticmethod
+    def _epoch(value):
+        if isinstance(value, datetime.datetime):
+            return value.timestamp()
+        return value
+
+
+class ArchiveStats():
+    """Counters for PacketArchiveWriter."""
+
+    def __init__(self):
+        self.packets = 0
+        self.blocks = 0
+        self.segments = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.errors = 0
+
+    def __repr__(self):
+        return f'<{self.__class__.__name__} packets={self.packets} blocks={self.blocks} segments={self.segments} ratio={self.ratio:.2f}>'
+
+    @property
+    def ratio(self):
+        return self.bytes_out / self.bytes_in if self.bytes_in else 0.0
+
+
+class PacketArchiveWriter():
+    '''Append-only archive of the raw MeshPacket bytes of every received packet, so the database can be
+    rebuilt from them after a schema change.
+
+    The receive thread only puts the packet's protobuf on a queue, a dedicated thread serializes it and
+    appends it to the current segment. Packets are buffered into blocks, each zlib compressed on its own,
+    written when block_bytes of packets are waiting or flush_interval seconds after the first one. After
+    each block, one index entry per packet is appended to the segment's sidecar .idx file (see
+    SegmentIndex), so an index entry never points at a block that isn't written yet.
+
+    A new segment is started when the current one is segment_max_bytes big or segment_max_age seconds
+    old, and every time the writer starts. Segment files are named after the (UTC) time they were started.
+    '''
+
+    def __init__(self, archive_dir, segment_max_bytes=64 * 1024 * 1024, segment_max_age=86400, block_bytes=64 * 1024, flush_interval=5.0, compression_level=6):
+        self.archive_dir = archive_dir
+        self.segment_max_bytes = segment_max_bytes
+        self.segment_max_age = segment_max_age
+        self.block_bytes = block_bytes
+        self.flush_interval = flush_interval
+        self.compression_level = compression_level
+
+        self._queue = queue.Queue()
+        self._thread = None
+        self.stats = ArchiveStats()
+        metrics.queue_depth.labels(queue='packet_archive').set_function(self._queue.qsize)
+
+        # only used by the writer thread
+        self._segment = None
+        self._index = None
+        self._segment_started = None
+        self._block = []
+        self._block_size = 0
+        self._last_received_at = 0.0
+
+    def __repr__(self):
+        return f'<{self.__class__.__name__} {self.archive_dir} segment={self.segment_max_bytes // (1024 * 1024)}MB/{self.segment_max_age}s {self.stats}>'
+
+    @property
+    def queue_depth(self):
+        return self._queue.qsize()
+
+    def start(self):
+        if self._thread is None:
+            os.makedirs(self.archive_dir, exist_ok=True)
+            self._thread = threading.Thread(target=self._run, name='packet-archive', daemon=True)
+            self._thread.start()
+
+    def stop(self, timeout=10):
+        """Writes anything still queued and stops the writer thread."""
+        if self._thread is not None:
+            self._queue.put(_STOP)
+            self._thread.join(timeout=timeout)
+            self._thread = None
+
+    def enqueue(self, packet):
+        """Queues a received packet dict (with the library's 'raw' MeshPacket) to be archived. Never blocks."""
+        raw = packet.get('raw')
+        if isinstance(raw, mesh_pb2.MeshPacket):
+            self._queue.put((time.time(), raw))
+
+    def _run(self):
+        stop = False
+        while not stop:
+            deadline = time.monotonic() + self.flush_interval
+            while self._block_size < self.block_bytes:
+                timeout = None if not self._block else max(0, deadline - time.monotonic())
+                try:
+                    item = self._queue.get(timeout=timeout)
+                except queue.Empty:
+                    break
+                if item is _STOP:
+                    stop = True
+                    break
+                if not self._block:
+                    deadline = time.monotonic() + self.flush_interval
+                self._add(*item)
+            try:
+                self._write_block()
+            except Exception as e:
+                self.stats.errors += 1
+                logging.exception('PacketArchiveWriter: failed to write block', exc_info=e)
+                self._close_segment()
+        self._close_segment()
+        logging.info(f'PacketArchiveWriter finished. {self.stats}')
+
+    def _add(self, received_at, raw):
+        # the index is searched by received at, keep it sorted even if the clock steps back
+        received_at = max(received_at, self._last_received_at)
+        self._last_received_at = received_at
+        data = raw.SerializeToString()
+        self._block.append((received_at, getattr(raw, 'from'), raw.id, data))
+        self._block_size += RECORD_HEADER.size + len(data)
+
+    def _write_block(self):
+        if not self._block:
+            return
+        block, self._block, self._block_size = self._block, [], 0
+
+        if self._segment is None or self._segment_full():
+            self._open_segment()
+
+        payload = b''.join(RECORD_HEADER.pack(received_at, len(data)) + data for received_at, _, _, data in block)
+        compressed = zlib.compress(payload, self.compression_level)
+        offset = self._segment.tell()
+        self._segment.write(BLOCK_HEADER.pack(len(compressed), len(block), zlib.crc32(compressed)) + compressed)
+        self._segment.flush()
+        self._index.write(b''.join(
+            INDEX_ENTRY.pack(received_at, src_num, pkt_id, offset, i) for i, (received_at, src_num, pkt_id, _) in enumerate(block)
+        ))
+        self._index.flush()
+
+        self.stats.packets += len(block)
+        self.stats.blocks += 1
+        self.stats.bytes_in += len(payload)
+        self.stats.bytes_out += BLOCK_HEADER.size + len(compressed)
+
+    def _segment_full(self):
+        return self._segment.tell() >= self.segment_max_bytes or time.monotonic() - self._segment_started >= self.segment_max_age
+
+    def _open_segment(self):
+        self._close_segment()
+        name = f'packets-{datetime.datetime.now(datetime.timezone.utc):%Y%m%dT%H%M%S}'
+        n = 1
+        while os.path.exists(os.path.join(self.archive_dir, f'{name}-{n:03d}{SEGMENT_SUFFIX}')):
+            n += 1
+        base = os.path.join(self.archive_dir, f'{name}-{n:03d}')
+        self._segment = open(base + SEGMENT_SUFFIX, 'xb')
+        self._segment.write(SEGMENT_MAGIC)
+        self._index = open(base + INDEX_SUFFIX, 'xb')
+        self._segment_started = time.monotonic()
+        self.stats.segments += 1
+        logging.info(f'PacketArchiveWriter: started segment {os.path.basename(base)}')
+
+    def _close_segment(self):
+        for f in (self._segment, self._index):
+            if f is not None:
+                try:
+                    f.close()
+                except Exception as e:
+                    logging.error(f'PacketArchiveWriter: error closing {f.name}: {e}')
+        self._segment = None
+        self._index = None
@@ -0,0 +1,186 @@
+import datetime
+import math
+import struct
+
+import google.protobuf.json_format
+from meshtastic import protocols
+from meshtastic.protobuf import mesh_pb2, portnums_pb2
+
+from db_classes import RXPacket
+
+
+# enum value -> name, as MessageToDict gives them (unknown values stay ints)
+_PORTNUM_NAMES = {value.number: value.name for value in portnums_pb2.PortNum.DESCRIPTOR.values}
+_PRIORITY_NAMES = {value.number: value.name for value in mesh_pb2.MeshPacket.Priority.DESCRIPTOR.values}
+
+BROADCAST_NUM = 0xFFFFFFFF
+
+
+def _float32(value):
+    # MessageToDict gives float fields as the shortest decimal that reads back as the same float32
+    # (-12.34, not -12.34000015258789), so the DB gets the same value either way
+    if not value:
+        # MessageToDict only leaves out +0.0
+        return value if math.copysign(1.0, value) < 0 else None
+    for precision in range(6, 10):
+        rounded = float(f'{value:.{precision}g}')
+        if struct.unpack('<f', struct.pack('<f', rounded))[0] == value:
+            return rounded
+    return value
+
+
+def to_packet_dict(mesh_packet):
+    """The packet dict MeshInterface publishes on meshtastic.receive for a MeshPacket (same conversion as
+    MeshInterface._handlePacketFromRadio, without updating the node DB)."""
+    d = google.protobuf.json_format.MessageToDict(mesh_packet)
+    d['raw'] = mesh_packet
+    d.setdefault('from', 0)
+    d.setdefault('to', 0)
+    d['fromId'] = f'!{d["from"]:08x}'
+    d['toId'] = '^all' if d['to'] == BROADCAST_NUM else f'!{d["to"]:08x}'
+
+    decoded = d.get('decoded')
+    if decoded is not None:
+        decoded['payload'] = mesh_packet.decoded.payload
+        handler = protocols.get(mesh_packet.decoded.portnum)
+        if handler is not None:
+            if handler.protobufFactory is not None:
+                pb = handler.protobufFactory()
+                pb.ParseFromString(mesh_packet.decoded.payload)
+                p = google.protobuf.json_format.MessageToDict(pb)
+                decoded[handler.name] = p
+                decoded[handler.name]['raw'] = pb
+            if mesh_packet.decoded.portnum == portnums_pb2.TEXT_MESSAGE_APP:
+                decoded['text'] = mesh_packet.decoded.payload.decode('utf-8')
+            elif mesh_packet.decoded.portnum == portnums_pb2.POSITION_APP:
+                # meshtastic's position handler adds the float versions
+                position = decoded['position']
+                if 'latitudeI' in position:
+                    position['latitude'] = float(position['latitudeI'] * 1e-7)
+                if 'longitudeI' in position:
+                    position['longitude'] = float(position['longitudeI'] * 1e-7)
+    return d
+
+
+class PacketRecord():
+    '''The rx_packets fields of a received packet, parsed before (and often without) building an RXPacket.
+
+    The common fields are read straight from the raw MeshPacket protobuf the library publishes as
+    packet['raw'] (or from the packet dict if there's none), and node names from the NodeDirectory. Unset
+    protobuf fields are None, like the keys MessageToDict leaves out.
+
+    port_fields holds what the portnum handler parsed: RXPacket columns (text, ...) and side table dicts by
+    RXPacket relationship name (e.g. 'position': {...}). Nothing is built from them until the packet is
+    persisted: to_insert_row()/detail_rows() give Core insert rows for RXPacketWriter, to_rx_packet() an
+    RXPacket for code that needs the ORM object (e.g. ACK.ack_packet).
+    '''
+
+    common_columns = (
+        'pkt_id', 'publisher_mesh_node_num', 'publisher_discord_bot_user_id', 'channel',
+        'src_num', 'src_id', 'src_short_name', 'src_long_name',
+        'dst_num', 'dst_id', 'dst_short_name', 'dst_long_name',
+        'hop_limit', 'hop_start', 'pki_encrypted', 'portnum', 'priority',
+        'rx_time', 'rx_rssi', 'rx_snr', 'to_all', 'want_ack', 'ts',
+    )
+
+    __slots__ = common_columns + ('port_fields', 'id')
+
+    def __init__(self, **fields):
+        for key in self.common_columns:
+            setattr(self, key, fields.get(key))
+        self.port_fields = {}
+        self.id = None  # rx_packets.id, set by RXPacketWriter
+
+    def __repr__(self):
+        return f'<{self.__class__.__name__} {self.portnum} pkt_id={self.pkt_id} from={self.src_id}>'
+
+    @classmethod
+    def from_packet(cls, packet, publisher_mesh_node_num, publisher_discord_bot_user_id, node_directory):
+        """Parses the common fields of a packet dict as published on meshtastic.receive."""
+        record = cls.__new__(cls)
+        raw = packet.get('raw')
+        if isinstance(raw, mesh_pb2.MeshPacket):
+            src_num = getattr(raw, 'from')
+            dst_num = raw.to
+            record.pkt_id = raw.id or None
+            record.channel = raw.channel or None
+            record.hop_limit = raw.hop_limit or None
+            record.hop_start = raw.hop_start or None
+            record.pki_encrypted = raw.pki_encrypted or None
+            record.portnum = _PORTNUM_NAMES.get(raw.decoded.portnum, raw.decoded.portnum) if raw.HasField('decoded') else None
+            record.priority = _PRIORITY_NAMES.get(raw.priority, raw.priority) if raw.priority else None
+            record.rx_time = raw.rx_time or None
+            record.rx_rssi = raw.rx_rssi or None
+            record.rx_snr = _float32(raw.rx_snr)
+            record.want_ack = raw.want_ack or None
+        else:
+            src_num = packet.get('from')
+            dst_num = packet.get('to')
+            record.pkt_id = packet.get('id')
+            record.channel = packet.get('channel')
+            record.hop_limit = packet.get('hopLimit')
+            record.hop_start = packet.get('hopStart')
+            record.pki_encrypted = packet.get('pkiEncrypted')
+            record.portnum = packet.get('decoded', {}).get('portnum')
+            record.priority = packet.get('priority')
+            record.rx_time = packet.get('rxTime')
+            record.rx_rssi = packet.get('rxRssi')
+            record.rx_snr = packet.get('rxSnr')
+            record.want_ack = packet.get('wantAck')
+
+        record.publisher_mesh_node_num = publisher_mesh_node_num
+        record.publisher_discord_bot_user_id = publisher_discord_bot_user_id
+        record.src_num = src_num
+        record.dst_num = dst_num
+        record.set_node_names(node_directory)
+        record.to_all = dst_num == BROADCAST_NUM
+        record.ts = datetime.datetime.now(datetime.timezone.utc)
+        record.port_fields = {}
+        record.id = None
+        return record
+
+    def set_node_names(self, node_directory):
+        """Sets the src/dst IDs and names from node_directory (anything with get(num) -> node dict). With None,
+        only the IDs are set, e.g. when the names are looked up later in packet order (see packet_replay.py)."""
+        self.src_id, self.src_short_name, self.src_long_name = self.node_names(node_directory, self.src_num)
+        self.dst_id, self.dst_short_name, self.dst_long_name = self.node_names(node_directory, self.dst_num)
+
+    @staticmethod
+    def node_names(node_directory, num):
+        # same values as MeshClient.get_short_name/get_long_name, without going through the node ID
+        if num is None:
+            return None, None, None
+        if node_directory is None:
+            return f'!{num:x}', None, None
+        node = node_directory.get(num)
+        if node and 'user' in node:
+            user = node['user']
+            return f'!{num:x}', user.get('shortName', '?'), user.get('longName', '?')
+        if num == BROADCAST_NUM:
+            return f'!{num:x}', '^all', 'Broadcast'
+        return f'!{num:x}', '?', '?'
+
+    def to_insert_row(self):
+        """Column values for a bulk Core insert into rx_packets (see RXPacketWriter)."""
+        row = dict.fromkeys(RXPacket.insert_columns)
+        for key in self.common_columns:
+            row[key] = getattr(self, key)
+        for key, value in self.port_fields.items():
+            if key not in RXPacket.detail_classes:
+                row[key] = value
+        return row
+
+    def detail_rows(self):
+        """(side table, insert row without packet_id) for each side table dict in port_fields."""
+        return [
+            (RXPacket.detail_classes[key], RXPacket.detail_classes[key].values_from_dict(value))
+            for key, value in self.port_fields.items() if key in RXPacket.detail_classes
+        ]
+
+    def to_rx_packet(self):
+        """Builds the RXPacket (with its side table rows) for this packet."""
+        fields = {key: getattr(self, key) for key in self.common_columns}
+        for key, value in self.port_fields.items():
+            detail = RXPacket.detail_classes.get(key)
+            fields[key] = detail.from_dict(value) if detail is not None else value
+        return RXPacket(**fields)
@@ -0,0 +1,454 @@
+import base64
+import collections
+import concurrent.futures
+import datetime
+import io
+import json
+import logging
+import operator
+import os
+import time
+
+from meshtastic.protobuf import mesh_pb2
+from sqlalchemy import JSON, func, select, text
+
+from db_classes import MeshNodeDB, RXPacket, discord_bot_id
+from packet_archive import PacketArchive
+from packet_record import PacketRecord, to_packet_dict
+from portnum_handlers import PortnumHandlerRegistry
+
+
+class ArchiveSource():
+    '''Replays a packet archive (see packet_archive.PacketArchiveWriter), one chunk per compressed block.
+
+    Chunk items are (received_at, MeshPacket bytes). Positions are [segment name, offset of the next block].
+    '''
+
+    format = 'archive'
+
+    def __init__(self, archive_dir, start=None, end=None):
+        self.path = os.path.abspath(archive_dir)
+        self.start = start
+        self.end = end
+
+    def __repr__(self):
+        return f'<{self.__class__.__name__} {self.path}>'
+
+    def chunks(self, position=None):
+        """Yields (position after the chunk, items), oldest first, continuing after position if given."""
+        resume_segment, resume_offset = position or (None, None)
+        for segment in PacketArchive(self.path).segments():
+            offset = None
+            if resume_segment is not None:
+                if segment.name < resume_segment:
+                    continue
+                if segment.name == resume_segment:
+                    offset = resume_offset
+            if offset is None and self.start is not None:
+                # skip to the block with the first packet received at or after start
+                index = segment.index()
+                if index is not None:
+                    with index:
+                        i = index.bisect(self.start)
+                        if i == len(index):
+                            continue
+                        offset = index[i][3]
+            for records, next_offset in segment.blocks(offset):
+                if self.end is not None and records and records[0][0] >= self.end:
+                    return
+                yield [segment.name, next_offset], records
+
+
+class JsonlSource():
+    '''Replays a JSON lines capture, chunk_lines lines per chunk. Positions are byte offsets.
+
+    Each line is one packet dict as published on meshtastic.receive. If it has a 'raw' key with the base64
+    MeshPacket bytes, the dict is built from those instead, like for archived packets. The receive time is
+    'received_at' (epoch seconds) if present, otherwise rxTime.
+    '''
+
+    format = 'jsonl'
+
+    def __init__(self, path, chunk_lines=2000):
+        self.path = os.path.abspath(path)
+        self.chunk_lines = chunk_lines
+
+    def __repr__(self):
+        return f'<{self.__class__.__name__} {self.path}>'
+
+    def chunks(self, position=None):
+        with open(self.path, 'rb') as f:
+            f.seek(position or 0)
+            eof = False
+            while not eof:
+                lines = []
+                while len(lines) < self.chunk_lines:
+                    line = f.readline()
+                    if not line:
+                        eof = True
+                        break
+                    if line.strip():
+                        lines.append(line)
+                if lines:
+                    yield f.tell(), lines
+
+
+class ReplayParser():
+    '''Parses replayed packets with the bot's own parsing code (PortnumHandlerRegistry.build_record), on a
+    worker process. It stands in for the MeshClient the handlers are given. No side effects are run.
+
+    Node names are not looked up here: they depend on the NODEINFO packets before each packet, so the main
+    process fills them in, in packet order (see PacketReplay).
+    '''
+
+    def __init__(self, publisher_mesh_node_num, publisher_discord_bot_user_id, start=None, end=None):
+        self.publisher_mesh_node_num = publisher_mesh_node_num
+        self.publisher_discord_bot_user_id = publisher_discord_bot_user_id
+        self.start = start
+        self.end = end
+        self.portnum_handlers = PortnumHandlerRegistry.default()
+
+    def packet_record(self, packet):
+        """Same as MeshClient.packet_record, without the node names."""
+        return PacketRecord.from_packet(packet, self.publisher_mesh_node_num, self.publisher_discord_bot_user_id, None)
+
+    def parse_chunk(self, source_format, items):
+        """Returns ([(rx_packets row, side table rows, nodeinfo user or None)], number of packets that failed)."""
+        parsed = []
+        errors = 0
+        for item in items:
+            try:
+                if source_format == ArchiveSource.format:
+                    received_at, data = item
+                    packet = self._from_bytes(data)
+                else:
+                    packet = json.loads(item)
+                    received_at = packet.pop('received_at', None) or packet.get('rxTime')
+                    if isinstance(packet.get('raw'), str):
+                        packet = self._from_bytes(base64.b64decode(packet['raw']))
+                if received_at is not None and not self._in_range(received_at):
+                    continue
+                parsed.append(self.parse(packet, received_at))
+            except Exception as e:
+                errors += 1
+                logging.warning(f'Replay: could not parse packet: {str(type(e))} {e}')
+        return parsed, errors
+
+    def parse(self, packet, received_at):
+        record = self.portnum_handlers.build_record(self, packet)
+        # ts is when the bot received the packet, not when it is replayed
+        record.ts = datetime.datetime.fromtimestamp(received_at, datetime.timezone.utc) if received_at is not None else None
+        user = None
+        if record.portnum == 'NODEINFO_APP':
+            nodeinfo = record.port_fields.get('nodeinfo') or {}
+            user = {key: nodeinfo[key] for key in ('id', 'shortName', 'longName') if key in nodeinfo}
+        return record.to_insert_row(), record.detail_rows(), user
+
+    def _in_range(self, received_at):
+        return (self.start is None or received_at >= self.start) and (self.end is None or received_at < self.end)
+
+    @staticmethod
+    def _from_bytes(data):
+        mesh_packet = mesh_pb2.MeshPacket()
+        mesh_packet.ParseFromString(data)
+        return to_packet_dict(mesh_packet)
+
+
+# the ReplayParser of a worker process, see _init_worker
+_parser = None
+
+
+def _init_worker(*args):
+    global _parser
+    _parser = ReplayParser(*args)
+
+
+def _parse_chunk(source_format, items):
+    return _parser.parse_chunk(source_format, items)
+
+
+class BulkPacketWriter():
+    '''Writes replayed packets in large batches, one transaction per batch.
+
+    Unlike RXPacketWriter, the rx_packets ids are allocated up front (max(id) on sqlite, the id sequence on
+    postgres), so rx_packets and every side table are written with a single statement each, without
+    waiting for RETURNING: a cursor.executemany on sqlite, a COPY on postgres. With a partition_manager, the
+    monthly partitions the packets fall in are created first.
+
+    On sqlite, stop the bot while replaying: ids taken from max(id) would collide with the ones it writes.
+    '''
+
+    def __init__(self, engine, partition_manager=None):
+        self._engine = engine
+        self.partition_manager = partition_manager
+
+    def __repr__(self):
+        return f'<{self.__class__.__name__} {self._engine.dialect.name}>'
+
+    def write(self, rows, details):
+        """Writes rx_packets rows (to_insert_row dicts) and their side table rows ((table, row) lists)."""
+        with self._engine.begin() as conn:
+            if self.partition_manager is not None:
+                self.partition_manager.create_partitions(conn, [row['ts'] for row in rows if row['ts'] is not None])
+            rows_by_table = {}
+            for row, row_id, packet_details in zip(rows, self._allocate_ids(conn, len(rows)), details):
+                row['id'] = row_id
+                for table, detail_row in packet_details:
+                    detail_row['packet_id'] = row_id
+                    rows_by_table.setdefault(table, []).append(detail_row)
+            self._insert(conn, RXPacket, rows)
+            for table, table_rows in rows_by_table.items():
+                self._insert(conn, table, table_rows)
+
+    @staticmethod
+    def _allocate_ids(conn, count):
+        if conn.dialect.name == 'postgresql':
+            return conn.execute(text(
+                "SELECT nextval(pg_get_serial_sequence(:table, 'id')) FROM generate_series(1, :count)"
+            ), {'table': RXPacket.__tablename__, 'count': count}).scalars().all()
+        max_id = conn.execute(select(func.max(RXPacket.id))).scalar() or 0
+        return range(max_id + 1, max_id + 1 + count)
+
+    def _insert(self, conn, table, rows):
+        if conn.dialect.name == 'postgresql':
+            self._copy(conn, table.__table__, rows)
+        else:
+            self._executemany(conn, table.__table__, rows)
+
+    @staticmethod
+    def _executemany(conn, table, rows):
+        # one cursor.executemany of value lists. Values are converted with the column types' bind processors,
+        # the same conversion conn.execute(insert(table), rows) does, without building a parameter dict per row
+        columns = list(rows[0])
+        processors = [
+            (i, processor) for i, processor in enumerate(
+                table.columns[column].type.dialect_impl(conn.dialect).bind_processor(conn.dialect) for column in columns
+            ) if processor is not None
+        ]
+        get_values = operator.itemgetter(*columns)
+        params = []
+        for row in rows:
+            values = list(get_values(row))
+            for i, processor in processors:
+                values[i] = processor(values[i])
+            params.append(tuple(values))
+        sql = f'INSERT INTO {table.name} ({", ".join(columns)}) VALUES ({", ".join("?" * len(columns))})'
+        conn.exec_driver_sql(sql, params)
+
+    def _copy(self, conn, table, rows):
+        columns = list(rows[0])
+        json_columns = {column.key for column in table.columns if isinstance(column.type, JSON)}
+        buf = io.StringIO()
+        for row in rows:
+            buf.write('\t'.join(self._copy_value(row[column], column in json_columns) for column in columns))
+            buf.write('\n')
+        buf.seek(0)
+        cursor = conn.connection.cursor()
+        try:
+            cursor.copy_expert(f'COPY {table.name} ({", ".join(columns)}) FROM STDIN', buf)
+        finally:
+            cursor.close()
+
+    @staticmethod
+    def _copy_value(value, is_json=False):
+        # COPY text format: \N is NULL, backslash escapes for the delimiter and line breaks
+        if value is None:
+            return '\\N'
+        if is_json:
+            value = json.dumps(value)
+        elif isinstance(value, bool):
+            return 't' if value else 'f'
+        elif isinstance(value, datetime.datetime):
+            return value.isoformat()
+        elif isinstance(value, float):
+            return repr(value)
+        else:
+            value = str(value)
+        return value.replace('\\', '\\\\').replace('\t', '\\t').replace('\n', '\\n').replace('\r', '\\r')
+
+
+class ReplayCheckpoint():
+    '''Where a replay got to, saved (atomically) after every batch that was committed, so an interrupted
+    replay continues after the last batch instead of writing packets twice.'''
+
+    def __init__(self, path):
+        self.path = path
+
+    def __repr__(self):
+        return f'<{self.__class__.__name__} {self.path}>'
+
+    def load(self, source):
+        """The position to continue from, None to start at the beginning. Raises ValueError if the
+        checkpoint is for another source."""
+        if not os.path.exists(self.path):
+            return None
+        with open(self.path) as f:
+            checkpoint = json.load(f)
+        if checkpoint.get('format') != source.format or checkpoint.get('source') != source.path:
+            raise ValueError(f'{self.path} is a checkpoint for {checkpoint.get("source")}, not {source.path}. Use another checkpoint file or start over.')
+        logging.info(f'Replay: continuing after {checkpoint["packets"]} packets, from {checkpoint["position"]}')
+        return checkpoint['position']
+
+    def save(self, source, position, packets):
+        checkpoint = {
+            'format': source.format,
+            'source': source.path,
+            'position': position,
+            'packets': packets,
+            'upd_ts': datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        }
+        tmp_path = f'{self.path}.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(checkpoint, f)
+        os.replace(tmp_path, self.path)
+
+    def clear(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+
+class ReplayStats():
+    """Counters for PacketReplay.run."""
+
+    def __init__(self):
+        self.packets = 0
+        self.errors = 0
+        self.batches = 0
+        self.parse_wait = 0.0
+        self.write_time = 0.0
+        self.started = time.monotonic()
+
+    def __repr__(self):
+        return f'<{self.__class__.__name__} packets={self.packets} errors={self.errors} rate={self.rate:.0f}/s>'
+
+    @property
+    def elapsed(self):
+        return time.monotonic() - self.started
+
+    @property
+    def rate(self):
+        return self.packets / self.elapsed if self.elapsed else 0.0
+
+
+class PacketReplay():
+    '''Rebuilds or backfills rx_packets (and the side tables) from recorded packets.
+
+    Chunks of the source are parsed on a pool of `workers` processes (in this process with workers=0), with
+    the same handlers as MeshClient.onReceiveMesh. The results are taken in source order: node names are
+    filled in from `nodes` ({num: node dict}, updated by NODEINFO packets as they come, like
+    NodeInfoHandler.prepare does), then every batch_size packets are written by a BulkPacketWriter and the
+    checkpoint is saved.
+
+    Packets are not checked against the ones already in the database, replay a time range that isn't in
+    it yet, or into an empty database.
+    '''
+
+    def __init__(self, source, writer, publisher_mesh_node_num, publisher_discord_bot_user_id, nodes=None, workers=None,
+                 batch_size=5000, checkpoint=None, start=None, end=None):
+        self.source = source
+        self.writer = writer
+        self.publisher_mesh_node_num = publisher_mesh_node_num
+        self.publisher_discord_bot_user_id = publisher_discord_bot_user_id
+        self.nodes = nodes if nodes is not None else {}
+        self.workers = os.cpu_count() if workers is None else workers
+        self.batch_size = batch_size
+        self.checkpoint = checkpoint
+        self.start = start
+        self.end = end
+        self.stats = ReplayStats()
+
+    def __repr__(self):
+        return f'<{self.__class__.__name__} {self.source} workers={self.workers} batch={self.batch_size}>'
+
+    def run(self, position=None):
+        """Replays the source from position (None = the beginning) to the end. Returns the ReplayStats."""
+        self.stats = ReplayStats()
+        rows, details = [], []
+        for position, parsed, errors in self._parsed_chunks(position):
+            self.stats.errors += errors
+            for row, packet_details, user in parsed:
+                if user is not None:
+                    node = self.nodes.get(row['src_num'], {'num': row['src_num']})
+                    self.nodes[row['src_num']] = {**node, 'user': {**node.get('user', {}), **user}}
+                for prefix in ('src', 'dst'):
+                    names = PacketRecord.node_names(self.nodes, row[f'{prefix}_num'])
+                    row[f'{prefix}_id'], row[f'{prefix}_short_name'], row[f'{prefix}_long_name'] = names
+                rows.append(row)
+                details.append(packet_details)
+            if len(rows) >= self.batch_size:
+                self._write(rows, details, position)
+                rows, details = [], []
+        if rows:
+            self._write(rows, details, position)
+        logging.info(f'Replay: {self.stats.packets} packets in {self.stats.elapsed:.1f}s ({self.stats.rate:.0f}/s), '
+                     f'{self.stats.errors} could not be parsed. Waited {self.stats.parse_wait:.1f}s for parsing, '
+                     f'{self.stats.write_time:.1f}s writing.')
+        return self.stats
+
+    def _parsed_chunks(self, position):
+        """Yields (position after the chunk, parsed packets, errors) for each chunk, in source order."""
+        parser_args = (self.publisher_mesh_node_num, self.publisher_discord_bot_user_id, self.start, self.end)
+        chunks = self.source.chunks(position)
+        if not self.workers:
+            parser = ReplayParser(*parser_args)
+            for chunk_position, items in chunks:
+                tic = time.monotonic()
+                parsed, errors = parser.parse_chunk(self.source.format, items)
+                self.stats.parse_wait += time.monotonic() - tic
+                yield chunk_position, parsed, errors
+            return
+
+        with concurrent.futures.ProcessPoolExecutor(max_workers=self.workers, initializer=_init_worker, initargs=parser_args) as pool:
+            # a few chunks per worker in flight, so reading the source never gets far ahead of the writes
+            pending = collections.deque()
+            for chunk_position, items in chunks:
+                pending.append((chunk_position, pool.submit(_parse_chunk, self.source.format, items)))
+                if len(pending) >= self.workers * 3:
+                    yield self._result(*pending.popleft())
+            while pending:
+                yield self._result(*pending.popleft())
+
+    def _result(self, chunk_position, future):
+        tic = time.monotonic()
+        parsed, errors = future.result()
+        self.stats.parse_wait += time.monotonic() - tic
+        return chunk_position, parsed, errors
+
+    def _write(self, rows, details, position):
+        tic = time.monotonic()
+        self.writer.write(rows, details)
+        self.stats.write_time += time.monotonic() - tic
+        self.stats.packets += len(rows)
+        self.stats.batches += 1
+        if self.checkpoint is not None:
+            self.checkpoint.save(self.source, position, self.stats.packets)
+        logging.info(f'Replay: {self.stats.packets} packets written ({self.stats.rate:.0f}/s), at {position}')
+
+    @staticmethod
+    def publisher(conn):
+        """(publisher_mesh_node_num, publisher_discord_bot_user_id) of the last bot that started on this
+        database, or (None, None)."""
+        bot = conn.execute(select(discord_bot_id.publisher_mesh_node_num, discord_bot_id.publisher_discord_bot_user_id)
+                           .order_by(discord_bot_id.id.desc()).limit(1)).first()
+        if bot is None:
+            return None, None
+        return int(bot[0]), int(bot[1])
+
+    @staticmethod
+    def known_nodes(conn, publisher_mesh_node_num):
+        """{num: node dict} of the nodes in the nodes table, to start the node names from."""
+        query = select(
+            MeshNodeDB.node_num,
+            MeshNodeDB.user_id_nodeinfo, MeshNodeDB.user_short_name_nodeinfo, MeshNodeDB.user_long_name_nodeinfo,
+            MeshNodeDB.user_id_nodedb, MeshNodeDB.user_short_name_nodedb, MeshNodeDB.user_long_name_nodedb,
+        ).where(MeshNodeDB.publisher_mesh_node_num == str(publisher_mesh_node_num))
+        nodes = {}
+        for num, *names in conn.execute(query):
+            node_id = names[0] or names[3]
+            short_name = names[1] or names[4]
+            long_name = names[2] or names[5]
+            if num is None or not (short_name or long_name):
+                continue
+            user = {key: value for key, value in (('id', node_id), ('shortName', short_name), ('longName', long_name)) if value}
+            nodes[num] = {'num': num, 'user': user}
+        return nodes
@@ -0,0 +1,165 @@
+import datetime
+import logging
+import re
+
+from sqlalchemy import text
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.schema import CreateIndex, CreateTable
+
+from db_classes import RXPacket, RX_PACKET_DETAILS
+
+
+class RXPacketPartition():
+    """One monthly partition of rx_packets, covering [start, end)."""
+
+    def __init__(self, name, start, end):
+        self.name = name
+        self.start = start
+        self.end = end
+
+    def __repr__(self):
+        return f'<{self.__class__.__name__} {self.name} {self.start:%Y-%m-%d}..{self.end:%Y-%m-%d}>'
+
+
+class RXPacketPartitionManager():
+    '''Monthly range partitioning of rx_packets on ts (postgres only).
+
+    The partitioned table's primary key is (id, ts), since postgres requires the partition key in it. Every
+    query on rx_packets with a ts range (e.g. /active, /nodeinfo, retention) only scans the partitions
+    that range covers. Rows outside every monthly partition go to rx_packets_default.
+
+    Partitions for the current month and months_ahead months after it are created at startup and by the
+    RetentionJob, so inserts never land in the default partition in normal operation. Dropping a whole
+    partition is how old packets are removed cheaply (see drop_before). The side tables (RXPacketDetail)
+    stay single tables, keyed by packet id.
+
+    On sqlite every method does nothing, rx_packets stays a plain table.
+    '''
+
+    table_name = RXPacket.__tablename__
+    default_partition = f'{table_name}_default'
+    _name_re = re.compile(rf'^{table_name}_p(\d{{4}})_(\d{{2}})$')
+
+    def __init__(self, months_ahead=3):
+        self.months_ahead = months_ahead
+
+    def __repr__(self):
+        return f'<{self.__class__.__name__} months_ahead={self.months_ahead}>'
+
+    @staticmethod
+    def is_supported(conn):
+        return conn.dialect.name == 'postgresql'
+
+    @staticmethod
+    def month_start(ts):
+        return datetime.datetime(ts.year, ts.month, 1, tzinfo=datetime.timezone.utc)
+
+    @staticmethod
+    def next_month(month):
+        if month.month == 12:
+            return month.replace(year=month.year + 1, month=1)
+        return month.replace(month=month.month + 1)
+
+    def partition_name(self, month):
+        return f'{self.table_name}_p{month:%Y_%m}'
+
+    def is_partitioned(self, conn):
+        # relkind 'p' = partitioned table, None = doesn't exist yet
+        relkind = conn.execute(text("SELECT relkind FROM pg_class WHERE oid = to_regclass(:name)"), {'name': self.table_name}).scalar()
+        if relkind is None:
+            return None
+        return relkind == 'p'
+
+    def setup(self, conn, now=None):
+        """Creates rx_packets as a partitioned table if it doesn't exist yet, then its upcoming partitions.
+        Run before Base.metadata.create_all (which skips rx_packets once it exists)."""
+        if not self.is_supported(conn):
+            logging.info(f'rx_packets partitioning is only supported on postgres, not {conn.dialect.name}. Using a single table.')
+            return False
+
+        partitioned = self.is_partitioned(conn)
+        if partitioned is False:
+            logging.warning(f'{self.table_name} already exists and is not partitioned. Convert it with '
+                            'db_scripts/0.1/update/from_0.1.25_postgres_partitioned.sql to use partitioning.')
+            return False
+
+        if partitioned is None:
+            ddl = str(CreateTable(RXPacket.__table__).compile(dialect=postgresql.dialect())).rstrip()
+            ddl = ddl.replace('PRIMARY KEY (id)', 'PRIMARY KEY (id, ts)')
+            conn.execute(text(f'{ddl} PARTITION BY RANGE (ts)'))
+            # indexes on the parent are created on every partition too
+            for index in RXPacket.__table__.indexes:
+                conn.execute(CreateIndex(index, if_not_exists=True))
+            conn.execute(text(f'CREATE TABLE IF NOT EXISTS {self.default_partition} PARTITION OF {self.table_name} DEFAULT'))
+            logging.info(f'Created {self.table_name} partitioned by month')
+
+        self.ensure_partitions(conn, now=now)
+        return True
+
+    def ensure_partitions(self, conn, now=None):
+        """Creates the partitions for this month and the next months_ahead months. Returns the names created."""
+        now = now or datetime.datetime.now(datetime.timezone.utc)
+        months = []
+        month = self.month_start(now)
+        for _ in range(self.months_ahead + 1):
+            months.append(month)
+            month = self.next_month(month)
+        return self.create_partitions(conn, months)
+
+    def create_partitions(self, conn, months):
+        """Creates the partitions for the months (datetimes within them) that don't have one yet, e.g. for
+        replayed packets from before the bot created partitions. Returns the names created."""
+        if not self.is_supported(conn) or not self.is_partitioned(conn):
+            return []
+        existing = {p.name for p in self.partitions(conn)}
+        created = []
+        for month in sorted({self.month_start(month) for month in months}):
+            name = self.partition_name(month)
+            if name not in existing:
+                # fails if the default partition already holds rows for this month, that needs a manual fix
+                conn.execute(text(
+                    f"CREATE TABLE IF NOT EXISTS {name} PARTITION OF {self.table_name} "
+                    f"FOR VALUES FROM ('{month.isoformat()}') TO ('{self.next_month(month).isoformat()}')"
+                ))
+                created.append(name)
+        if created:
+            logging.info(f'Created {self.table_name} partitions: {", ".join(created)}')
+        return created
+
+    def partitions(self, conn):
+        """The monthly partitions of rx_packets (not the default one), oldest first."""
+        names = conn.execute(text(
+            "SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid "
+            "WHERE i.inhparent = to_regclass(:name)"
+        ), {'name': self.table_name}).scalars().all()
+        partitions = []
+        for name in names:
+            match = self._name_re.match(name)
+            if match is None:
+                continue
+            start = datetime.datetime(int(match[1]), int(match[2]), 1, tzinfo=datetime.timezone.utc)
+            partitions.append(RXPacketPartition(name, start, self.next_month(start)))
+        return sorted(partitions, key=lambda p: p.start)
+
+    def drop_before(self, conn, cutoff, rollup_max_id=None):
+        """Drops the monthly partitions that only hold packets received before cutoff. A partition with
+        TELEMETRY_APP packets that haven't been rolled up yet (id > rollup_max_id) is kept. ACKs of dropped
+        routing packets keep their ack_packet_id, ACK.ack_packet is then None. Returns the names dropped."""
+        if not self.is_supported(conn) or not self.is_partitioned(conn):
+            return []
+        dropped = []
+        for partition in self.partitions(conn):
+            if partition.end > cutoff:
+                break
+            not_rolled_up = text(f"SELECT 1 FROM {partition.name} WHERE portnum = 'TELEMETRY_APP' AND id > :max_id LIMIT 1")
+            if conn.execute(not_rolled_up, {'max_id': rollup_max_id if rollup_max_id is not None else -1}).first() is not None:
+                logging.warning(f'Not dropping {partition.name}, it has telemetry that has not been rolled up yet')
+                continue
+            # the side tables aren't partitioned, their rows go first
+            for detail in RX_PACKET_DETAILS:
+                conn.execute(text(f'DELETE FROM {detail.__tablename__} WHERE packet_id IN (SELECT id FROM {partition.name})'))
+            conn.execute(text(f'DROP TABLE {partition.name}'))
+            dropped.append(partition.name)
+        if dropped:
+            logging.info(f'Dropped {self.table_name} partitions: {", ".join(dropped)}')
+        return dropped
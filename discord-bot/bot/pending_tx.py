@@ -0,0 +1,114 @@
+import logging
+import threading
+import time
+
+
+class PendingTX():
+    """A transmitted packet that may still receive ACKs."""
+
+    def __init__(self, publisher_mesh_node_num, packet_id, tx_packet_row_id, discord_message_id, dest_id=None, trace=None):
+        self.publisher_mesh_node_num = str(publisher_mesh_node_num)
+        self.packet_id = int(packet_id)
+        self.tx_packet_row_id = tx_packet_row_id # tx_packets.id
+        self.discord_message_id = discord_message_id
+        self.dest_id = dest_id
+        self.sent_at = time.monotonic()
+        self.ack_pkt_ids = set() # pkt_id of the ACKs already handled, the same ACK can be delivered twice
+        self.trace = trace # tracing.Trace of the message, held until the first ACK (or expiry)
+
+    def __repr__(self):
+        return f'<{self.__class__.__name__} packet_id={self.packet_id} dest={self.dest_id} acks={len(self.ack_pkt_ids)}>'
+
+    @property
+    def key(self):
+        return (self.publisher_mesh_node_num, self.packet_id)
+
+
+class PendingTXTable():
+    """In-memory index of transmitted packets, keyed by (publisher, packet_id), used to match ACKs to them.
+
+    Packets stay in the table for `expiry` seconds after being sent, since a packet can get several ACKs
+    (implicit and explicit). An ACK that arrives before its packet has been added (the radio can answer
+    before sendText returns) is parked for up to `early_ack_expiry` seconds and handed back by add().
+    """
+
+    def __init__(self, expiry=600, early_ack_expiry=10):
+        self.expiry = expiry
+        self.early_ack_expiry = early_ack_expiry
+
+        self._lock = threading.Lock()
+        self._pending = {}
+        self._early_acks = {}
+        self._last_expire = time.monotonic()
+
+    def __repr__(self):
+        return f'<{self.__class__.__name__} pending={len(self._pending)} early_acks={len(self._early_acks)}>'
+
+    def __len__(self):
+        return len(self._pending)
+
+    @staticmethod
+    def _key(publisher_mesh_node_num, packet_id):
+        return (str(publisher_mesh_node_num), int(packet_id))
+
+    def add(self, pending_tx):
+        """Adds a sent packet. Returns any ACKs that were parked waiting for it."""
+        with self._lock:
+            self._pending[pending_tx.key] = pending_tx
+            parked = self._early_acks.pop(pending_tx.key, [])
+        self._maybe_expire()
+        return [ack for parked_at, ack in parked]
+
+    def resolve_or_park(self, publisher_mesh_node_num, packet_id, ack):
+        """Returns the PendingTX an ACK is for. If it isn't known (yet), the ACK is parked and None is returned."""
+        key = self._key(publisher_mesh_node_num, packet_id)
+        with self._lock:
+            pending_tx = self._pending.get(key)
+            if pending_tx is None:
+                self._early_acks.setdefault(key, []).append((time.monotonic(), ack))
+        self._maybe_expire()
+        return pending_tx
+
+    def claim_ack(self, pending_tx, ack_pkt_id):
+        """Records that the ACK with pkt_id ack_pkt_id is being handled. Returns (claimed, trace): claimed is
+        False if it was already handled (the same ACK is delivered to onReceiveMesh and onMsgResponse, and
+        parked ACKs are handled on the TX thread). trace is the packet's trace for the first ACK, else None."""
+        with self._lock:
+            if ack_pkt_id in pending_tx.ack_pkt_ids:
+                return False, None
+            pending_tx.ack_pkt_ids.add(ack_pkt_id)
+            trace = pending_tx.trace
+            pending_tx.trace = None
+        return True, trace
+
+    def _maybe_expire(self):
+        # cheap enough to do inline, but no need to do it on every packet
+        if time.monotonic() - self._last_expire > 1:
+            self.expire()
+
+    def expire(self):
+        now = time.monotonic()
+        with self._lock:
+            self._last_expire = now
+            expired_tx = [key for key, pending_tx in self._pending.items() if now - pending_tx.sent_at > self.expiry]
+            expired_traces = []
+            for key in expired_tx:
+                pending_tx = self._pending.pop(key)
+                if pending_tx.trace is not None:
+                    expired_traces.append(pending_tx.trace)
+                    pending_tx.trace = None
+
+            expired_acks = []
+            for key, parked in list(self._early_acks.items()):
+                still_parked = [(parked_at, ack) for parked_at, ack in parked if now - parked_at <= self.early_ack_expiry]
+                if len(still_parked) != len(parked):
+                    expired_acks.append(key)
+                if still_parked:
+                    self._early_acks[key] = still_parked
+                else:
+                    del self._early_acks[key]
+
+        for trace in expired_traces:
+            trace.release('no_ack')
+        for publisher_mesh_node_num, packet_id in expired_acks:
+            logging.error(f'No matching packet found for request_id: {packet_id}. Is this an ACK for a packet sent before the bot started, or a self-ack?')
@@ -0,0 +1,275 @@
+import contextlib
+import logging
+import time
+
+import metrics
+
+
+class HandlerStats():
+    """Call count, error count and time spent for one portnum handler."""
+
+    def __init__(self):
+        self.count = 0
+        self.errors = 0
+        self.total_time = 0.0
+        self.max_time = 0.0
+
+    def __repr__(self):
+        return f'<{self.__class__.__name__} count={self.count} errors={self.errors} avg={self.avg_ms:.2f}ms max={self.max_time*1000:.2f}ms>'
+
+    @property
+    def avg_ms(self):
+        return self.total_time * 1000 / self.count if self.count else 0.0
+
+    @contextlib.contextmanager
+    def measure(self):
+        tic = time.perf_counter()
+        try:
+            yield
+        except Exception:
+            self.errors += 1
+            raise
+        finally:
+            toc = time.perf_counter() - tic
+            self.count += 1
+            self.total_time += toc
+            self.max_time = max(self.max_time, toc)
+
+
+class PortnumHandler():
+    """Parsing and side effects for one portnum. Subclass and register with PortnumHandlerRegistry.
+
+    For each received packet, process() calls:
+        prepare(mesh_client, packet): state that has to be updated before the packet is parsed
+        parse(decoded): returns the port specific RXPacket columns and side table dicts (by relationship name)
+        needs_rx_packet(record): whether handle() needs an RXPacket, instead of the PacketRecord
+        handle(mesh_client, packet, db_packet, trace): side effects, after the packet is queued to be saved.
+            trace is the packet's tracing.Trace (or None), to pass on with anything queued for discord
+
+    The packet is parsed into a PacketRecord, which is what gets queued to be saved, unless needs_rx_packet()
+    says an RXPacket has to be built for it.
+    """
+
+    portnum = None
+
+    def __init__(self):
+        self.stats = HandlerStats()
+
+    def __repr__(self):
+        return f'<{self.__class__.__name__} {self.portnum}>'
+
+    def process(self, mesh_client, packet, trace=None):
+        """Parses the packet, queues it to be saved and runs the side effects. Returns the PacketRecord or RXPacket."""
+        with self.stats.measure():
+            self.prepare(mesh_client, packet)
+            tic = time.perf_counter()
+            db_packet = self.build_record(mesh_client, packet)
+            metrics.packet_parse_seconds.labels(portnum=self.portnum).observe(time.perf_counter() - tic)
+            if self.needs_rx_packet(db_packet):
+                db_packet = db_packet.to_rx_packet()
+            if trace is not None:
+                trace.mark('parsed')
+            mesh_client.save_rx_packet(db_packet, trace)
+            self.handle(mesh_client, packet, db_packet, trace)
+        return db_packet
+
+    def build_record(self, mesh_client, packet):
+        record = mesh_client.packet_record(packet)
+        record.port_fields = self.parse(packet.get('decoded', {}))
+        return record
+
+    def build_packet(self, mesh_client, packet):
+        return self.build_record(mesh_client, packet).to_rx_packet()
+
+    def prepare(self, mesh_client, packet):
+        pass
+
+    def parse(self, decoded):
+        return {}
+
+    def needs_rx_packet(self, record):
+        return False
+
+    def handle(self, mesh_client, packet, db_packet, trace=None):
+        pass
+
+
+class TextMessageHandler(PortnumHandler):
+    """Text messages: both channel and DMs. Forwarded to discord."""
+
+    portnum = 'TEXT_MESSAGE_APP'
+
+    def parse(self, decoded):
+        return {
+            'text': decoded.get('text'),
+            'bitfield': decoded.get('bitfield'),
+            'emoji': decoded.get('emoji'),
+            'reply_id': decoded.get('replyId'),
+        }
+
+    def needs_rx_packet(self, record):
+        # the discord embed uses the RXPacket display properties
+        return True
+
+    def handle(self, mesh_client, packet, db_packet, trace=None):
+        mesh_client.discord_client.enqueue_mesh_text_msg_received(db_packet, trace)
+
+
+class NodeInfoHandler(PortnumHandler):
+    """Node info: updates the node directory, and queues the MeshNodeDB update."""
+
+    portnum = 'NODEINFO_APP'
+
+    def prepare(self, mesh_client, packet):
+        # index the new names before anything looks them up (including this packet's src names)
+        mesh_client.node_directory.update_user(packet.get('from'), packet['decoded'].get('user'))
+
+    def parse(self, decoded):
+        return {
+            'nodeinfo': decoded.get('user', {}),
+        }
+
+    def handle(self, mesh_client, packet, db_packet, trace=None):
+        # the MeshNodeDB upsert is done by the RX writer thread
+        mesh_client.save_node_info(packet)
+
+
+class RoutingHandler(PortnumHandler):
+    """Routing packets, matched against sent packets when they are ACKs.
+
+    NOTE: There are 2 types of ACK - implicit and explicit
+    Implicit means that your node heard a relay of your message, so you know it was received by at least 1 node
+    Explicit means that the destination node sent an ACK back to you (this only works for DMs, not channel messages)
+    """
+
+    portnum = 'ROUTING_APP'
+
+    def parse(self, decoded):
+        return {
+            'routing': {
+                'requestId': decoded.get('requestId'),
+                'errorReason': decoded.get('routing', {}).get('errorReason'),
+            },
+        }
+
+    def needs_rx_packet(self, record):
+        # ACKs are matched against sent packets, and the ACK row links to the RXPacket
+        return record.priority == 'ACK' and bool(record.port_fields['routing']['requestId'])
+
+    def handle(self, mesh_client, packet, db_packet, trace=None):
+        if db_packet.priority == 'ACK' and packet.get('decoded', {}).get('requestId'):
+            logging.info(f'Got ACK from {db_packet.src_descriptive}. Request ID: {db_packet.request_id}')
+            mesh_client.process_ack(db_packet)
+
+
+class TracerouteHandler(PortnumHandler):
+    """Traceroute packets. Only saved for now."""
+
+    portnum = 'TRACEROUTE_APP'
+
+    def parse(self, decoded):
+        return {
+            'traceroute': decoded.get('traceroute', {}),
+        }
+
+
+class TelemetryHandler(PortnumHandler):
+    """Telemetry packets. Only saved for now."""
+
+    portnum = 'TELEMETRY_APP'
+
+    # (RXPacket relationship, key in the telemetry dict)
+    metrics = (
+        ('device_metrics', 'deviceMetrics'),
+        ('environment_metrics', 'environmentMetrics'),
+        ('power_metrics', 'powerMetrics'),
+        ('air_quality_metrics', 'airQualityMetrics'),
+    )
+
+    def parse(self, decoded):
+        telemetry_data = decoded.get('telemetry', {})
+
+        # a telemetry packet carries one kind of metrics, only that side table gets a row
+        fields = {}
+        for relationship_name, key in self.metrics:
+            metrics = telemetry_data.get(key)
+            if metrics:
+                fields[relationship_name] = metrics
+        return fields
+
+
+class PositionHandler(PortnumHandler):
+    """Position packets. Only saved for now."""
+
+    portnum = 'POSITION_APP'
+
+    def parse(self, decoded):
+        return {
+            'position': decoded.get('position', {}),
+        }
+
+
+class PortnumHandlerRegistry():
+    """Maps portnum -> PortnumHandler for MeshClient.onReceiveMesh.
+
+    Packets without a handler (unknown ports, encrypted packets) only get their common columns parsed into a
+    PacketRecord for the writer. Their stats are kept in `unhandled`.
+    """
+
+    def __init__(self, handlers=()):
+        self._handlers = {}
+        self.unhandled = HandlerStats()
+        for handler in handlers:
+            self.register(handler)
+
+    def __repr__(self):
+        return f'<{self.__class__.__name__} {list(self._handlers)}>'
+
+    def register(self, handler):
+        """Registers (or replaces) the handler for handler.portnum."""
+        self._handlers[handler.portnum] = handler
+
+    def get(self, portnum):
+        return self._handlers.get(portnum)
+
+    def process(self, mesh_client, packet, trace=None):
+        """Runs the handler for the packet's portnum. Returns the PacketRecord/RXPacket, or None if there was no handler."""
+        portnum = packet.get('decoded', {}).get('portnum')
+        metrics.packets_received.labels(portnum=portnum or ('ENCRYPTED' if packet.get('encrypted') else 'UNKNOWN')).inc()
+        handler = self._handlers.get(portnum)
+        if handler is not None:
+            return handler.process(mesh_client, packet, trace)
+
+        with self.unhandled.measure():
+            tic = time.perf_counter()
+            record = mesh_client.packet_record(packet)
+            metrics.packet_parse_seconds.labels(portnum='unhandled').observe(time.perf_counter() - tic)
+            if trace is not None:
+                trace.mark('parsed')
+            mesh_client.save_rx_packet(record, trace)
+        return None
+
+    def build_record(self, mesh_client, packet):
+        """Parses the packet into a PacketRecord like process() does, without saving it or running any side
+        effects (not even prepare). Used to replay archived packets."""
+        handler = self._handlers.get(packet.get('decoded', {}).get('portnum'))
+        if handler is not None:
+            return handler.build_record(mesh_client, packet)
+        return mesh_client.packet_record(packet)
+
+    def stats(self):
+        """Returns {portnum: HandlerStats}, with the fast path under 'unhandled'."""
+        out = {portnum: handler.stats for portnum, handler in self._handlers.items()}
+        out['unhandled'] = self.unhandled
+        return out
+
+    @staticmethod
+    def default():
+        return PortnumHandlerRegistry([
+            TextMessageHandler(),
+            NodeInfoHandler(),
+            RoutingHandler(),
+            TracerouteHandler(),
+            TelemetryHandler(),
+            PositionHandler(),
+        ])
@@ -0,0 +1,80 @@
+import asyncio
+import concurrent.futures
+import functools
+import logging
+import time
+
+from db_base import session_scope
+
+
+class QueryTimeout(Exception):
+    """A query didn't finish within QueryService.timeout."""
+
+
+class QueryStats():
+    """Counters for QueryService, shown in /debug."""
+
+    def __init__(self):
+        self.count = 0
+        self.errors = 0
+        self.timeouts = 0
+        self.total_time = 0.0
+        self.max_time = 0.0
+
+    def __repr__(self):
+        return f'<{self.__class__.__name__} count={self.count} errors={self.errors} timeouts={self.timeouts} avg={self.avg_ms:.1f}ms>'
+
+    @property
+    def avg_ms(self):
+        return self.total_time * 1000 / self.count if self.count else 0.0
+
+
+class QueryService():
+    '''Runs blocking DB reads for slash commands on a thread pool, so they don't block the discord event loop.
+
+    Each query runs inside its own session_scope on the worker thread, so session_scope() calls made by the
+    query (e.g. MeshClient.get_nodes_from_db) use that worker's session, not one shared with the mesh thread.
+
+    A query that takes longer than timeout raises QueryTimeout in the command. The worker thread can't be
+    interrupted, so it still finishes the query in the background.
+    '''
+
+    def __init__(self, workers=4, timeout=20):
+        self.workers = workers
+        self.timeout = timeout
+        self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=workers, thread_name_prefix='db-query')
+        self.stats = QueryStats()
+
+    def __repr__(self):
+        return f'<{self.__class__.__name__} workers={self.workers} timeout={self.timeout}s {self.stats}>'
+
+    def _run(self, fn, args, kwargs):
+        tic = time.perf_counter()
+        try:
+            with session_scope():
+                return fn(*args, **kwargs)
+        except Exception:
+            self.stats.errors += 1
+            raise
+        finally:
+            toc = time.perf_counter() - tic
+            self.stats.count += 1
+            self.stats.total_time += toc
+            self.stats.max_time = max(self.stats.max_time, toc)
+
+    async def run(self, fn, *args, timeout=None, **kwargs):
+        """Calls fn(*args, **kwargs) on a worker thread and returns the result.
+        Raises QueryTimeout if it takes longer than timeout (default: self.timeout) seconds."""
+        timeout = timeout or self.timeout
+        loop = asyncio.get_running_loop()
+        future = loop.run_in_executor(self._executor, functools.partial(self._run, fn, args, kwargs))
+        try:
+            return await asyncio.wait_for(future, timeout)
+        except asyncio.TimeoutError:
+            self.stats.timeouts += 1
+            name = getattr(fn, '__qualname__', repr(fn))
+            logging.error(f'Query {name} timed out after {timeout}s')
+            raise QueryTimeout(f'{name} took longer than {timeout}s')
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,74 @@
+import itertools
+import logging
+import threading
+import time
+
+import metrics
+
+
+_trace_ids = itertools.count(1)
+
+
+class Trace():
+    '''Stage timestamps of one received packet (path 'rx', from onReceiveMesh to the discord post and the DB
+    commit) or one message sent from discord (path 'tx', from the slash command to sendText and the ACK).
+
+    The trace is handed along with the packet/message: every queue or thread that takes it hold()s it and
+    release()s it when it's done with it, marking the stage it reached. When the last holder releases it,
+    the stage times go to metrics.trace_stage_seconds / trace_seconds, and the whole trace is logged if it
+    took longer than slow_seconds[path]. mark() and hold() are safe to call from any thread.
+    '''
+
+    # traces longer than this (seconds) are logged, by path. Set from the config (tracing_info) at startup
+    slow_seconds = {'rx': 5.0, 'tx': 60.0}
+
+    def __init__(self, path, description):
+        self.trace_id = next(_trace_ids)
+        self.path = path
+        self.description = description
+        self.started = time.monotonic()
+        self.stages = []  # (stage, seconds since started)
+        self.finished = None
+        self._holders = 1  # the creator, who releases it like everyone else
+        self._lock = threading.Lock()
+
+    def __repr__(self):
+        return f'<{self.__class__.__name__} {self.path}#{self.trace_id} {self.description} stages={len(self.stages)}>'
+
+    def __str__(self):
+        total = self.finished if self.finished is not None else time.monotonic() - self.started
+        stages = ', '.join(f'{stage} {_format_seconds(t)}' for stage, t in sorted(self.stages, key=lambda s: s[1]))
+        return f'{self.path}#{self.trace_id} {self.description}: {_format_seconds(total)} ({stages})'
+
+    def mark(self, stage):
+        """Records that the packet/message reached stage now."""
+        self.stages.append((stage, time.monotonic() - self.started))
+
+    def hold(self):
+        """Keeps the trace open until the matching release(). Returns the trace."""
+        with self._lock:
+            self._holders += 1
+        return self
+
+    def release(self, stage=None):
+        """Marks stage (if given) and gives up a hold. The last release finishes the trace."""
+        if stage is not None:
+            self.mark(stage)
+        with self._lock:
+            self._holders -= 1
+            if self._holders:
+                return
+        self._finish()
+
+    def _finish(self):
+        self.finished = time.monotonic() - self.started
+        for stage, t in self.stages:
+            metrics.trace_stage_seconds.labels(path=self.path, stage=stage).observe(t)
+        metrics.trace_seconds.labels(path=self.path).observe(self.finished)
+        threshold = self.slow_seconds.get(self.path)
+        if threshold and self.finished > threshold:
+            logging.warning(f'Slow trace {self}')
+
+
+def _format_seconds(seconds):
+    return f'{seconds*1000:.1f}ms' if seconds < 1 else f'{seconds:.2f}s'
@@ -0,0 +1,247 @@
+import collections
+import logging
+import math
+import threading
+import time
+
+
+class TXPriority():
+    """Priority classes for outbound mesh traffic, lower value is sent first."""
+    ADMIN = 0
+    DM = 1
+    CHANNEL = 2
+    TELEMETRY = 3
+
+    names = {
+        ADMIN: 'admin',
+        DM: 'dm',
+        CHANNEL: 'channel',
+        TELEMETRY: 'telemetry',
+    }
+
+
+# (name, bandwidth kHz, spreading factor, coding rate 4/x) for each Config.LoRaConfig.ModemPreset value
+MODEM_PRESETS = {
+    0: ('LONG_FAST', 250, 11, 5),
+    1: ('LONG_SLOW', 125, 12, 8),
+    2: ('VERY_LONG_SLOW', 62.5, 12, 8),
+    3: ('MEDIUM_SLOW', 250, 10, 5),
+    4: ('MEDIUM_FAST', 250, 9, 5),
+    5: ('SHORT_SLOW', 250, 8, 5),
+    6: ('SHORT_FAST', 250, 7, 5),
+    7: ('LONG_MODERATE', 125, 11, 8),
+    8: ('SHORT_TURBO', 500, 7, 5),
+}
+
+
+def lora_airtime(payload_bytes, bandwidth_khz, spreading_factor, coding_rate, preamble_len=16):
+    """Time on air in seconds of one LoRa packet (explicit header, CRC on). See Semtech AN1200.13."""
+    t_sym = (2 ** spreading_factor) / (bandwidth_khz * 1000)
+    low_data_rate_optimize = 1 if t_sym > 0.016 else 0
+    payload_symbols = 8 + max(
+        math.ceil((8 * payload_bytes - 4 * spreading_factor + 28 + 16) / (4 * (spreading_factor - 2 * low_data_rate_optimize))) * coding_rate,
+        0
+    )
+    return (preamble_len + 4.25 + payload_symbols) * t_sym
+
+
+class TokenBucket():
+    """Airtime budget. Refills at `rate` seconds of airtime per second, up to `capacity` seconds."""
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self._last = time.monotonic()
+
+    def __repr__(self):
+        return f'<{self.__class__.__name__} {self.tokens:.2f}/{self.capacity}s rate={self.rate}>'
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self._last) * self.rate)
+        self._last = now
+
+    def time_until(self, cost):
+        """Seconds until `cost` tokens are available (0 if they are now)."""
+        self._refill()
+        # a packet bigger than the whole bucket only has to wait for a full bucket
+        cost = min(cost, self.capacity)
+        if self.tokens >= cost:
+            return 0
+        return (cost - self.tokens) / self.rate
+
+    def consume(self, cost):
+        self._refill()
+        self.tokens -= min(cost, self.capacity)
+
+
+class TXRequest():
+    """One queued outbound message (the same dicts MeshClient used to put on _meshqueue/_adminqueue)."""
+
+    def __init__(self, msg, priority, fair_key=None, airtime=0.0):
+        self.msg = msg
+        self.priority = priority
+        self.fair_key = fair_key
+        self.airtime = airtime
+        self.submitted_at = time.monotonic()
+
+    def __repr__(self):
+        return f'<{self.__class__.__name__} {TXPriority.names.get(self.priority)} {self.fair_key} airtime={self.airtime*1000:.0f}ms>'
+
+
+class TXStats():
+    """Counters and wait times (submit -> send) for one priority class."""
+
+    def __init__(self):
+        self.submitted = 0
+        self.rejected = 0
+        self.sent = 0
+        self.errors = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+    def __repr__(self):
+        return f'<{self.__class__.__name__} sent={self.sent} rejected={self.rejected} errors={self.errors} avg_wait={self.avg_wait:.1f}s>'
+
+    @property
+    def avg_wait(self):
+        return self.total_wait / self.sent if self.sent else 0.0
+
+
+class TXScheduler():
+    '''Paces outbound mesh traffic to the radio's airtime budget.
+
+    Requests are queued by priority class (admin, DMs, channel text, telemetry). Within a class, the
+    queues for each fair_key (e.g. channel index or DM destination) are served round robin, so one busy
+    channel can't starve the others. A worker thread sends the next request once the token bucket has
+    enough airtime for it. The bucket refills at duty_cycle seconds of airtime per second and holds up to
+    burst_airtime seconds, so short bursts go out immediately.
+
+    submit() never blocks: if max_queue requests are already waiting, the request is rejected.
+    '''
+
+    # over-the-air bytes added to every packet (meshtastic header + Data protobuf framing)
+    packet_overhead = 22
+
+    def __init__(self, send_fn, ready_fn=None, duty_cycle=0.1, burst_airtime=10.0, max_queue=50, modem_preset=0):
+        self._send_fn = send_fn
+        self._ready_fn = ready_fn or (lambda: True)
+        self.max_queue = max_queue
+
+        self._bucket = TokenBucket(rate=duty_cycle, capacity=burst_airtime)
+        self.set_modem_preset(modem_preset)
+
+        self._cond = threading.Condition()
+        self._queues = {priority: collections.OrderedDict() for priority in TXPriority.names}
+        self._depth = 0
+        self._stats = {priority: TXStats() for priority in TXPriority.names}
+        self._thread = None
+        self._stopping = False
+
+    def __repr__(self):
+        return f'<{self.__class__.__name__} {self.modem_preset_name} depth={self.queue_depth} {self._bucket}>'
+
+    @property
+    def queue_depth(self):
+        return self._depth
+
+    def depth_by_priority(self):
+        with self._cond:
+            return {TXPriority.names[priority]: sum(len(q) for q in queues.values()) for priority, queues in self._queues.items()}
+
+    def stats(self):
+        """Returns {priority name: TXStats}."""
+        return {TXPriority.names[priority]: stats for priority, stats in self._stats.items()}
+
+    def set_modem_preset(self, modem_preset):
+        """Sets the LoRa parameters used to estimate airtime. Called once the radio's config is known."""
+        self.modem_preset_name, self._bandwidth, self._spreading_factor, self._coding_rate = MODEM_PRESETS.get(modem_preset, MODEM_PRESETS[0])
+
+    def estimate_airtime(self, payload_bytes):
+        return lora_airtime(payload_bytes + self.packet_overhead, self._bandwidth, self._spreading_factor, self._coding_rate)
+
+    def submit(self, msg, priority, fair_key=None, payload_bytes=0):
+        """Queues a message to be sent. Returns False (without blocking) if the queue is full."""
+        request = TXRequest(msg, priority, fair_key=fair_key, airtime=self.estimate_airtime(payload_bytes))
+        stats = self._stats[priority]
+        with self._cond:
+            if self._depth >= self.max_queue:
+                stats.rejected += 1
+                logging.warning(f'TXScheduler: queue full ({self._depth}), rejected {request}')
+                return False
+            self._queues[priority].setdefault(fair_key, collections.deque()).append(request)
+            self._depth += 1
+            stats.submitted += 1
+            self._cond.notify()
+        return True
+
+    def start(self):
+        if self._thread is None:
+            self._stopping = False
+            self._thread = threading.Thread(target=self._run, name='tx-scheduler', daemon=True)
+            self._thread.start()
+
+    def stop(self, timeout=5):
+        if self._thread is not None:
+            with self._cond:
+                self._stopping = True
+                self._cond.notify()
+            self._thread.join(timeout=timeout)
+            self._thread = None
+
+    def _peek(self):
+        # highest priority class first, then the fair_key at the head of that class's round robin
+        for priority, queues in self._queues.items():
+            if queues:
+                return priority, next(iter(queues))
+        return None, None
+
+    def _pop(self, priority, fair_key):
+        queues = self._queues[priority]
+        pending = queues[fair_key]
+        request = pending.popleft()
+        del queues[fair_key]
+        if pending:
+            # back of the line for this key
+            queues[fair_key] = pending
+        self._depth -= 1
+        return request
+
+    def _next_request(self):
+        """Blocks until a request can be sent (or stop() is called, then returns None)."""
+        with self._cond:
+            while not self._stopping:
+                priority, fair_key = self._peek()
+                if priority is None:
+                    self._cond.wait()
+                    continue
+                if not self._ready_fn():
+                    self._cond.wait(timeout=0.5)
+                    continue
+                request = self._queues[priority][fair_key][0]
+                wait = self._bucket.time_until(request.airtime)
+                if wait > 0:
+                    # re-checked on wake up, a higher priority request may have arrived meanwhile
+                    self._cond.wait(timeout=wait)
+                    continue
+                self._bucket.consume(request.airtime)
+                return self._pop(priority, fair_key)
+        return None
+
+    def _run(self):
+        while True:
+            request = self._next_request()
+            if request is None:
+                break
+            stats = self._stats[request.priority]
+            wait = time.monotonic() - request.submitted_at
+            stats.total_wait += wait
+            stats.max_wait = max(stats.max_wait, wait)
+            try:
+                self._send_fn(request)
+                stats.sent += 1
+            except Exception as e:
+                stats.errors += 1
+                logging.exception(f'TXScheduler: error sending {request}', exc_info=e)
+        logging.info('TXScheduler finished.')
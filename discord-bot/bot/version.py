@@ -1 +1 @@
-__version__ = "0.1.10"
\ No newline at end of file
+__version__ = "0.1.35"
\ No newline at end of file
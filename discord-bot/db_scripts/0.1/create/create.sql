@@ -25,14 +25,15 @@ CREATE TABLE tx_packets (
 
 CREATE TABLE rx_packets (
 	id INTEGER NOT NULL, 
+	pkt_id BIGINT, 
 	publisher_mesh_node_num VARCHAR, 
 	publisher_discord_bot_user_id VARCHAR, 
 	channel INTEGER, 
-	src_num INTEGER, 
+	src_num BIGINT, 
 	src_id VARCHAR, 
 	src_short_name VARCHAR, 
 	src_long_name VARCHAR, 
-	dst_num INTEGER, 
+	dst_num BIGINT, 
 	dst_id VARCHAR, 
 	dst_short_name VARCHAR, 
 	dst_long_name VARCHAR, 
@@ -41,7 +42,7 @@ CREATE TABLE rx_packets (
 	pki_encrypted BOOLEAN, 
 	portnum VARCHAR, 
 	priority VARCHAR, 
-	rx_time INTEGER, 
+	rx_time BIGINT, 
 	rx_rssi DOUBLE, 
 	rx_snr DOUBLE, 
 	to_all BOOLEAN, 
@@ -49,38 +50,8 @@ CREATE TABLE rx_packets (
 	text VARCHAR, 
 	bitfield INTEGER, 
 	emoji INTEGER, 
-	reply_id INTEGER, 
-	telemetry_air_quality_metrics JSON, 
-	telemetry_device_metrics JSON, 
-	telemetry_environment_metrics JSON, 
-	telemetry_power_metrics JSON, 
-	has_air_quality_metrics BOOLEAN, 
-	has_device_metrics BOOLEAN, 
-	has_environment_metrics BOOLEAN, 
-	has_power_metrics BOOLEAN, 
-	has_position_data BOOLEAN, 
-	altitude DOUBLE, 
-	latitude DOUBLE, 
-	"latitudeI" INTEGER, 
-	longitude DOUBLE, 
-	"longitudeI" INTEGER, 
-	pos_time INTEGER, 
-	location_source VARCHAR, 
-	pdop DOUBLE, 
-	ground_speed DOUBLE, 
-	ground_track DOUBLE, 
-	sats_in_view INTEGER, 
-	precision_bits INTEGER, 
-	node_id VARCHAR, 
-	node_short_name VARCHAR, 
-	node_long_name VARCHAR, 
-	mac_address VARCHAR, 
-	hw_model VARCHAR, 
-	public_key VARCHAR, 
-	request_id VARCHAR, 
-	error_reason VARCHAR, 
-	traceroute_data JSON, 
-	ts DATETIME, pkt_id INTEGER, 
+	reply_id BIGINT, 
+	ts DATETIME, 
 	PRIMARY KEY (id)
 )
 
@@ -116,11 +87,275 @@ CREATE TABLE acks (
 	ack_packet_id INTEGER, 
 	implicit_ack BOOLEAN, 
 	PRIMARY KEY (id), 
-	FOREIGN KEY(tx_packet_id) REFERENCES tx_packets (id), 
-	FOREIGN KEY(ack_packet_id) REFERENCES rx_packets (id)
+	FOREIGN KEY(tx_packet_id) REFERENCES tx_packets (id)
+)
+
+CREATE INDEX ix_tx_packets_publisher_packet_id ON tx_packets (publisher_mesh_node_num, packet_id)
+
+CREATE INDEX ix_rx_packets_publisher_src_num_portnum_ts ON rx_packets (publisher_mesh_node_num, src_num, portnum, ts)
+
+CREATE INDEX ix_rx_packets_publisher_src_id_ts ON rx_packets (publisher_mesh_node_num, src_id, ts)
+
+CREATE INDEX ix_rx_packets_publisher_ts ON rx_packets (publisher_mesh_node_num, ts)
+
+CREATE INDEX ix_nodes_publisher_node_num ON nodes (publisher_mesh_node_num, node_num)
+
+CREATE INDEX ix_acks_tx_packet_id ON acks (tx_packet_id)
+
+CREATE TABLE node_activity (
+	id INTEGER NOT NULL, 
+	publisher_mesh_node_num VARCHAR, 
+	src_num BIGINT, 
+	src_id VARCHAR, 
+	src_short_name VARCHAR, 
+	src_long_name VARCHAR, 
+	last_portnum VARCHAR, 
+	last_ts DATETIME, 
+	pkt_count BIGINT, 
+	PRIMARY KEY (id), 
+	CONSTRAINT uq_node_activity_publisher_src_num UNIQUE (publisher_mesh_node_num, src_num)
+)
+
+CREATE INDEX ix_node_activity_publisher_last_ts ON node_activity (publisher_mesh_node_num, last_ts)
+
+CREATE TABLE node_activity_hourly (
+	id INTEGER NOT NULL, 
+	publisher_mesh_node_num VARCHAR, 
+	src_num BIGINT, 
+	hour_ts DATETIME, 
+	pkt_count BIGINT, 
+	PRIMARY KEY (id), 
+	CONSTRAINT uq_node_activity_hourly_publisher_src_num_hour UNIQUE (publisher_mesh_node_num, src_num, hour_ts)
 )
 
+CREATE INDEX ix_node_activity_hourly_publisher_hour_ts ON node_activity_hourly (publisher_mesh_node_num, hour_ts)
 
 
 
+CREATE TABLE rollup_state (
+	name VARCHAR NOT NULL, 
+	last_id BIGINT, 
+	upd_ts DATETIME, 
+	PRIMARY KEY (name)
+)
+
+CREATE TABLE telemetry_hourly (
+	id INTEGER NOT NULL, 
+	publisher_mesh_node_num VARCHAR, 
+	src_num BIGINT, 
+	bucket_ts DATETIME, 
+	pkt_count BIGINT, 
+	battery_level_min DOUBLE, 
+	battery_level_max DOUBLE, 
+	battery_level_sum DOUBLE, 
+	battery_level_count INTEGER, 
+	voltage_min DOUBLE, 
+	voltage_max DOUBLE, 
+	voltage_sum DOUBLE, 
+	voltage_count INTEGER, 
+	channel_utilization_min DOUBLE, 
+	channel_utilization_max DOUBLE, 
+	channel_utilization_sum DOUBLE, 
+	channel_utilization_count INTEGER, 
+	air_util_tx_min DOUBLE, 
+	air_util_tx_max DOUBLE, 
+	air_util_tx_sum DOUBLE, 
+	air_util_tx_count INTEGER, 
+	temperature_min DOUBLE, 
+	temperature_max DOUBLE, 
+	temperature_sum DOUBLE, 
+	temperature_count INTEGER, 
+	relative_humidity_min DOUBLE, 
+	relative_humidity_max DOUBLE, 
+	relative_humidity_sum DOUBLE, 
+	relative_humidity_count INTEGER, 
+	barometric_pressure_min DOUBLE, 
+	barometric_pressure_max DOUBLE, 
+	barometric_pressure_sum DOUBLE, 
+	barometric_pressure_count INTEGER, 
+	PRIMARY KEY (id), 
+	CONSTRAINT uq_telemetry_hourly_publisher_src_num_bucket UNIQUE (publisher_mesh_node_num, src_num, bucket_ts)
+)
+
+CREATE TABLE telemetry_daily (
+	id INTEGER NOT NULL, 
+	publisher_mesh_node_num VARCHAR, 
+	src_num BIGINT, 
+	bucket_ts DATETIME, 
+	pkt_count BIGINT, 
+	battery_level_min DOUBLE, 
+	battery_level_max DOUBLE, 
+	battery_level_sum DOUBLE, 
+	battery_level_count INTEGER, 
+	voltage_min DOUBLE, 
+	voltage_max DOUBLE, 
+	voltage_sum DOUBLE, 
+	voltage_count INTEGER, 
+	channel_utilization_min DOUBLE, 
+	channel_utilization_max DOUBLE, 
+	channel_utilization_sum DOUBLE, 
+	channel_utilization_count INTEGER, 
+	air_util_tx_min DOUBLE, 
+	air_util_tx_max DOUBLE, 
+	air_util_tx_sum DOUBLE, 
+	air_util_tx_count INTEGER, 
+	temperature_min DOUBLE, 
+	temperature_max DOUBLE, 
+	temperature_sum DOUBLE, 
+	temperature_count INTEGER, 
+	relative_humidity_min DOUBLE, 
+	relative_humidity_max DOUBLE, 
+	relative_humidity_sum DOUBLE, 
+	relative_humidity_count INTEGER, 
+	barometric_pressure_min DOUBLE, 
+	barometric_pressure_max DOUBLE, 
+	barometric_pressure_sum DOUBLE, 
+	barometric_pressure_count INTEGER, 
+	PRIMARY KEY (id), 
+	CONSTRAINT uq_telemetry_daily_publisher_src_num_bucket UNIQUE (publisher_mesh_node_num, src_num, bucket_ts)
+)
+
+
+CREATE TABLE rx_positions (
+	latitude DOUBLE, 
+	longitude DOUBLE, 
+	latitude_i INTEGER, 
+	longitude_i INTEGER, 
+	altitude DOUBLE, 
+	pos_time BIGINT, 
+	location_source VARCHAR, 
+	pdop DOUBLE, 
+	ground_speed DOUBLE, 
+	ground_track DOUBLE, 
+	sats_in_view INTEGER, 
+	precision_bits INTEGER, 
+	packet_id BIGINT NOT NULL, 
+	PRIMARY KEY (packet_id)
+)
+
+
+
+CREATE TABLE rx_device_metrics (
+	battery_level DOUBLE, 
+	voltage DOUBLE, 
+	channel_utilization DOUBLE, 
+	air_util_tx DOUBLE, 
+	uptime_seconds BIGINT, 
+	extra JSON, 
+	packet_id BIGINT NOT NULL, 
+	PRIMARY KEY (packet_id)
+)
+
+
+
+CREATE TABLE rx_environment_metrics (
+	temperature DOUBLE, 
+	relative_humidity DOUBLE, 
+	barometric_pressure DOUBLE, 
+	gas_resistance DOUBLE, 
+	voltage DOUBLE, 
+	current DOUBLE, 
+	iaq INTEGER, 
+	distance DOUBLE, 
+	lux DOUBLE, 
+	white_lux DOUBLE, 
+	ir_lux DOUBLE, 
+	uv_lux DOUBLE, 
+	wind_direction INTEGER, 
+	wind_speed DOUBLE, 
+	wind_gust DOUBLE, 
+	wind_lull DOUBLE, 
+	weight DOUBLE, 
+	radiation DOUBLE, 
+	rainfall_1h DOUBLE, 
+	rainfall_24h DOUBLE, 
+	soil_moisture INTEGER, 
+	soil_temperature DOUBLE, 
+	extra JSON, 
+	packet_id BIGINT NOT NULL, 
+	PRIMARY KEY (packet_id)
+)
+
+
+
+CREATE TABLE rx_power_metrics (
+	ch1_voltage DOUBLE, 
+	ch1_current DOUBLE, 
+	ch2_voltage DOUBLE, 
+	ch2_current DOUBLE, 
+	ch3_voltage DOUBLE, 
+	ch3_current DOUBLE, 
+	ch4_voltage DOUBLE, 
+	ch4_current DOUBLE, 
+	ch5_voltage DOUBLE, 
+	ch5_current DOUBLE, 
+	ch6_voltage DOUBLE, 
+	ch6_current DOUBLE, 
+	ch7_voltage DOUBLE, 
+	ch7_current DOUBLE, 
+	ch8_voltage DOUBLE, 
+	ch8_current DOUBLE, 
+	extra JSON, 
+	packet_id BIGINT NOT NULL, 
+	PRIMARY KEY (packet_id)
+)
+
+
+
+CREATE TABLE rx_air_quality_metrics (
+	pm10_standard INTEGER, 
+	pm25_standard INTEGER, 
+	pm40_standard INTEGER, 
+	pm100_standard INTEGER, 
+	pm10_environmental INTEGER, 
+	pm25_environmental INTEGER, 
+	pm100_environmental INTEGER, 
+	particles_03um INTEGER, 
+	particles_05um INTEGER, 
+	particles_10um INTEGER, 
+	particles_25um INTEGER, 
+	particles_40um INTEGER, 
+	particles_50um INTEGER, 
+	particles_100um INTEGER, 
+	co2 INTEGER, 
+	co2_temperature DOUBLE, 
+	co2_humidity DOUBLE, 
+	extra JSON, 
+	packet_id BIGINT NOT NULL, 
+	PRIMARY KEY (packet_id)
+)
+
+
+
+CREATE TABLE rx_nodeinfo (
+	node_id VARCHAR, 
+	short_name VARCHAR, 
+	long_name VARCHAR, 
+	mac_address VARCHAR, 
+	hw_model VARCHAR, 
+	role VARCHAR, 
+	public_key VARCHAR, 
+	packet_id BIGINT NOT NULL, 
+	PRIMARY KEY (packet_id)
+)
+
+
+
+CREATE TABLE rx_routing (
+	request_id BIGINT, 
+	error_reason VARCHAR, 
+	packet_id BIGINT NOT NULL, 
+	PRIMARY KEY (packet_id)
+)
+
+
+
+CREATE TABLE rx_traceroutes (
+	route JSON, 
+	snr_towards JSON, 
+	route_back JSON, 
+	snr_back JSON, 
+	packet_id BIGINT NOT NULL, 
+	PRIMARY KEY (packet_id)
+)
 
@@ -0,0 +1,27 @@
+-- This adds the indexes used by the hot rx_packets/tx_packets queries (Postgres)
+-- New databases get these from the models, this is only needed for databases created by 0.1.12 or older
+-- The indexes are built CONCURRENTLY so the bot can keep writing while this runs.
+-- CREATE INDEX CONCURRENTLY can't run inside a transaction, so run it with autocommit:
+--   psql -h <host> -U <user> -d <db_name> -f from_0.1.12_postgres.sql
+-- If a build is interrupted it leaves an INVALID index behind; drop it and run this again.
+
+-- per node, per portnum counts and "latest" lookups (/nodeinfo)
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_rx_packets_publisher_src_num_portnum_ts ON rx_packets (publisher_mesh_node_num, src_num, portnum, ts);
+
+-- latest packet and packet counts per src_id (/active, /all_nodes)
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_rx_packets_publisher_src_id_ts ON rx_packets (publisher_mesh_node_num, src_id, ts);
+
+-- time window filters
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_rx_packets_publisher_ts ON rx_packets (publisher_mesh_node_num, ts);
+
+-- matching ACKs/responses to the packet they acknowledge
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_tx_packets_publisher_packet_id ON tx_packets (publisher_mesh_node_num, packet_id);
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_acks_tx_packet_id ON acks (tx_packet_id);
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_nodes_publisher_node_num ON nodes (publisher_mesh_node_num, node_num);
+
+ANALYZE rx_packets;
+ANALYZE tx_packets;
+ANALYZE acks;
+ANALYZE nodes;
@@ -0,0 +1,58 @@
+-- Converts rx_packets to a table range partitioned by month on ts (Postgres only)
+-- Only needed to turn on database_info.partition_rx_packets for a database created by 0.1.25 or older.
+-- New databases are created partitioned by the bot when the option is on.
+-- Stop the bot first. This copies every packet, so it takes a while (and twice the disk space) on a big table:
+--   psql -h <host> -U <user> -d <db_name> -f from_0.1.25_postgres_partitioned.sql
+-- The old table is kept as rx_packets_unpartitioned, drop it once the bot runs fine (see the end of this file).
+
+BEGIN;
+
+-- partition bounds below are in UTC
+SET LOCAL TimeZone = 'UTC';
+
+-- the partitioned table's primary key is (id, ts), so acks can't have a foreign key to rx_packets.id anymore
+ALTER TABLE acks DROP CONSTRAINT IF EXISTS acks_ack_packet_id_fkey;
+
+ALTER TABLE rx_packets RENAME TO rx_packets_unpartitioned;
+ALTER TABLE rx_packets_unpartitioned RENAME CONSTRAINT rx_packets_pkey TO rx_packets_unpartitioned_pkey;
+ALTER INDEX IF EXISTS ix_rx_packets_publisher_src_num_portnum_ts RENAME TO ix_rx_packets_unpartitioned_publisher_src_num_portnum_ts;
+ALTER INDEX IF EXISTS ix_rx_packets_publisher_src_id_ts RENAME TO ix_rx_packets_unpartitioned_publisher_src_id_ts;
+ALTER INDEX IF EXISTS ix_rx_packets_publisher_ts RENAME TO ix_rx_packets_unpartitioned_publisher_ts;
+
+-- ts is part of the primary key now
+UPDATE rx_packets_unpartitioned SET ts = to_timestamp(0) WHERE ts IS NULL;
+
+-- keeps the id default (nextval('rx_packets_id_seq')), so ids continue where they left off
+CREATE TABLE rx_packets (LIKE rx_packets_unpartitioned INCLUDING DEFAULTS) PARTITION BY RANGE (ts);
+ALTER TABLE rx_packets ADD PRIMARY KEY (id, ts);
+CREATE INDEX ix_rx_packets_publisher_src_num_portnum_ts ON rx_packets (publisher_mesh_node_num, src_num, portnum, ts);
+CREATE INDEX ix_rx_packets_publisher_src_id_ts ON rx_packets (publisher_mesh_node_num, src_id, ts);
+CREATE INDEX ix_rx_packets_publisher_ts ON rx_packets (publisher_mesh_node_num, ts);
+
+CREATE TABLE rx_packets_default PARTITION OF rx_packets DEFAULT;
+
+-- one partition per month, from the oldest packet to 3 months from now (the bot creates later ones itself)
+DO $$
+DECLARE
+    month timestamptz := date_trunc('month', coalesce((SELECT min(ts) FROM rx_packets_unpartitioned WHERE ts > to_timestamp(0)), now()));
+BEGIN
+    WHILE month < date_trunc('month', now()) + interval '4 months' LOOP
+        EXECUTE format(
+            'CREATE TABLE %I PARTITION OF rx_packets FOR VALUES FROM (%L) TO (%L)',
+            'rx_packets_p' || to_char(month, 'YYYY_MM'), month, month + interval '1 month'
+        );
+        month := month + interval '1 month';
+    END LOOP;
+END
+$$;
+
+INSERT INTO rx_packets SELECT * FROM rx_packets_unpartitioned;
+
+ALTER SEQUENCE rx_packets_id_seq OWNED BY rx_packets.id;
+
+COMMIT;
+
+ANALYZE rx_packets;
+
+-- once the bot runs fine on the partitioned table:
+-- DROP TABLE rx_packets_unpartitioned;
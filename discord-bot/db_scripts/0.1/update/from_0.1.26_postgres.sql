@@ -0,0 +1,319 @@
+-- Moves the port specific rx_packets columns to the side tables (rx_positions, rx_device_metrics, ...) and drops them (Postgres)
+-- Only needed for databases created by 0.1.26 or older. Without it the bot still works, but /nodeinfo and the
+-- telemetry rollups only see packets received after the update.
+-- Stop the bot first. Everything runs in one transaction:
+--   psql -h <host> -U <user> -d <db_name> -f from_0.1.26_postgres.sql
+-- Dropped columns only free their space once rows are rewritten, run VACUUM FULL rx_packets afterwards to reclaim it now.
+
+BEGIN;
+
+-- the side tables (the bot also creates them at startup)
+CREATE TABLE IF NOT EXISTS rx_positions (
+	latitude DOUBLE PRECISION, 
+	longitude DOUBLE PRECISION, 
+	latitude_i INTEGER, 
+	longitude_i INTEGER, 
+	altitude DOUBLE PRECISION, 
+	pos_time BIGINT, 
+	location_source VARCHAR, 
+	pdop DOUBLE PRECISION, 
+	ground_speed DOUBLE PRECISION, 
+	ground_track DOUBLE PRECISION, 
+	sats_in_view INTEGER, 
+	precision_bits INTEGER, 
+	packet_id BIGINT NOT NULL, 
+	PRIMARY KEY (packet_id)
+);
+
+CREATE TABLE IF NOT EXISTS rx_device_metrics (
+	battery_level DOUBLE PRECISION, 
+	voltage DOUBLE PRECISION, 
+	channel_utilization DOUBLE PRECISION, 
+	air_util_tx DOUBLE PRECISION, 
+	uptime_seconds BIGINT, 
+	extra JSON, 
+	packet_id BIGINT NOT NULL, 
+	PRIMARY KEY (packet_id)
+);
+
+CREATE TABLE IF NOT EXISTS rx_environment_metrics (
+	temperature DOUBLE PRECISION, 
+	relative_humidity DOUBLE PRECISION, 
+	barometric_pressure DOUBLE PRECISION, 
+	gas_resistance DOUBLE PRECISION, 
+	voltage DOUBLE PRECISION, 
+	current DOUBLE PRECISION, 
+	iaq INTEGER, 
+	distance DOUBLE PRECISION, 
+	lux DOUBLE PRECISION, 
+	white_lux DOUBLE PRECISION, 
+	ir_lux DOUBLE PRECISION, 
+	uv_lux DOUBLE PRECISION, 
+	wind_direction INTEGER, 
+	wind_speed DOUBLE PRECISION, 
+	wind_gust DOUBLE PRECISION, 
+	wind_lull DOUBLE PRECISION, 
+	weight DOUBLE PRECISION, 
+	radiation DOUBLE PRECISION, 
+	rainfall_1h DOUBLE PRECISION, 
+	rainfall_24h DOUBLE PRECISION, 
+	soil_moisture INTEGER, 
+	soil_temperature DOUBLE PRECISION, 
+	extra JSON, 
+	packet_id BIGINT NOT NULL, 
+	PRIMARY KEY (packet_id)
+);
+
+CREATE TABLE IF NOT EXISTS rx_power_metrics (
+	ch1_voltage DOUBLE PRECISION, 
+	ch1_current DOUBLE PRECISION, 
+	ch2_voltage DOUBLE PRECISION, 
+	ch2_current DOUBLE PRECISION, 
+	ch3_voltage DOUBLE PRECISION, 
+	ch3_current DOUBLE PRECISION, 
+	ch4_voltage DOUBLE PRECISION, 
+	ch4_current DOUBLE PRECISION, 
+	ch5_voltage DOUBLE PRECISION, 
+	ch5_current DOUBLE PRECISION, 
+	ch6_voltage DOUBLE PRECISION, 
+	ch6_current DOUBLE PRECISION, 
+	ch7_voltage DOUBLE PRECISION, 
+	ch7_current DOUBLE PRECISION, 
+	ch8_voltage DOUBLE PRECISION, 
+	ch8_current DOUBLE PRECISION, 
+	extra JSON, 
+	packet_id BIGINT NOT NULL, 
+	PRIMARY KEY (packet_id)
+);
+
+CREATE TABLE IF NOT EXISTS rx_air_quality_metrics (
+	pm10_standard INTEGER, 
+	pm25_standard INTEGER, 
+	pm40_standard INTEGER, 
+	pm100_standard INTEGER, 
+	pm10_environmental INTEGER, 
+	pm25_environmental INTEGER, 
+	pm100_environmental INTEGER, 
+	particles_03um INTEGER, 
+	particles_05um INTEGER, 
+	particles_10um INTEGER, 
+	particles_25um INTEGER, 
+	particles_40um INTEGER, 
+	particles_50um INTEGER, 
+	particles_100um INTEGER, 
+	co2 INTEGER, 
+	co2_temperature DOUBLE PRECISION, 
+	co2_humidity DOUBLE PRECISION, 
+	extra JSON, 
+	packet_id BIGINT NOT NULL, 
+	PRIMARY KEY (packet_id)
+);
+
+CREATE TABLE IF NOT EXISTS rx_nodeinfo (
+	node_id VARCHAR, 
+	short_name VARCHAR, 
+	long_name VARCHAR, 
+	mac_address VARCHAR, 
+	hw_model VARCHAR, 
+	role VARCHAR, 
+	public_key VARCHAR, 
+	packet_id BIGINT NOT NULL, 
+	PRIMARY KEY (packet_id)
+);
+
+CREATE TABLE IF NOT EXISTS rx_routing (
+	request_id BIGINT, 
+	error_reason VARCHAR, 
+	packet_id BIGINT NOT NULL, 
+	PRIMARY KEY (packet_id)
+);
+
+CREATE TABLE IF NOT EXISTS rx_traceroutes (
+	route JSON, 
+	snr_towards JSON, 
+	route_back JSON, 
+	snr_back JSON, 
+	packet_id BIGINT NOT NULL, 
+	PRIMARY KEY (packet_id)
+);
+
+INSERT INTO rx_positions (packet_id, latitude, longitude, latitude_i, longitude_i, altitude, pos_time, location_source, pdop, ground_speed, ground_track, sats_in_view, precision_bits)
+SELECT
+    id,
+    latitude,
+    longitude,
+    "latitudeI",
+    "longitudeI",
+    altitude,
+    pos_time,
+    location_source,
+    pdop,
+    ground_speed,
+    ground_track,
+    sats_in_view,
+    precision_bits
+FROM rx_packets
+WHERE portnum = 'POSITION_APP';
+
+INSERT INTO rx_device_metrics (packet_id, battery_level, voltage, channel_utilization, air_util_tx, uptime_seconds, extra)
+SELECT
+    id,
+    (telemetry_device_metrics->>'batteryLevel')::double precision,
+    (telemetry_device_metrics->>'voltage')::double precision,
+    (telemetry_device_metrics->>'channelUtilization')::double precision,
+    (telemetry_device_metrics->>'airUtilTx')::double precision,
+    (telemetry_device_metrics->>'uptimeSeconds')::bigint,
+    NULLIF((telemetry_device_metrics::jsonb - ARRAY['batteryLevel', 'voltage', 'channelUtilization', 'airUtilTx', 'uptimeSeconds']), '{}'::jsonb)::json
+FROM rx_packets
+WHERE portnum = 'TELEMETRY_APP' AND telemetry_device_metrics::text NOT IN ('{}', 'null');
+
+INSERT INTO rx_environment_metrics (packet_id, temperature, relative_humidity, barometric_pressure, gas_resistance, voltage, current, iaq, distance, lux, white_lux, ir_lux, uv_lux, wind_direction, wind_speed, wind_gust, wind_lull, weight, radiation, rainfall_1h, rainfall_24h, soil_moisture, soil_temperature, extra)
+SELECT
+    id,
+    (telemetry_environment_metrics->>'temperature')::double precision,
+    (telemetry_environment_metrics->>'relativeHumidity')::double precision,
+    (telemetry_environment_metrics->>'barometricPressure')::double precision,
+    (telemetry_environment_metrics->>'gasResistance')::double precision,
+    (telemetry_environment_metrics->>'voltage')::double precision,
+    (telemetry_environment_metrics->>'current')::double precision,
+    (telemetry_environment_metrics->>'iaq')::integer,
+    (telemetry_environment_metrics->>'distance')::double precision,
+    (telemetry_environment_metrics->>'lux')::double precision,
+    (telemetry_environment_metrics->>'whiteLux')::double precision,
+    (telemetry_environment_metrics->>'irLux')::double precision,
+    (telemetry_environment_metrics->>'uvLux')::double precision,
+    (telemetry_environment_metrics->>'windDirection')::integer,
+    (telemetry_environment_metrics->>'windSpeed')::double precision,
+    (telemetry_environment_metrics->>'windGust')::double precision,
+    (telemetry_environment_metrics->>'windLull')::double precision,
+    (telemetry_environment_metrics->>'weight')::double precision,
+    (telemetry_environment_metrics->>'radiation')::double precision,
+    (telemetry_environment_metrics->>'rainfall1h')::double precision,
+    (telemetry_environment_metrics->>'rainfall24h')::double precision,
+    (telemetry_environment_metrics->>'soilMoisture')::integer,
+    (telemetry_environment_metrics->>'soilTemperature')::double precision,
+    NULLIF((telemetry_environment_metrics::jsonb - ARRAY['temperature', 'relativeHumidity', 'barometricPressure', 'gasResistance', 'voltage', 'current', 'iaq', 'distance', 'lux', 'whiteLux', 'irLux', 'uvLux', 'windDirection', 'windSpeed', 'windGust', 'windLull', 'weight', 'radiation', 'rainfall1h', 'rainfall24h', 'soilMoisture', 'soilTemperature']), '{}'::jsonb)::json
+FROM rx_packets
+WHERE portnum = 'TELEMETRY_APP' AND telemetry_environment_metrics::text NOT IN ('{}', 'null');
+
+INSERT INTO rx_power_metrics (packet_id, ch1_voltage, ch1_current, ch2_voltage, ch2_current, ch3_voltage, ch3_current, ch4_voltage, ch4_current, ch5_voltage, ch5_current, ch6_voltage, ch6_current, ch7_voltage, ch7_current, ch8_voltage, ch8_current, extra)
+SELECT
+    id,
+    (telemetry_power_metrics->>'ch1Voltage')::double precision,
+    (telemetry_power_metrics->>'ch1Current')::double precision,
+    (telemetry_power_metrics->>'ch2Voltage')::double precision,
+    (telemetry_power_metrics->>'ch2Current')::double precision,
+    (telemetry_power_metrics->>'ch3Voltage')::double precision,
+    (telemetry_power_metrics->>'ch3Current')::double precision,
+    (telemetry_power_metrics->>'ch4Voltage')::double precision,
+    (telemetry_power_metrics->>'ch4Current')::double precision,
+    (telemetry_power_metrics->>'ch5Voltage')::double precision,
+    (telemetry_power_metrics->>'ch5Current')::double precision,
+    (telemetry_power_metrics->>'ch6Voltage')::double precision,
+    (telemetry_power_metrics->>'ch6Current')::double precision,
+    (telemetry_power_metrics->>'ch7Voltage')::double precision,
+    (telemetry_power_metrics->>'ch7Current')::double precision,
+    (telemetry_power_metrics->>'ch8Voltage')::double precision,
+    (telemetry_power_metrics->>'ch8Current')::double precision,
+    NULLIF((telemetry_power_metrics::jsonb - ARRAY['ch1Voltage', 'ch1Current', 'ch2Voltage', 'ch2Current', 'ch3Voltage', 'ch3Current', 'ch4Voltage', 'ch4Current', 'ch5Voltage', 'ch5Current', 'ch6Voltage', 'ch6Current', 'ch7Voltage', 'ch7Current', 'ch8Voltage', 'ch8Current']), '{}'::jsonb)::json
+FROM rx_packets
+WHERE portnum = 'TELEMETRY_APP' AND telemetry_power_metrics::text NOT IN ('{}', 'null');
+
+INSERT INTO rx_air_quality_metrics (packet_id, pm10_standard, pm25_standard, pm40_standard, pm100_standard, pm10_environmental, pm25_environmental, pm100_environmental, particles_03um, particles_05um, particles_10um, particles_25um, particles_40um, particles_50um, particles_100um, co2, co2_temperature, co2_humidity, extra)
+SELECT
+    id,
+    (telemetry_air_quality_metrics->>'pm10Standard')::integer,
+    (telemetry_air_quality_metrics->>'pm25Standard')::integer,
+    (telemetry_air_quality_metrics->>'pm40Standard')::integer,
+    (telemetry_air_quality_metrics->>'pm100Standard')::integer,
+    (telemetry_air_quality_metrics->>'pm10Environmental')::integer,
+    (telemetry_air_quality_metrics->>'pm25Environmental')::integer,
+    (telemetry_air_quality_metrics->>'pm100Environmental')::integer,
+    (telemetry_air_quality_metrics->>'particles03um')::integer,
+    (telemetry_air_quality_metrics->>'particles05um')::integer,
+    (telemetry_air_quality_metrics->>'particles10um')::integer,
+    (telemetry_air_quality_metrics->>'particles25um')::integer,
+    (telemetry_air_quality_metrics->>'particles40um')::integer,
+    (telemetry_air_quality_metrics->>'particles50um')::integer,
+    (telemetry_air_quality_metrics->>'particles100um')::integer,
+    (telemetry_air_quality_metrics->>'co2')::integer,
+    (telemetry_air_quality_metrics->>'co2Temperature')::double precision,
+    (telemetry_air_quality_metrics->>'co2Humidity')::double precision,
+    NULLIF((telemetry_air_quality_metrics::jsonb - ARRAY['pm10Standard', 'pm25Standard', 'pm40Standard', 'pm100Standard', 'pm10Environmental', 'pm25Environmental', 'pm100Environmental', 'particles03um', 'particles05um', 'particles10um', 'particles25um', 'particles40um', 'particles50um', 'particles100um', 'co2', 'co2Temperature', 'co2Humidity']), '{}'::jsonb)::json
+FROM rx_packets
+WHERE portnum = 'TELEMETRY_APP' AND telemetry_air_quality_metrics::text NOT IN ('{}', 'null');
+
+INSERT INTO rx_nodeinfo (packet_id, node_id, short_name, long_name, mac_address, hw_model, role, public_key)
+SELECT
+    id,
+    node_id,
+    node_short_name,
+    node_long_name,
+    mac_address,
+    hw_model,
+    NULL,
+    public_key
+FROM rx_packets
+WHERE portnum = 'NODEINFO_APP';
+
+INSERT INTO rx_routing (packet_id, request_id, error_reason)
+SELECT
+    id,
+    CAST(NULLIF(request_id, '') AS BIGINT),
+    error_reason
+FROM rx_packets
+WHERE portnum = 'ROUTING_APP';
+
+INSERT INTO rx_traceroutes (packet_id, route, snr_towards, route_back, snr_back)
+SELECT
+    id,
+    (traceroute_data->'route')::json,
+    (traceroute_data->'snrTowards')::json,
+    (traceroute_data->'routeBack')::json,
+    (traceroute_data->'snrBack')::json
+FROM rx_packets
+WHERE portnum = 'TRACEROUTE_APP';
+
+ALTER TABLE rx_packets
+    DROP COLUMN IF EXISTS telemetry_air_quality_metrics,
+    DROP COLUMN IF EXISTS telemetry_device_metrics,
+    DROP COLUMN IF EXISTS telemetry_environment_metrics,
+    DROP COLUMN IF EXISTS telemetry_power_metrics,
+    DROP COLUMN IF EXISTS has_air_quality_metrics,
+    DROP COLUMN IF EXISTS has_device_metrics,
+    DROP COLUMN IF EXISTS has_environment_metrics,
+    DROP COLUMN IF EXISTS has_power_metrics,
+    DROP COLUMN IF EXISTS has_position_data,
+    DROP COLUMN IF EXISTS altitude,
+    DROP COLUMN IF EXISTS latitude,
+    DROP COLUMN IF EXISTS "latitudeI",
+    DROP COLUMN IF EXISTS longitude,
+    DROP COLUMN IF EXISTS "longitudeI",
+    DROP COLUMN IF EXISTS pos_time,
+    DROP COLUMN IF EXISTS location_source,
+    DROP COLUMN IF EXISTS pdop,
+    DROP COLUMN IF EXISTS ground_speed,
+    DROP COLUMN IF EXISTS ground_track,
+    DROP COLUMN IF EXISTS sats_in_view,
+    DROP COLUMN IF EXISTS precision_bits,
+    DROP COLUMN IF EXISTS node_id,
+    DROP COLUMN IF EXISTS node_short_name,
+    DROP COLUMN IF EXISTS node_long_name,
+    DROP COLUMN IF EXISTS mac_address,
+    DROP COLUMN IF EXISTS hw_model,
+    DROP COLUMN IF EXISTS public_key,
+    DROP COLUMN IF EXISTS request_id,
+    DROP COLUMN IF EXISTS error_reason,
+    DROP COLUMN IF EXISTS traceroute_data;
+
+COMMIT;
+
+ANALYZE rx_packets;
+ANALYZE rx_positions;
+ANALYZE rx_device_metrics;
+ANALYZE rx_environment_metrics;
+ANALYZE rx_power_metrics;
+ANALYZE rx_air_quality_metrics;
+ANALYZE rx_nodeinfo;
+ANALYZE rx_routing;
+ANALYZE rx_traceroutes;
@@ -0,0 +1,310 @@
+-- Moves the port specific rx_packets columns to the side tables (rx_positions, rx_device_metrics, ...) and drops them (SQLite)
+-- Only needed for databases created by 0.1.26 or older. Without it the bot still works, but /nodeinfo and the
+-- telemetry rollups only see packets received after the update.
+-- Stop the bot first. Needs SQLite 3.35 or newer (ALTER TABLE DROP COLUMN):
+--   sqlite3 <db file> < from_0.1.26_sqlite.sql
+-- Run VACUUM afterwards to shrink the file.
+
+BEGIN;
+
+-- the side tables (the bot also creates them at startup)
+CREATE TABLE IF NOT EXISTS rx_positions (
+	latitude DOUBLE, 
+	longitude DOUBLE, 
+	latitude_i INTEGER, 
+	longitude_i INTEGER, 
+	altitude DOUBLE, 
+	pos_time BIGINT, 
+	location_source VARCHAR, 
+	pdop DOUBLE, 
+	ground_speed DOUBLE, 
+	ground_track DOUBLE, 
+	sats_in_view INTEGER, 
+	precision_bits INTEGER, 
+	packet_id BIGINT NOT NULL, 
+	PRIMARY KEY (packet_id)
+);
+
+CREATE TABLE IF NOT EXISTS rx_device_metrics (
+	battery_level DOUBLE, 
+	voltage DOUBLE, 
+	channel_utilization DOUBLE, 
+	air_util_tx DOUBLE, 
+	uptime_seconds BIGINT, 
+	extra JSON, 
+	packet_id BIGINT NOT NULL, 
+	PRIMARY KEY (packet_id)
+);
+
+CREATE TABLE IF NOT EXISTS rx_environment_metrics (
+	temperature DOUBLE, 
+	relative_humidity DOUBLE, 
+	barometric_pressure DOUBLE, 
+	gas_resistance DOUBLE, 
+	voltage DOUBLE, 
+	current DOUBLE, 
+	iaq INTEGER, 
+	distance DOUBLE, 
+	lux DOUBLE, 
+	white_lux DOUBLE, 
+	ir_lux DOUBLE, 
+	uv_lux DOUBLE, 
+	wind_direction INTEGER, 
+	wind_speed DOUBLE, 
+	wind_gust DOUBLE, 
+	wind_lull DOUBLE, 
+	weight DOUBLE, 
+	radiation DOUBLE, 
+	rainfall_1h DOUBLE, 
+	rainfall_24h DOUBLE, 
+	soil_moisture INTEGER, 
+	soil_temperature DOUBLE, 
+	extra JSON, 
+	packet_id BIGINT NOT NULL, 
+	PRIMARY KEY (packet_id)
+);
+
+CREATE TABLE IF NOT EXISTS rx_power_metrics (
+	ch1_voltage DOUBLE, 
+	ch1_current DOUBLE, 
+	ch2_voltage DOUBLE, 
+	ch2_current DOUBLE, 
+	ch3_voltage DOUBLE, 
+	ch3_current DOUBLE, 
+	ch4_voltage DOUBLE, 
+	ch4_current DOUBLE, 
+	ch5_voltage DOUBLE, 
+	ch5_current DOUBLE, 
+	ch6_voltage DOUBLE, 
+	ch6_current DOUBLE, 
+	ch7_voltage DOUBLE, 
+	ch7_current DOUBLE, 
+	ch8_voltage DOUBLE, 
+	ch8_current DOUBLE, 
+	extra JSON, 
+	packet_id BIGINT NOT NULL, 
+	PRIMARY KEY (packet_id)
+);
+
+CREATE TABLE IF NOT EXISTS rx_air_quality_metrics (
+	pm10_standard INTEGER, 
+	pm25_standard INTEGER, 
+	pm40_standard INTEGER, 
+	pm100_standard INTEGER, 
+	pm10_environmental INTEGER, 
+	pm25_environmental INTEGER, 
+	pm100_environmental INTEGER, 
+	particles_03um INTEGER, 
+	particles_05um INTEGER, 
+	particles_10um INTEGER, 
+	particles_25um INTEGER, 
+	particles_40um INTEGER, 
+	particles_50um INTEGER, 
+	particles_100um INTEGER, 
+	co2 INTEGER, 
+	co2_temperature DOUBLE, 
+	co2_humidity DOUBLE, 
+	extra JSON, 
+	packet_id BIGINT NOT NULL, 
+	PRIMARY KEY (packet_id)
+);
+
+CREATE TABLE IF NOT EXISTS rx_nodeinfo (
+	node_id VARCHAR, 
+	short_name VARCHAR, 
+	long_name VARCHAR, 
+	mac_address VARCHAR, 
+	hw_model VARCHAR, 
+	role VARCHAR, 
+	public_key VARCHAR, 
+	packet_id BIGINT NOT NULL, 
+	PRIMARY KEY (packet_id)
+);
+
+CREATE TABLE IF NOT EXISTS rx_routing (
+	request_id BIGINT, 
+	error_reason VARCHAR, 
+	packet_id BIGINT NOT NULL, 
+	PRIMARY KEY (packet_id)
+);
+
+CREATE TABLE IF NOT EXISTS rx_traceroutes (
+	route JSON, 
+	snr_towards JSON, 
+	route_back JSON, 
+	snr_back JSON, 
+	packet_id BIGINT NOT NULL, 
+	PRIMARY KEY (packet_id)
+);
+
+INSERT INTO rx_positions (packet_id, latitude, longitude, latitude_i, longitude_i, altitude, pos_time, location_source, pdop, ground_speed, ground_track, sats_in_view, precision_bits)
+SELECT
+    id,
+    latitude,
+    longitude,
+    "latitudeI",
+    "longitudeI",
+    altitude,
+    pos_time,
+    location_source,
+    pdop,
+    ground_speed,
+    ground_track,
+    sats_in_view,
+    precision_bits
+FROM rx_packets
+WHERE portnum = 'POSITION_APP';
+
+INSERT INTO rx_device_metrics (packet_id, battery_level, voltage, channel_utilization, air_util_tx, uptime_seconds, extra)
+SELECT
+    id,
+    json_extract(telemetry_device_metrics, '$.batteryLevel'),
+    json_extract(telemetry_device_metrics, '$.voltage'),
+    json_extract(telemetry_device_metrics, '$.channelUtilization'),
+    json_extract(telemetry_device_metrics, '$.airUtilTx'),
+    json_extract(telemetry_device_metrics, '$.uptimeSeconds'),
+    NULLIF(json_remove(telemetry_device_metrics, '$.batteryLevel', '$.voltage', '$.channelUtilization', '$.airUtilTx', '$.uptimeSeconds'), '{}')
+FROM rx_packets
+WHERE portnum = 'TELEMETRY_APP' AND telemetry_device_metrics NOT IN ('{}', 'null');
+
+INSERT INTO rx_environment_metrics (packet_id, temperature, relative_humidity, barometric_pressure, gas_resistance, voltage, current, iaq, distance, lux, white_lux, ir_lux, uv_lux, wind_direction, wind_speed, wind_gust, wind_lull, weight, radiation, rainfall_1h, rainfall_24h, soil_moisture, soil_temperature, extra)
+SELECT
+    id,
+    json_extract(telemetry_environment_metrics, '$.temperature'),
+    json_extract(telemetry_environment_metrics, '$.relativeHumidity'),
+    json_extract(telemetry_environment_metrics, '$.barometricPressure'),
+    json_extract(telemetry_environment_metrics, '$.gasResistance'),
+    json_extract(telemetry_environment_metrics, '$.voltage'),
+    json_extract(telemetry_environment_metrics, '$.current'),
+    json_extract(telemetry_environment_metrics, '$.iaq'),
+    json_extract(telemetry_environment_metrics, '$.distance'),
+    json_extract(telemetry_environment_metrics, '$.lux'),
+    json_extract(telemetry_environment_metrics, '$.whiteLux'),
+    json_extract(telemetry_environment_metrics, '$.irLux'),
+    json_extract(telemetry_environment_metrics, '$.uvLux'),
+    json_extract(telemetry_environment_metrics, '$.windDirection'),
+    json_extract(telemetry_environment_metrics, '$.windSpeed'),
+    json_extract(telemetry_environment_metrics, '$.windGust'),
+    json_extract(telemetry_environment_metrics, '$.windLull'),
+    json_extract(telemetry_environment_metrics, '$.weight'),
+    json_extract(telemetry_environment_metrics, '$.radiation'),
+    json_extract(telemetry_environment_metrics, '$.rainfall1h'),
+    json_extract(telemetry_environment_metrics, '$.rainfall24h'),
+    json_extract(telemetry_environment_metrics, '$.soilMoisture'),
+    json_extract(telemetry_environment_metrics, '$.soilTemperature'),
+    NULLIF(json_remove(telemetry_environment_metrics, '$.temperature', '$.relativeHumidity', '$.barometricPressure', '$.gasResistance', '$.voltage', '$.current', '$.iaq', '$.distance', '$.lux', '$.whiteLux', '$.irLux', '$.uvLux', '$.windDirection', '$.windSpeed', '$.windGust', '$.windLull', '$.weight', '$.radiation', '$.rainfall1h', '$.rainfall24h', '$.soilMoisture', '$.soilTemperature'), '{}')
+FROM rx_packets
+WHERE portnum = 'TELEMETRY_APP' AND telemetry_environment_metrics NOT IN ('{}', 'null');
+
+INSERT INTO rx_power_metrics (packet_id, ch1_voltage, ch1_current, ch2_voltage, ch2_current, ch3_voltage, ch3_current, ch4_voltage, ch4_current, ch5_voltage, ch5_current, ch6_voltage, ch6_current, ch7_voltage, ch7_current, ch8_voltage, ch8_current, extra)
+SELECT
+    id,
+    json_extract(telemetry_power_metrics, '$.ch1Voltage'),
+    json_extract(telemetry_power_metrics, '$.ch1Current'),
+    json_extract(telemetry_power_metrics, '$.ch2Voltage'),
+    json_extract(telemetry_power_metrics, '$.ch2Current'),
+    json_extract(telemetry_power_metrics, '$.ch3Voltage'),
+    json_extract(telemetry_power_metrics, '$.ch3Current'),
+    json_extract(telemetry_power_metrics, '$.ch4Voltage'),
+    json_extract(telemetry_power_metrics, '$.ch4Current'),
+    json_extract(telemetry_power_metrics, '$.ch5Voltage'),
+    json_extract(telemetry_power_metrics, '$.ch5Current'),
+    json_extract(telemetry_power_metrics, '$.ch6Voltage'),
+    json_extract(telemetry_power_metrics, '$.ch6Current'),
+    json_extract(telemetry_power_metrics, '$.ch7Voltage'),
+    json_extract(telemetry_power_metrics, '$.ch7Current'),
+    json_extract(telemetry_power_metrics, '$.ch8Voltage'),
+    json_extract(telemetry_power_metrics, '$.ch8Current'),
+    NULLIF(json_remove(telemetry_power_metrics, '$.ch1Voltage', '$.ch1Current', '$.ch2Voltage', '$.ch2Current', '$.ch3Voltage', '$.ch3Current', '$.ch4Voltage', '$.ch4Current', '$.ch5Voltage', '$.ch5Current', '$.ch6Voltage', '$.ch6Current', '$.ch7Voltage', '$.ch7Current', '$.ch8Voltage', '$.ch8Current'), '{}')
+FROM rx_packets
+WHERE portnum = 'TELEMETRY_APP' AND telemetry_power_metrics NOT IN ('{}', 'null');
+
+INSERT INTO rx_air_quality_metrics (packet_id, pm10_standard, pm25_standard, pm40_standard, pm100_standard, pm10_environmental, pm25_environmental, pm100_environmental, particles_03um, particles_05um, particles_10um, particles_25um, particles_40um, particles_50um, particles_100um, co2, co2_temperature, co2_humidity, extra)
+SELECT
+    id,
+    json_extract(telemetry_air_quality_metrics, '$.pm10Standard'),
+    json_extract(telemetry_air_quality_metrics, '$.pm25Standard'),
+    json_extract(telemetry_air_quality_metrics, '$.pm40Standard'),
+    json_extract(telemetry_air_quality_metrics, '$.pm100Standard'),
+    json_extract(telemetry_air_quality_metrics, '$.pm10Environmental'),
+    json_extract(telemetry_air_quality_metrics, '$.pm25Environmental'),
+    json_extract(telemetry_air_quality_metrics, '$.pm100Environmental'),
+    json_extract(telemetry_air_quality_metrics, '$.particles03um'),
+    json_extract(telemetry_air_quality_metrics, '$.particles05um'),
+    json_extract(telemetry_air_quality_metrics, '$.particles10um'),
+    json_extract(telemetry_air_quality_metrics, '$.particles25um'),
+    json_extract(telemetry_air_quality_metrics, '$.particles40um'),
+    json_extract(telemetry_air_quality_metrics, '$.particles50um'),
+    json_extract(telemetry_air_quality_metrics, '$.particles100um'),
+    json_extract(telemetry_air_quality_metrics, '$.co2'),
+    json_extract(telemetry_air_quality_metrics, '$.co2Temperature'),
+    json_extract(telemetry_air_quality_metrics, '$.co2Humidity'),
+    NULLIF(json_remove(telemetry_air_quality_metrics, '$.pm10Standard', '$.pm25Standard', '$.pm40Standard', '$.pm100Standard', '$.pm10Environmental', '$.pm25Environmental', '$.pm100Environmental', '$.particles03um', '$.particles05um', '$.particles10um', '$.particles25um', '$.particles40um', '$.particles50um', '$.particles100um', '$.co2', '$.co2Temperature', '$.co2Humidity'), '{}')
+FROM rx_packets
+WHERE portnum = 'TELEMETRY_APP' AND telemetry_air_quality_metrics NOT IN ('{}', 'null');
+
+INSERT INTO rx_nodeinfo (packet_id, node_id, short_name, long_name, mac_address, hw_model, role, public_key)
+SELECT
+    id,
+    node_id,
+    node_short_name,
+    node_long_name,
+    mac_address,
+    hw_model,
+    NULL,
+    public_key
+FROM rx_packets
+WHERE portnum = 'NODEINFO_APP';
+
+INSERT INTO rx_routing (packet_id, request_id, error_reason)
+SELECT
+    id,
+    CAST(request_id AS INTEGER),
+    error_reason
+FROM rx_packets
+WHERE portnum = 'ROUTING_APP';
+
+INSERT INTO rx_traceroutes (packet_id, route, snr_towards, route_back, snr_back)
+SELECT
+    id,
+    json_extract(traceroute_data, '$.route'),
+    json_extract(traceroute_data, '$.snrTowards'),
+    json_extract(traceroute_data, '$.routeBack'),
+    json_extract(traceroute_data, '$.snrBack')
+FROM rx_packets
+WHERE portnum = 'TRACEROUTE_APP';
+
+ALTER TABLE rx_packets DROP COLUMN telemetry_air_quality_metrics;
+ALTER TABLE rx_packets DROP COLUMN telemetry_device_metrics;
+ALTER TABLE rx_packets DROP COLUMN telemetry_environment_metrics;
+ALTER TABLE rx_packets DROP COLUMN telemetry_power_metrics;
+ALTER TABLE rx_packets DROP COLUMN has_air_quality_metrics;
+ALTER TABLE rx_packets DROP COLUMN has_device_metrics;
+ALTER TABLE rx_packets DROP COLUMN has_environment_metrics;
+ALTER TABLE rx_packets DROP COLUMN has_power_metrics;
+ALTER TABLE rx_packets DROP COLUMN has_position_data;
+ALTER TABLE rx_packets DROP COLUMN altitude;
+ALTER TABLE rx_packets DROP COLUMN latitude;
+ALTER TABLE rx_packets DROP COLUMN "latitudeI";
+ALTER TABLE rx_packets DROP COLUMN longitude;
+ALTER TABLE rx_packets DROP COLUMN "longitudeI";
+ALTER TABLE rx_packets DROP COLUMN pos_time;
+ALTER TABLE rx_packets DROP COLUMN location_source;
+ALTER TABLE rx_packets DROP COLUMN pdop;
+ALTER TABLE rx_packets DROP COLUMN ground_speed;
+ALTER TABLE rx_packets DROP COLUMN ground_track;
+ALTER TABLE rx_packets DROP COLUMN sats_in_view;
+ALTER TABLE rx_packets DROP COLUMN precision_bits;
+ALTER TABLE rx_packets DROP COLUMN node_id;
+ALTER TABLE rx_packets DROP COLUMN node_short_name;
+ALTER TABLE rx_packets DROP COLUMN node_long_name;
+ALTER TABLE rx_packets DROP COLUMN mac_address;
+ALTER TABLE rx_packets DROP COLUMN hw_model;
+ALTER TABLE rx_packets DROP COLUMN public_key;
+ALTER TABLE rx_packets DROP COLUMN request_id;
+ALTER TABLE rx_packets DROP COLUMN error_reason;
+ALTER TABLE rx_packets DROP COLUMN traceroute_data;
+
+COMMIT;
+
+ANALYZE;